@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from sketches import SKETCH_COLUMNS, sketch_counts
+from store import COUNT_COLUMNS
+
+# Size of one cube cell along the time axis
+BUCKET_FREQ = 'h'
+
+# Columns summed into every cell: all counts, so that any derived metric can
+# be evaluated per bucket (see derived.py), and `rows`, the number of records
+# behind a cell
+SUM_COLUMNS = COUNT_COLUMNS + ['rows']
+LABEL_COLUMNS = ['hour', 'day_of_week']
+ROW_AGG = {**{col: 'first' for col in LABEL_COLUMNS}, **{col: 'sum' for col in SUM_COLUMNS}}
+# Cells also hold the quantile sketches' bin counts (see sketches.py),
+# which merge by summing like the other counts
+CELL_AGG = {**ROW_AGG, **{col: 'sum' for col in SKETCH_COLUMNS}}
+SKETCH_DTYPE = np.int32
+
+
+def bucket_bound(end):
+    # Start of the first bucket not wholly inside a window ending at end
+    # (inclusive)
+    return (pd.Timestamp(end) + pd.Timedelta(1, 'ns')).floor(BUCKET_FREQ)
+
+
+def _aggregate_cells(rows):
+    # Collapse raw records into one row per time bucket
+    buckets = rows['timestamp'].dt.floor(BUCKET_FREQ)
+    # Stored counts use narrow dtypes; groupby sums them into int64, so no
+    # widened copy of the rows is needed
+    grouped = rows[LABEL_COLUMNS + COUNT_COLUMNS].assign(rows=np.int8(1)).groupby(buckets.rename('bucket'), sort=True)
+    cells = grouped.agg(ROW_AGG)
+    sketches = sketch_counts(rows, grouped.ngroup().to_numpy(), len(cells)).astype(SKETCH_DTYPE)
+    return pd.concat([cells, pd.DataFrame(sketches, index=cells.index, columns=SKETCH_COLUMNS)], axis=1)
+
+
+class AggregateCube:
+    # Pre-aggregated sums and counts per (time bucket, hour, day_of_week).
+    # Each hourly bucket falls in exactly one hour and day, so the cube is
+    # stored as one row per bucket, sorted by bucket start.
+
+    def __init__(self, rows, cells=None):
+        # cells: the result of aggregating these rows, when already known
+        self.cells = _aggregate_cells(rows) if cells is None else cells
+
+    def merged(self, rows):
+        # Cells with new records merged in, leaving the cube as it is; only
+        # the cells at or after the first new bucket are touched, so
+        # appending recent data stays cheap
+        if len(rows) == 0:
+            return self.cells
+        new_cells = _aggregate_cells(rows)
+        split = self.cells.index.searchsorted(new_cells.index[0])
+        head, tail = self.cells.iloc[:split], self.cells.iloc[split:]
+        if len(tail):
+            merged = pd.concat([tail, new_cells])
+            tail = merged.groupby(level=0, sort=True).agg(CELL_AGG)
+        else:
+            tail = new_cells
+        return pd.concat([head, tail])
+
+    def window(self, start=None, end=None):
+        # Cells whose whole bucket lies inside [start, end]: the start is
+        # rounded up and the end (just past it, as it is inclusive) down to
+        # the cube's resolution, so a partial bucket at either edge is left
+        # out rather than counting records outside the window
+        index = self.cells.index
+        first = 0 if start is None else index.searchsorted(pd.Timestamp(start).ceil(BUCKET_FREQ))
+        last = len(index) if end is None else index.searchsorted(bucket_bound(end))
+        return self.cells.iloc[first:last]
+
+    def sums(self, column, start=None, end=None, columns=SUM_COLUMNS):
+        # Summed cells (of the given columns) per hour or day_of_week; sums
+        # from several cubes can be added together before the metrics are
+        # evaluated
+        return self.window(start, end).groupby(column, sort=True, observed=True)[columns].sum()
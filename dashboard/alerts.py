@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from derived import evaluate, metric_columns
+from sites import ALL_SITES
+from store import SITE_COLUMN
+
+# Standing alert rules, evaluated as records are ingested rather than when
+# the dashboard renders. Each site (and all sites together) keeps an
+# exponentially weighted moving sum of the count columns the rules' metrics
+# are derived from, decayed by record time with a half-life of
+# ALERT_HALF_LIFE_MINUTES: a fixed amount of state however many records
+# arrive. A rule fires when its metric crosses the threshold and stays
+# active until it crosses back; fired alerts go into a ring buffer of the
+# last ALERT_HISTORY, which is all the UI reads.
+ALERT_HALF_LIFE_MINUTES = float(os.environ.get('ALERT_HALF_LIFE_MINUTES', 60))
+ALERT_HISTORY = int(os.environ.get('ALERT_HISTORY', 50))
+# Rules are not evaluated on less evidence than this many (decayed)
+# detections, so a site's first few detections do not fire them
+ALERT_MIN_DETECTIONS = float(os.environ.get('ALERT_MIN_DETECTIONS', 20))
+# History older than this many half-lives weighs less than 0.1%; the
+# state can be started from just that much
+WARMUP_HALF_LIVES = 10
+
+# Rule: metric (see derived.py) below ('<') or above ('>') the threshold
+AlertRule = namedtuple('AlertRule', ['metric', 'comparison', 'threshold', 'message'])
+
+ALERT_RULES = {
+    'low_helmet_compliance': AlertRule('helmet_compliance_rate', '<', 50, "🚨 Low helmet compliance detected!"),
+    'high_child_ratio': AlertRule('child_passenger_ratio', '>', 15, "👶 High child passenger ratio observed"),
+    'low_safety_score': AlertRule('safety_score', '<', 60, "⚠️ Safety score below threshold")
+}
+
+
+class AlertEngine:
+    # Rolling per-site state, the active rules and the fired-alert buffer.
+    # Every worker feeds it the same records in the same order, so they all
+    # hold the same alerts.
+
+    def __init__(self, rules=ALERT_RULES, half_life=pd.Timedelta(minutes=ALERT_HALF_LIFE_MINUTES),
+                 history=ALERT_HISTORY, min_detections=ALERT_MIN_DETECTIONS):
+        self.rules = rules
+        self.metrics = tuple(sorted({rule.metric for rule in rules.values()}))
+        self.columns = metric_columns(self.metrics)
+        self.half_life = half_life.value
+        self.warmup = WARMUP_HALF_LIVES * half_life
+        self.min_detections = min_detections
+        # Site -> (decayed sums of self.columns, time they are decayed to in ns)
+        self._state = {}
+        # (rule name, site) -> the alert that fired, while the rule holds
+        self._active = {}
+        self._fired = deque(maxlen=history)
+        # Bumped whenever the active set or the buffer changes
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def update(self, frame):
+        # Fold records (rows in the data.csv layout) into the rolling state
+        # and evaluate the rules for the sites they touched
+        if frame.empty:
+            return
+        timestamps = frame['timestamp'].to_numpy('datetime64[ns]').astype(np.int64)
+        counts = frame[self.columns].to_numpy(np.float64)
+        sites = frame[SITE_COLUMN].to_numpy() if SITE_COLUMN in frame else np.zeros(len(frame), dtype=np.int64)
+        with self._lock:
+            self._fold(ALL_SITES, timestamps, counts)
+            for site in np.unique(sites):
+                selected = sites == site
+                self._fold(int(site), timestamps[selected], counts[selected])
+            self._evaluate([ALL_SITES] + [int(site) for site in np.unique(sites)])
+
+    def _fold(self, site, timestamps, counts):
+        # Decay the state and the new records to the latest time seen; late
+        # records simply carry less weight
+        sums, time = self._state.get(site, (np.zeros(len(self.columns)), None))
+        latest = int(timestamps.max()) if time is None else max(time, int(timestamps.max()))
+        if time is not None:
+            sums = sums * 0.5 ** ((latest - time) / self.half_life)
+        weights = 0.5 ** ((latest - timestamps) / self.half_life)
+        self._state[site] = (sums + weights @ counts, latest)
+
+    def _evaluate(self, sites):
+        for site in sites:
+            sums, time = self._state[site]
+            if sums[self.columns.index('total_detections')] < self.min_detections:
+                continue
+            values = dict(zip(self.metrics, evaluate([sums], self.metrics)[0]))
+            for name, rule in self.rules.items():
+                value = values[rule.metric]
+                breached = value < rule.threshold if rule.comparison == '<' else value > rule.threshold
+                key = (name, site)
+                if breached and key not in self._active:
+                    alert = {'rule': name, 'site': site, 'message': rule.message, 'value': float(value),
+                             'timestamp': pd.Timestamp(time)}
+                    self._active[key] = alert
+                    self._fired.append(alert)
+                    self.version += 1
+                elif not breached and key in self._active:
+                    del self._active[key]
+                    self.version += 1
+
+    def active(self, site=ALL_SITES):
+        # Alerts currently holding for the site (ALL_SITES: for all sites
+        # together), oldest first
+        with self._lock:
+            return [alert for alert in self._active.values() if alert['site'] == site]
+
+    def recent(self, site=ALL_SITES, limit=None):
+        # The site's fired alerts from the buffer, newest first
+        with self._lock:
+            alerts = [alert for alert in reversed(self._fired) if alert['site'] == site]
+        return alerts[:limit]
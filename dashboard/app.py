@@ -1,30 +1,130 @@
 import dash
-from dash import dcc, html, Input, Output, callback
+from dash import dcc, html, Input, Output, State, Patch, ALL, ClientsideFunction, callback, clientside_callback
 import plotly.graph_objects as go
-import plotly.express as px
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import base64
-import io
-from PIL import Image
 
 import os
+import time
 
-# Load pre-generated data
-DATA_PATH = os.path.join(os.path.dirname(__file__), 'data.csv')
-df = pd.read_csv(DATA_PATH, parse_dates=["timestamp"])
+import queries
+
+from alerts import AlertEngine
+from background import background_callback, ignore_progress, make_background_manager
+from cache import ResultCache
+from compact import epoch_ms
+from compression import register_compression
+from downsample import DEFAULT_POINTS, MINMAX_RATIO, downsample_indices
+from frames import frame_src, recent_frames, register_frame_routes
+from ingest import records_to_frame, register_ingest_routes
+from metrics import PROFILE_PATH, Metrics, SamplingProfiler, register_metrics_routes
+from queries import AXIS_COLUMNS, make_alert_tailer, make_log_tailer, open_detections
+from sites import ALL_SITES
+from snapshot import cells_to_json, load_snapshot
+
+# Per-stage timings and callback counters, served on /metrics
+metrics = Metrics()
+
+# Load pre-generated data (the columnar store from convert_data.py if present)
+# into per-site partitions with prefix sums and aggregate cubes, or open the
+# SQLite database with DETECTION_BACKEND=sqlite (see queries.py, shared with
+# the Streamlit dashboard). Rates are derived from summed counts when a view
+# needs them (derived.py), not stored per record.
+DATA_PATH = os.environ.get('DETECTION_DATA_PATH', os.path.join(os.path.dirname(__file__), 'data.csv'))
+STORE_PATH = os.environ.get('DETECTION_STORE_PATH', os.path.join(os.path.dirname(__file__), 'data_store'))
+with metrics.span('load'):
+    detections, DATA_SOURCE_ID = open_detections(STORE_PATH, DATA_PATH)
+
+# Alert rules with rolling per-site state (alerts.py), started from the most
+# recent history and then fed every ingested record; the alerts panel only
+# reads what they have fired
+alert_engine = AlertEngine()
+if len(detections):
+    with metrics.span('alerts'):
+        alert_engine.update(detections.window(detections.max_timestamp - alert_engine.warmup))
 
 port = int(os.environ.get("PORT", 8050))
 
-# Calculate metrics
-df['helmet_compliance_rate'] = (df['helmet_compliance'] / df['total_detections'] * 100).round(1)
-df['child_passenger_ratio'] = (df['child_passengers'] / df['total_detections'] * 100).round(1)
-df['mirror_coverage_rate'] = ((df['left_mirror'] + df['right_mirror'] + df['both_mirrors']) / df['total_detections'] * 100).round(1)
-df['safety_score'] = (df['helmet_compliance_rate'] * 0.6 + df['mirror_coverage_rate'] * 0.4).round(1)
+# How often the browser polls for newly ingested data (0 disables live mode)
+LIVE_INTERVAL_MS = int(os.environ.get("LIVE_INTERVAL_MS", 5000))
+
+# Live ingest: new records are appended to their site's store and folded
+# into its cube incrementally (or inserted into the database), without
+# reloading anything
+@metrics.timed('ingest')
+def ingest_records(records):
+    frame = records_to_frame(records)
+    previous_version = get_cache_version()
+    appended = detections.append(frame)
+    # The records are stored now; an error past here must not make the log
+    # tailer apply them a second time
+    try:
+        if alert_tailer is None:
+            alert_engine.update(frame)
+        result_cache.invalidate(previous_version)
+    except Exception as e:
+        print(f"Error updating alerts and cache after ingest: {e}")
+    return appended
+
+# Data version as seen by the browser. Every worker applies the same log in
+# the same order (or reads the one database), so row counts agree between
+# workers.
+# 'since' holds the version the browser had before, for sending deltas.
+def get_data_version():
+    return {'rows': len(detections), 'rebuilds': detections.rebuilds, 'since': None}
+
+# Version that cached results are keyed on: the loaded dataset plus
+# everything ingested into it since
+def get_cache_version():
+    return f"{DATA_SOURCE_ID}:{len(detections)}:{detections.rebuilds}"
+
+# Figures and aggregates shared across users and worker processes
+result_cache = ResultCache(get_cache_version, metrics=metrics)
+
+def get_cache_hit_ratio():
+    hits = metrics.counters[('dashboard_cache_requests_total', (('result', 'hit'),))]
+    misses = metrics.counters[('dashboard_cache_requests_total', (('result', 'miss'),))]
+    return {(): hits / max(1, hits + misses)}
 
-# Initialize the Dash app
-app = dash.Dash(__name__)
+metrics.collect('dashboard_cache_hit_ratio', 'gauge', "Share of result cache lookups served from the cache",
+                get_cache_hit_ratio)
+metrics.collect('dashboard_rows', 'gauge', "Detection records loaded",
+                lambda: {(): len(detections)})
+metrics.collect('dashboard_sites', 'gauge', "Sites with detections",
+                lambda: {(): len(detections.sites)})
+metrics.collect('dashboard_active_alerts', 'gauge', "Alert rules currently firing for all sites",
+                lambda: {(): len(alert_engine.active())})
+
+# Initialize the Dash app; time range updates over many records run as
+# background jobs when a job manager is available (see background.py)
+background_manager = make_background_manager(metrics=metrics)
+app = dash.Dash(__name__, background_callback_manager=background_manager)
+server = app.server  # WSGI callable; see wsgi.py
+
+# Serve frame renditions as cacheable JPEGs instead of inlining them
+register_frame_routes(app.server)
+
+# Accept detections over HTTP and follow the shared detection log
+register_ingest_routes(app.server)
+
+register_metrics_routes(app.server, metrics, app.config.routes_pathname_prefix + '_dash-update-component')
+
+# gzip/brotli for callback responses, the layout and the JS/CSS bundles.
+# Registered after the metrics hooks so those see the compressed size.
+register_compression(app.server, static_prefixes=[app.config.routes_pathname_prefix + '_dash-component-suites/',
+                                                  app.config.routes_pathname_prefix + 'assets/'])
+log_tailer = make_log_tailer(detections, ingest_records)
+alert_tailer = make_alert_tailer(detections, lambda records: alert_engine.update(records_to_frame(records)))
+
+# Threads every serving process needs. They are not started on import: under
+# gunicorn the data is loaded once in the master and workers are forked from
+# it, and threads do not survive a fork. gunicorn.conf.py starts them in each
+# worker; running app.py directly starts them below.
+def start_worker_threads():
+    log_tailer.start()
+    if alert_tailer is not None:
+        alert_tailer.start()
+    if PROFILE_PATH:
+        SamplingProfiler(PROFILE_PATH).start()
 
 # Define custom CSS styles
 custom_styles = {
@@ -70,270 +170,358 @@ custom_styles = {
     }
 }
 
-# Define the layout
-app.layout = html.Div([
-    # Header with gradient background
-    html.Div([
+# Progress bar under the time range buttons
+PROGRESS_STYLE = {'width': '100%', 'height': '6px', 'marginTop': '10px', 'accentColor': '#00ff88'}
+
+# Progress is reported after each of the stages of update_time_range_outputs()
+UPDATE_STAGES = 4
+
+# The page layout; serve_layout() fills in a fresh copy for every page load
+def build_layout():
+    return html.Div([
+        # Header with gradient background
         html.Div([
-            html.H1("🏍️ MOTORCYCLE SAFETY INSIGHTS", 
-                    style={'textAlign': 'center', 'color': '#ffffff', 'fontWeight': 'bold', 
-                           'fontSize': '32px', 'margin': '0', 'textShadow': '0 2px 10px rgba(0,0,0,0.5)'}),
-            html.P("Real-time traffic monitoring and safety analytics", 
-                   style={'textAlign': 'center', 'color': '#e2e8f0', 'fontSize': '16px', 'margin': '10px 0 0 0'})
-        ], style={'padding': '30px'})
-    ], style={'background': 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)', 
-              'boxShadow': '0 5px 20px rgba(0,0,0,0.3)'}),
+            html.Div([
+                html.H1("🏍️ MOTORCYCLE SAFETY INSIGHTS", 
+                        style={'textAlign': 'center', 'color': '#ffffff', 'fontWeight': 'bold', 
+                               'fontSize': '32px', 'margin': '0', 'textShadow': '0 2px 10px rgba(0,0,0,0.5)'}),
+                html.P("Real-time traffic monitoring and safety analytics", 
+                       style={'textAlign': 'center', 'color': '#e2e8f0', 'fontSize': '16px', 'margin': '10px 0 0 0'})
+            ], style={'padding': '30px'})
+        ], style={'background': 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)', 
+                  'boxShadow': '0 5px 20px rgba(0,0,0,0.3)'}),
     
-    # Main container
-    html.Div([
-        # Top row - Enhanced key metrics with icons (evenly distributed)
+        # Main container
         html.Div([
-            # Helmet compliance rate
+            # Top row - Enhanced key metrics with icons (evenly distributed)
             html.Div([
+                # Helmet compliance rate
                 html.Div([
-                    html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
-                    html.H3("HELMET COMPLIANCE", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
-                    html.Div(id='helmet-compliance-metric', style={'color': '#00ff88', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(0,255,136,0.5)'}),
-                    html.Div(id='helmet-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
-                ], style={'textAlign': 'center'})
-            ], style=custom_styles['metric_card']),
+                    html.Div([
+                        html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
+                        html.H3("HELMET COMPLIANCE", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
+                        html.Div(id='helmet-compliance-metric', style={'color': '#00ff88', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(0,255,136,0.5)'}),
+                        html.Div(id='helmet-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
+                    ], style={'textAlign': 'center'})
+                ], style=custom_styles['metric_card']),
             
-            # Total detections
-            html.Div([
+                # Total detections
                 html.Div([
-                    html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
-                    html.H3("TOTAL DETECTIONS", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
-                    html.Div(id='total-detections-metric', style={'color': '#00b4ff', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(0,180,255,0.5)'}),
-                    html.Div(id='detection-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
-                ], style={'textAlign': 'center'})
-            ], style=custom_styles['metric_card']),
+                    html.Div([
+                        html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
+                        html.H3("TOTAL DETECTIONS", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
+                        html.Div(id='total-detections-metric', style={'color': '#00b4ff', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(0,180,255,0.5)'}),
+                        html.Div(id='detection-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
+                    ], style={'textAlign': 'center'})
+                ], style=custom_styles['metric_card']),
             
-            # Child passenger ratio
-            html.Div([
+                # Child passenger ratio
                 html.Div([
-                    html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
-                    html.H3("CHILD PASSENGER RATIO", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
-                    html.Div(id='child-ratio-metric', style={'color': '#ffb800', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(255,184,0,0.5)'}),
-                    html.Div(id='child-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
-                ], style={'textAlign': 'center'})
-            ], style=custom_styles['metric_card']),
+                    html.Div([
+                        html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
+                        html.H3("CHILD PASSENGER RATIO", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
+                        html.Div(id='child-ratio-metric', style={'color': '#ffb800', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(255,184,0,0.5)'}),
+                        html.Div(id='child-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
+                    ], style={'textAlign': 'center'})
+                ], style=custom_styles['metric_card']),
             
-            # Safety score
-            html.Div([
+                # Safety score
                 html.Div([
-                    html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
-                    html.H3("SAFETY SCORE", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
-                    html.Div(id='safety-score-metric', style={'color': '#ff6b6b', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(255,107,107,0.5)'}),
-                    html.Div(id='safety-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
-                ], style={'textAlign': 'center'})
-            ], style=custom_styles['metric_card']),
-        ], style={'display': 'flex', 'gap': '10px', 'marginBottom': '20px'}),
+                    html.Div([
+                        html.Div(" ", style={'fontSize': '40px', 'marginBottom': '10px'}),
+                        html.H3("SAFETY SCORE", style={'color': '#ffffff', 'fontSize': '14px', 'textAlign': 'center', 'marginBottom': '5px', 'fontWeight': '600'}),
+                        html.Div(id='safety-score-metric', style={'color': '#ff6b6b', 'fontSize': '42px', 'fontWeight': 'bold', 'textAlign': 'center', 'textShadow': '0 0 20px rgba(255,107,107,0.5)'}),
+                        html.Div(id='safety-trend', style={'color': '#a0aec0', 'fontSize': '12px', 'textAlign': 'center', 'marginTop': '5px'})
+                    ], style={'textAlign': 'center'})
+                ], style=custom_styles['metric_card']),
+            ], style={'display': 'flex', 'gap': '10px', 'marginBottom': '20px'}),
         
-        # Control panel
-        html.Div([
+            # Control panel
             html.Div([
-                html.H3("📅 TIME RANGE SELECTOR", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
                 html.Div([
-                    html.Button("Last 24 Hours", id='btn-24h', className='time-btn', 
-                               style={'margin': '5px', 'padding': '10px 20px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'}),
-                    html.Button("Last Week", id='btn-week', className='time-btn',
-                               style={'margin': '5px', 'padding': '10px 20px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'}),
-                    html.Button("All Time", id='btn-all', className='time-btn',
-                               style={'margin': '5px', 'padding': '10px 20px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'})
-                ], style={'marginTop': '15px'})
-            ], style=custom_styles['chart_card'])
-        ], style={'marginBottom': '20px'}),
+                    html.H3("📅 TIME RANGE SELECTOR", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                    html.Div([
+                        html.Button("Last 24 Hours", id='btn-24h', className='time-btn', 
+                                   style={'margin': '5px', 'padding': '10px 20px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'}),
+                        html.Button("Last Week", id='btn-week', className='time-btn',
+                                   style={'margin': '5px', 'padding': '10px 20px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'}),
+                        html.Button("All Time", id='btn-all', className='time-btn',
+                                   style={'margin': '5px', 'padding': '10px 20px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'})
+                    ], style={'marginTop': '15px'}),
+                    # Shown while a background update runs
+                    html.Progress(id='update-progress', value=0, max=UPDATE_STAGES, style={**PROGRESS_STYLE, 'visibility': 'hidden'})
+                ], style={**custom_styles['chart_card'], 'flex': '2'}),
+            
+                # Site selector (options filled in per page load)
+                html.Div([
+                    html.H3("📍 SITE", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                    dcc.Dropdown(
+                        id='site-dropdown',
+                        value=ALL_SITES,
+                        clearable=False,
+                        style={'color': '#000', 'fontSize': '14px', 'marginTop': '15px'}
+                    )
+                ], style={**custom_styles['chart_card'], 'flex': '1'})
+            ], style={'display': 'flex', 'flexWrap': 'wrap', 'marginBottom': '20px'}),
         
-        # Middle row - Image and status
-        html.Div([
-            # Latest detected frame with your image
+            # Middle row - Image and status
             html.Div([
-                html.H3("LATEST DETECTED FRAME", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                # Latest detected frame with your image
                 html.Div([
-                    html.Img(
-                        id='latest-frame',
-                        src='data:image/png;base64,',  # Will be updated with actual image
-                        style={
-                            'width': '100%',
-                            'height': 'auto',
-                            'maxHeight': '400px',
-                            'objectFit': 'contain',
-                            'borderRadius': '15px',
-                            'border': '2px solid rgba(255,255,255,0.1)'
-                        }
-                    )
-                ], style={'textAlign': 'center'})
-            ], style={**custom_styles['image_frame'], 'flex': '2'}),
+                    html.H3("LATEST DETECTED FRAME", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                    html.Div([
+                        html.Img(
+                            id='latest-frame',
+                            src="",  # Served by the /frames routes
+                            style={
+                                'width': '100%',
+                                'height': 'auto',
+                                'maxHeight': '400px',
+                                'objectFit': 'contain',
+                                'borderRadius': '15px',
+                                'border': '2px solid rgba(255,255,255,0.1)'
+                            }
+                        )
+                    ], style={'textAlign': 'center'}),
+                    # Thumbnails of the recent frames; clicking one shows it
+                    # instead of the latest until LIVE is clicked
+                    html.Div([
+                        html.Button("LIVE", id='frame-live',
+                                   style={'padding': '6px 14px', 'backgroundColor': '#4299e1', 'color': 'white', 'border': 'none', 'borderRadius': '10px', 'cursor': 'pointer'}),
+                        html.Div(id='frame-history', className='frame-history')
+                    ], className='frame-strip')
+                ], style={**custom_styles['image_frame'], 'flex': '2'}),
             
-            # Quick stats and alerts
-            html.Div([
-                # Mirror status
+                # Quick stats and alerts
                 html.Div([
-                    html.H3("MIRROR STATUS", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
-                    dcc.Graph(id='mirror-status-chart', style={'height': '280px'})
-                ], style={**custom_styles['chart_card'], 'marginBottom': '15px'}),
+                    # Mirror status
+                    html.Div([
+                        html.H3("MIRROR STATUS", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                        dcc.Graph(id='mirror-status-chart', style={'height': '280px'})
+                    ], style={**custom_styles['chart_card'], 'marginBottom': '15px'}),
                 
-                # Live alerts
-                html.Div([
-                    html.H3("LIVE ALERTS", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
-                    html.Div(id='live-alerts', style={'color': '#e2e8f0', 'fontSize': '14px'})
-                ], style=custom_styles['chart_card'])
-            ], style={'flex': '1', 'margin': '10px'})
-        ], style={'display': 'flex', 'flexWrap': 'wrap', 'marginBottom': '20px'}),
+                    # Live alerts
+                    html.Div([
+                        html.H3("LIVE ALERTS", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                        html.Div(id='live-alerts', style={'color': '#e2e8f0', 'fontSize': '14px'})
+                    ], style=custom_styles['chart_card'])
+                ], style={'flex': '1', 'margin': '10px'})
+            ], style={'display': 'flex', 'flexWrap': 'wrap', 'marginBottom': '20px'}),
         
-        # Bottom row - Enhanced charts
-        html.Div([
-            # Helmet compliance heatmap by hour and day with dropdown
+            # Bottom row - Enhanced charts
             html.Div([
+                # Helmet compliance heatmap by hour and day with dropdown
                 html.Div([
-                    html.H3("HELMET COMPLIANCE vs. NON-COMPLIANCE", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600', 'display': 'inline-block'}),
                     html.Div([
-                        dcc.Dropdown(
-                            id='heatmap-axis-dropdown',
-                            options=[
-                                {'label': 'Hours', 'value': 'hours'},
-                                {'label': 'Days of Week', 'value': 'days'}
-                            ],
-                            value='hours',
-                            style={'width': '120px', 'color': '#000', 'fontSize': '14px'}
-                        )
-                    ], style={'float': 'right', 'marginTop': '10px'})
-                ], style={'clearfix': 'both', 'marginBottom': '15px'}),
-                dcc.Graph(id='compliance-heatmap')
-            ], style={**custom_styles['chart_card'], 'flex': '1'}),
+                        html.H3("HELMET COMPLIANCE vs. NON-COMPLIANCE", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600', 'display': 'inline-block'}),
+                        html.Div([
+                            dcc.Dropdown(
+                                id='heatmap-axis-dropdown',
+                                options=[
+                                    {'label': 'Hours', 'value': 'hours'},
+                                    {'label': 'Days of Week', 'value': 'days'}
+                                ],
+                                value='hours',
+                                style={'width': '120px', 'color': '#000', 'fontSize': '14px'}
+                            )
+                        ], style={'float': 'right', 'marginTop': '10px'})
+                    ], style={'clearfix': 'both', 'marginBottom': '15px'}),
+                    dcc.Graph(id='compliance-heatmap')
+                ], style={**custom_styles['chart_card'], 'flex': '1'}),
             
-            # Helmet compliance trends with dropdown
-            html.Div([
+                # Helmet compliance trends with dropdown
                 html.Div([
-                    html.H3("HELMET COMPLIANCE TRENDS", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600', 'display': 'inline-block'}),
                     html.Div([
-                        dcc.Dropdown(
-                            id='trend-axis-dropdown',
-                            options=[
-                                {'label': 'Hours', 'value': 'hours'},
-                                {'label': 'Days of Week', 'value': 'days'}
-                            ],
-                            value='hours',
-                            style={'width': '120px', 'color': '#000', 'fontSize': '14px'}
-                        )
-                    ], style={'float': 'right', 'marginTop': '10px'})
-                ], style={'clearfix': 'both', 'marginBottom': '15px'}),
-                dcc.Graph(id='helmet-compliance-trends')
-            ], style={**custom_styles['chart_card'], 'flex': '1'})
-        ], style={'display': 'flex', 'flexWrap': 'wrap', 'marginBottom': '20px'}),
+                        html.H3("HELMET COMPLIANCE TRENDS", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600', 'display': 'inline-block'}),
+                        html.Div([
+                            dcc.Dropdown(
+                                id='trend-axis-dropdown',
+                                options=[
+                                    {'label': 'Hours', 'value': 'hours'},
+                                    {'label': 'Days of Week', 'value': 'days'}
+                                ],
+                                value='hours',
+                                style={'width': '120px', 'color': '#000', 'fontSize': '14px'}
+                            )
+                        ], style={'float': 'right', 'marginTop': '10px'})
+                    ], style={'clearfix': 'both', 'marginBottom': '15px'}),
+                    dcc.Graph(id='helmet-compliance-trends')
+                ], style={**custom_styles['chart_card'], 'flex': '1'})
+            ], style={'display': 'flex', 'flexWrap': 'wrap', 'marginBottom': '20px'}),
         
-        # Additional insights row
-        html.Div([
-            # Detection patterns over time
+            # Additional insights row
             html.Div([
-                html.H3("DETECTION PATTERNS OVER TIME", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600'}),
-                dcc.Graph(id='detection-patterns')
-            ], style={**custom_styles['chart_card'], 'flex': '2'}),
+                # Detection patterns over time
+                html.Div([
+                    html.H3("DETECTION PATTERNS OVER TIME", style={'color': '#ffffff', 'fontSize': '18px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                    dcc.Graph(id='detection-patterns')
+                ], style={**custom_styles['chart_card'], 'flex': '2'}),
             
-            # Top insights
-            html.Div([
-                html.H3("💡 KEY INSIGHTS", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
-                html.Div(id='key-insights', style={'color': '#e2e8f0', 'fontSize': '14px', 'lineHeight': '1.6'})
-            ], style={**custom_styles['chart_card'], 'flex': '1'})
-        ], style={'display': 'flex', 'flexWrap': 'wrap'})
+                # Top insights
+                html.Div([
+                    html.H3("💡 KEY INSIGHTS", style={'color': '#ffffff', 'fontSize': '16px', 'marginBottom': '15px', 'fontWeight': '600'}),
+                    html.Div(id='key-insights', style={'color': '#e2e8f0', 'fontSize': '14px', 'lineHeight': '1.6'})
+                ], style={**custom_styles['chart_card'], 'flex': '1'})
+            ], style={'display': 'flex', 'flexWrap': 'wrap'})
         
-    ], style={'background': 'linear-gradient(135deg, #0f172a 0%, #1e293b 100%)', 'minHeight': '100vh', 'padding': '20px'}),
+        ], style={'background': 'linear-gradient(135deg, #0f172a 0%, #1e293b 100%)', 'minHeight': '100vh', 'padding': '20px'}),
+    
+        # Store components for time range selection
+        dcc.Store(id='selected-time-range', data='all'),
     
-    # Store components for time range selection
-    dcc.Store(id='selected-time-range', data='all')
+        # Per-hour and per-day totals for the selected range; the axis dropdowns
+        # re-slice these in the browser
+        dcc.Store(id='axis-aggregates'),
     
-], style={'margin': '0', 'padding': '0', 'fontFamily': 'Inter, -apple-system, BlinkMacSystemFont, sans-serif'})
+        # Live mode: poll for newly ingested data
+        dcc.Store(id='data-version'),
+    
+        # Time range and site handed to the background job (see
+        # update_time_range_outputs)
+        dcc.Store(id='background-request'),
+    
+        # Frame picked from the history (None follows the latest), and the
+        # [frame ids, selected frame] the history strip was last rendered for
+        dcc.Store(id='selected-frame', data=None),
+        dcc.Store(id='frame-history-state'),
+    
+        # [alert engine version, site] the alerts panel was last rendered for
+        dcc.Store(id='alerts-state'),
+        dcc.Interval(id='live-interval', interval=max(LIVE_INTERVAL_MS, 1000), disabled=LIVE_INTERVAL_MS <= 0)
+    
+    ], style={'margin': '0', 'padding': '0', 'fontFamily': 'Inter, -apple-system, BlinkMacSystemFont, sans-serif'})
 
-# Function to encode image for display
-def encode_image_for_display():
-    try:
-        # Safely construct the image path relative to this script
-        image_path = os.path.join(os.path.dirname(__file__), "latest_frame.jpg")
-        img = Image.open(image_path)
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return f"data:image/png;base64,{img_str}"
-    except Exception as e:
-        print(f"Error loading image: {e}")
-        return "data:image/png;base64,"
+# Thumbnail strip of the frame history, newest first
+def build_frame_history(frames, selected_frame=None):
+    return [
+        html.Img(
+            id={'type': 'frame-thumb', 'index': frame_id},
+            src=frame_src(frame_id, 'thumb'),
+            className='frame-thumb active' if frame_id == selected_frame else 'frame-thumb'
+        )
+        for frame_id in frames
+    ]
 
-# Callback for time range buttons
-@callback(
+# Outputs of the default view (All Time, all sites, hour axes) as
+# {'component-id.property': value}. They go into the initial layout, so the
+# first paint needs no callback round trip.
+def render_default_view():
+    view = dict(zip(
+        ['helmet-compliance-metric.children', 'total-detections-metric.children',
+         'child-ratio-metric.children', 'safety-score-metric.children',
+         'helmet-trend.children', 'detection-trend.children',
+         'child-trend.children', 'safety-trend.children'],
+        build_kpi_outputs(get_kpis('all'))
+    ))
+    view['mirror-status-chart.figure'] = build_mirror_figure('all')
+    view['detection-patterns.figure'] = build_detection_figure('all')
+    view['axis-aggregates.data'] = get_axis_aggregates('all')
+    view['compliance-heatmap.figure'] = build_compliance_figure('all', 'hours')
+    view['helmet-compliance-trends.figure'] = build_trend_figure('all', 'hours')
+    return view
+
+# The default view from the startup snapshot while nothing has been
+# ingested since it was made, rendered (and cached) otherwise
+def default_view():
+    snapshot = load_snapshot(DATA_SOURCE_ID, len(detections))
+    if snapshot is not None and snapshot.get('view_version') == get_cache_version():
+        return snapshot['view']
+    return render_default_view()
+
+# (data version, default view) read from the same data: records ingested
+# while the view renders change the version, and it is rendered again, so
+# live updates to the page start from exactly the records it shows
+def versioned_default_view():
+    data_version = get_data_version()
+    while True:
+        view = default_view()
+        rendered, data_version = data_version, get_data_version()
+        if data_version == rendered:
+            return data_version, view
+
+# Startup snapshot contents (written by snapshot.py): the default view and,
+# for the in-memory backend, every site's aggregate cells
+def make_snapshot():
+    cells = None
+    if hasattr(detections, 'partitions'):
+        cells = {site: cells_to_json(partition.cube.cells) for site, partition in detections.partitions.items()}
+    return {'source_id': DATA_SOURCE_ID, 'rows': len(detections), 'view_version': get_cache_version(),
+            'view': render_default_view(), 'cells': cells}
+
+# Stamp the current data version into each page load, so live updates are
+# relative to the data the page was rendered from. Every output of the
+# default view starts out filled in; later changes are patches and
+# browser-side re-renders of the data.
+def serve_layout():
+    layout = build_layout()
+    data_version, view = versioned_default_view()
+    layout['data-version'].data = data_version
+    layout['site-dropdown'].options = [{'label': 'All sites', 'value': ALL_SITES}] + [
+        {'label': f"Site {site}", 'value': site} for site in detections.sites
+    ]
+    for output, value in view.items():
+        component_id, prop = output.split('.')
+        setattr(layout[component_id], prop, value)
+    frames = recent_frames()
+    layout['latest-frame'].src = frame_src(frames[0]) if frames else ""
+    layout['frame-history'].children = build_frame_history(frames)
+    layout['frame-history-state'].data = [frames, None]
+    layout['live-alerts'].children = build_alerts(ALL_SITES)
+    layout['alerts-state'].data = [alert_engine.version, ALL_SITES]
+    return layout
+
+# Pure UI state is handled in the browser (assets/dashboard.js): the time
+# range buttons and box-zoom on the detection chart set the selected range
+# without a server round trip
+clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='selectTimeRange'),
     Output('selected-time-range', 'data'),
     [Input('btn-24h', 'n_clicks'),
      Input('btn-week', 'n_clicks'),
-     Input('btn-all', 'n_clicks')],
+     Input('btn-all', 'n_clicks'),
+     Input('detection-patterns', 'relayoutData')],
     prevent_initial_call=True
 )
-def update_time_range(btn_24h, btn_week, btn_all):
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return 'all'
-    
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    if button_id == 'btn-24h':
-        return '24h'
-    elif button_id == 'btn-week':
-        return 'week'
-    else:
-        return 'all'
+
+clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='highlightTimeRange'),
+    [Output('btn-24h', 'className'),
+     Output('btn-week', 'className'),
+     Output('btn-all', 'className')],
+    Input('selected-time-range', 'data')
+)
+
+# (start, end) bounds of the selected time range; None leaves a side open
+def get_time_range_bounds(time_range):
+    return queries.get_time_range_bounds(time_range, detections.max_timestamp)
 
 # Function to filter data based on time range
-def filter_data_by_time_range(time_range):
-    if time_range == '24h':
-        cutoff_date = df['timestamp'].max() - timedelta(hours=24)
-        return df[df['timestamp'] >= cutoff_date]
-    elif time_range == 'week':
-        cutoff_date = df['timestamp'].max() - timedelta(days=7)
-        return df[df['timestamp'] >= cutoff_date]
-    else:
-        return df
+def filter_data_by_time_range(time_range, site=ALL_SITES):
+    return filter_data_by_window(*get_time_range_bounds(time_range), site=site)
 
-# Callbacks for updating charts and metrics
-@callback(
-    [Output('helmet-compliance-metric', 'children'),
-     Output('total-detections-metric', 'children'),
-     Output('child-ratio-metric', 'children'),
-     Output('safety-score-metric', 'children'),
-     Output('helmet-trend', 'children'),
-     Output('detection-trend', 'children'),
-     Output('child-trend', 'children'),
-     Output('safety-trend', 'children'),
-     Output('mirror-status-chart', 'figure'),
-     Output('compliance-heatmap', 'figure'),
-     Output('helmet-compliance-trends', 'figure'),
-     Output('detection-patterns', 'figure'),
-     Output('live-alerts', 'children'),
-     Output('key-insights', 'children'),
-     Output('latest-frame', 'src')],
-    [Input('selected-time-range', 'data'),
-     Input('heatmap-axis-dropdown', 'value'),
-     Input('trend-axis-dropdown', 'value')]
-)
-def update_dashboard(time_range, heatmap_axis, trend_axis):
-    # Filter data based on time range
-    filtered_df = filter_data_by_time_range(time_range)
-    
-    # Calculate metrics
-    avg_helmet_compliance = filtered_df['helmet_compliance_rate'].mean()
-    total_detections = filtered_df['total_detections'].sum()
-    avg_child_ratio = filtered_df['child_passenger_ratio'].mean()
-    avg_safety_score = filtered_df['safety_score'].mean()
-    
-    # Calculate trends (simple comparison with previous period)
-    helmet_trend = "📈 +2.3% vs last period"
-    detection_trend = "📈 +15% vs last period"
-    child_trend = "📉 -0.8% vs last period"
-    safety_trend = "📈 +1.5% vs last period"
-    
-    # Mirror status pie chart with enhanced styling and fixed legend
-    mirror_data = {
-        'No Mirror': filtered_df['no_mirror'].sum(),
-        'Left Mirror': filtered_df['left_mirror'].sum(),
-        'Right Mirror': filtered_df['right_mirror'].sum(),
-        'Both Mirrors': filtered_df['both_mirrors'].sum()
-    }
+@metrics.timed('filter')
+def filter_data_by_window(start=None, end=None, site=ALL_SITES):
+    return queries.filter_window(detections, start, end, site)
+
+# Key metrics, with the previous period's for the trend strings
+@metrics.timed('aggregate')
+def get_kpis(time_range, site=ALL_SITES):
+    return queries.get_kpis(detections, time_range, site)
+
+# Mirror status values, in pie slice order
+@metrics.timed('aggregate')
+def get_mirror_data(time_range, site=ALL_SITES):
+    return queries.get_mirror_data(detections, time_range, site)
+
+def get_axis_title(axis):
+    return 'Hour of Day' if axis == 'hours' else 'Day of Week'
+
+# Mirror status pie chart with enhanced styling and fixed legend
+# (figures are cached as plain dicts, which Dash accepts as-is)
+@result_cache.memoize
+@metrics.timed('figure')
+def build_mirror_figure(time_range, site=ALL_SITES):
+    mirror_data = get_mirror_data(time_range, site)
     
     mirror_fig = go.Figure(data=[go.Pie(
         labels=list(mirror_data.keys()),
@@ -360,36 +548,34 @@ def update_dashboard(time_range, heatmap_axis, trend_axis):
         margin=dict(l=0, r=80, t=0, b=0),
         height=250
     )
-    
-    # Helmet compliance vs. non-compliance stacked bar chart
-    if heatmap_axis == 'hours':
-        compliance_data = filtered_df.groupby('hour').agg({
-            'helmet_compliance': 'sum',
-            'total_detections': 'sum'
-        }).reset_index()
-        compliance_data['non_compliant'] = compliance_data['total_detections'] - compliance_data['helmet_compliance']
-        x_values = compliance_data['hour']
-        x_title = 'Hour of Day'
-    else:
-        compliance_data = filtered_df.groupby('day_of_week').agg({
-            'helmet_compliance': 'sum',
-            'total_detections': 'sum'
-        }).reset_index()
-        compliance_data['non_compliant'] = compliance_data['total_detections'] - compliance_data['helmet_compliance']
-        x_values = compliance_data['day_of_week']
-        x_title = 'Day of Week'
+    return mirror_fig.to_dict()
+
+# Helmet compliance vs. non-compliance per hour or day
+@result_cache.memoize
+def get_compliance_data(time_range, heatmap_axis, site=ALL_SITES):
+    # assign() copies, leaving the cached trend data untouched
+    return get_trend_data(time_range, heatmap_axis, site).assign(
+        non_compliant=lambda grouped: grouped['total_detections'] - grouped['helmet_compliance']
+    )
+
+# Helmet compliance vs. non-compliance stacked bar chart
+@result_cache.memoize
+@metrics.timed('figure')
+def build_compliance_figure(time_range, heatmap_axis, site=ALL_SITES):
+    compliance_data = get_compliance_data(time_range, heatmap_axis, site)
+    x_values = compliance_data.index.tolist()
 
     # Stacked bar chart figure
     heatmap_fig = go.Figure()
     heatmap_fig.add_trace(go.Bar(
         x=x_values,
-        y=compliance_data['helmet_compliance'],
+        y=compliance_data['helmet_compliance'].tolist(),
         name='Helmet Compliant',
         marker_color='#ffb800'  # yellow-gold from your pie chart
     ))
     heatmap_fig.add_trace(go.Bar(
         x=x_values,
-        y=compliance_data['non_compliant'],
+        y=compliance_data['non_compliant'].tolist(),
         name='Non-compliant',
         marker_color='#ff6b6b'  # red from your pie chart
     ))
@@ -398,7 +584,7 @@ def update_dashboard(time_range, heatmap_axis, trend_axis):
     heatmap_fig.update_layout(
         barmode='stack',
         #title='Helmet Compliance vs. Non-compliance',
-        xaxis=dict(title=x_title, gridcolor='#4a5568'),
+        xaxis=dict(title=get_axis_title(heatmap_axis), gridcolor='#4a5568'),
         yaxis=dict(title='Number of Riders', gridcolor='#4a5568'),
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
@@ -413,36 +599,67 @@ def update_dashboard(time_range, heatmap_axis, trend_axis):
             bgcolor="rgba(0,0,0,0)"
         )
     )
-    
-    # Helmet compliance trends (line chart only)
-    if trend_axis == 'hours':
-        trend_data = filtered_df.groupby('hour')['helmet_compliance_rate'].mean().reset_index()
-        trend_fig = go.Figure()
-        trend_fig.add_trace(go.Scatter(
-            x=trend_data['hour'],
-            y=trend_data['helmet_compliance_rate'],
-            mode='lines+markers',
-            name='Compliance Rate',
-            line=dict(color='#00ff88', width=4),
-            marker=dict(size=8, color='#00ff88')
-        ))
-        trend_fig.update_layout(
-            xaxis=dict(title='Hour of Day', gridcolor='#4a5568')
-        )
-    else:
-        trend_data = filtered_df.groupby('day_of_week')['helmet_compliance_rate'].mean().reset_index()
-        trend_fig = go.Figure()
-        trend_fig.add_trace(go.Scatter(
-            x=trend_data['day_of_week'],
-            y=trend_data['helmet_compliance_rate'],
-            mode='lines+markers',
-            name='Compliance Rate',
-            line=dict(color='#00ff88', width=4),
-            marker=dict(size=8, color='#00ff88')
-        ))
-        trend_fig.update_layout(
-            xaxis=dict(title='Day of Week', gridcolor='#4a5568')
-        )
+    return heatmap_fig.to_dict()
+
+# Compliance rate and detections per hour or day
+@result_cache.memoize
+@metrics.timed('aggregate')
+def get_trend_data(time_range, trend_axis, site=ALL_SITES):
+    return queries.get_trend_data(detections, time_range, trend_axis, site)
+
+# p10/p50/p90 of the records' compliance rates and detections per hour or
+# day, from the quantile sketches
+@result_cache.memoize
+@metrics.timed('aggregate')
+def get_trend_quantiles(time_range, trend_axis, site=ALL_SITES):
+    return queries.get_trend_quantiles(detections, time_range, trend_axis, site)
+
+# Quantile columns the trend chart band is drawn from, sent with the axis
+# aggregates
+TREND_BAND = ['helmet_compliance_rate_p10', 'helmet_compliance_rate_p90', 'helmet_compliance_rate_p50']
+
+# Helmet compliance trends: the overall rate per hour or day, over the
+# p10-p90 band and median of the individual records' rates
+@result_cache.memoize
+@metrics.timed('figure')
+def build_trend_figure(time_range, trend_axis, site=ALL_SITES):
+    trend_data = get_trend_data(time_range, trend_axis, site)
+    trend_quantiles = get_trend_quantiles(time_range, trend_axis, site)
+    trend_fig = go.Figure()
+    trend_fig.add_trace(go.Scatter(
+        x=trend_quantiles.index.tolist(),
+        y=trend_quantiles['helmet_compliance_rate_p10'].round(1).tolist(),
+        mode='lines',
+        name='p10',
+        line=dict(color='rgba(0,255,136,0.3)', width=1)
+    ))
+    trend_fig.add_trace(go.Scatter(
+        x=trend_quantiles.index.tolist(),
+        y=trend_quantiles['helmet_compliance_rate_p90'].round(1).tolist(),
+        mode='lines',
+        name='p90',
+        fill='tonexty',
+        fillcolor='rgba(0,255,136,0.15)',
+        line=dict(color='rgba(0,255,136,0.3)', width=1)
+    ))
+    trend_fig.add_trace(go.Scatter(
+        x=trend_quantiles.index.tolist(),
+        y=trend_quantiles['helmet_compliance_rate_p50'].round(1).tolist(),
+        mode='lines',
+        name='Median',
+        line=dict(color='#00ff88', width=2, dash='dot')
+    ))
+    trend_fig.add_trace(go.Scatter(
+        x=trend_data.index.tolist(),
+        y=trend_data['helmet_compliance_rate'].tolist(),
+        mode='lines+markers',
+        name='Compliance Rate',
+        line=dict(color='#00ff88', width=4),
+        marker=dict(size=8, color='#00ff88')
+    ))
+    trend_fig.update_layout(
+        xaxis=dict(title=get_axis_title(trend_axis), gridcolor='#4a5568')
+    )
     
     trend_fig.update_layout(
         paper_bgcolor='rgba(0,0,0,0)',
@@ -452,19 +669,49 @@ def update_dashboard(time_range, heatmap_axis, trend_axis):
         showlegend=False,
         margin=dict(l=0, r=0, t=0, b=0)
     )
-    
-    # Detection patterns over time 
+    return trend_fig.to_dict()
+
+# Columns plotted on the detection patterns chart, in trace order
+DETECTION_SERIES = ['total_detections', 'helmet_compliance']
+
+# (x, y) per detection trace, downsampled to a fixed point budget so the
+# payload does not grow with the length of the window. Cameras and sites
+# reporting at the same time are summed into one point.
+@result_cache.memoize
+@metrics.timed('aggregate')
+def get_detection_series(time_range, site=ALL_SITES):
+    start, end = get_time_range_bounds(time_range)
+    # A database backend pre-reduces long series to what the downsampling
+    # below picks from
+    columns = detections.series(start, end, DETECTION_SERIES, site, max_points=DEFAULT_POINTS * MINMAX_RATIO)
+
+    series = []
+    for timestamps, values in columns:
+        # x as epoch milliseconds on a date axis
+        timestamps = epoch_ms(timestamps)
+
+        with metrics.span('downsample'):
+            kept = downsample_indices(timestamps, values)
+        # Plain lists (see compact.py)
+        series.append((timestamps[kept].tolist(), values[kept].tolist()))
+    return series
+
+# Detection patterns over time 
+@result_cache.memoize
+@metrics.timed('figure')
+def build_detection_figure(time_range, site=ALL_SITES):
+    (total_x, total_y), (helmet_x, helmet_y) = get_detection_series(time_range, site)
     detection_fig = go.Figure()
     detection_fig.add_trace(go.Scatter(
-        x=filtered_df['timestamp'],
-        y=filtered_df['total_detections'],
+        x=total_x,
+        y=total_y,
         mode='lines',
         name='Total Detections',
         line=dict(color='#00b4ff', width=2)
     ))
     detection_fig.add_trace(go.Scatter(
-        x=filtered_df['timestamp'],
-        y=filtered_df['helmet_compliance'],
+        x=helmet_x,
+        y=helmet_y,
         mode='lines',
         name='Helmet Compliance Count',
         line=dict(color='#00ff88', width=2)
@@ -473,72 +720,342 @@ def update_dashboard(time_range, heatmap_axis, trend_axis):
         paper_bgcolor='rgba(0,0,0,0)',
         plot_bgcolor='rgba(0,0,0,0)',
         font=dict(color='white'),
-        xaxis=dict(title='Time', gridcolor='#4a5568'),
+        xaxis=dict(title='Time', type='date', gridcolor='#4a5568'),
         yaxis=dict(title='Count', gridcolor='#4a5568'),
         legend=dict(orientation="h", yanchor="bottom", y=-0.2, xanchor="center", x=0.5),
         margin=dict(l=0, r=0, t=0, b=0)
     )
-    
-    # Live alerts
-    alerts = []
-    if avg_helmet_compliance < 50:
-        alerts.append("🚨 Low helmet compliance detected!")
-    if avg_child_ratio > 15:
-        alerts.append("👶 High child passenger ratio observed")
-    if avg_safety_score < 60:
-        alerts.append("⚠️ Safety score below threshold")
-    
-    alert_display = html.Div([
-        html.Div(alert, style={'marginBottom': '8px', 'padding': '8px', 'backgroundColor': 'rgba(255,107,107,0.1)', 'borderRadius': '5px'}) 
-        for alert in alerts
-    ]) if alerts else html.Div("✅ All systems normal", style={'color': '#00ff88'})
-    
-    # Key insights
-    if trend_axis == 'hours':
-        trend_data = filtered_df.groupby('hour')['helmet_compliance_rate'].mean()
-        peak_hour = trend_data.idxmax()
-        peak_detection_hour = filtered_df.groupby('hour')['total_detections'].sum().idxmax()
-    else:
-        trend_data = filtered_df.groupby('day_of_week')['helmet_compliance_rate'].mean()
-        peak_hour = trend_data.idxmax()
-        peak_detection_hour = filtered_df.groupby('day_of_week')['total_detections'].sum().idxmax()
+    return detection_fig.to_dict()
+
+# Live alerts: the rules currently firing for the site, then the ones that
+# fired before, from the alert engine's buffer
+RECENT_ALERTS = 5
+
+def build_alerts(site=ALL_SITES):
+    active = alert_engine.active(site)
+    items = [
+        html.Div(alert['message'], style={'marginBottom': '8px', 'padding': '8px', 'backgroundColor': 'rgba(255,107,107,0.1)', 'borderRadius': '5px'}) 
+        for alert in active
+    ] or [html.Div("✅ All systems normal", style={'color': '#00ff88', 'marginBottom': '8px'})]
+    items += [
+        html.Div(f"{alert['timestamp']:%b %d %H:%M} · {alert['message']}", style={'color': '#a0aec0', 'fontSize': '12px', 'marginBottom': '4px'})
+        for alert in alert_engine.recent(site, RECENT_ALERTS) if not any(alert is current for current in active)
+    ]
+    return html.Div(items)
+
+# Key insights (same grouping as the trend chart). The dashboard renders
+# these in the browser (renderInsights in assets/dashboard.js); this version
+# backs update_dashboard().
+def build_insights(kpis, time_range, trend_axis, site=ALL_SITES):
+    trend_data = get_trend_data(time_range, trend_axis, site)
+    if trend_data.empty:
+        # A custom window can contain no records at all
+        return html.Div("No detections in the selected window")
+    peak_hour = trend_data['helmet_compliance_rate'].idxmax()
+    peak_detection_hour = trend_data['total_detections'].idxmax()
     
     insights = [
-        f"Average compliance rate: {avg_helmet_compliance:.1f}%",
+        f"Average compliance rate: {kpis['avg_helmet_compliance']:.1f}%",
         f"Peak detection {'hour' if trend_axis == 'hours' else 'day'}: {peak_detection_hour}",
         f"Best compliance {'hour' if trend_axis == 'hours' else 'day'}: {peak_hour}",
-        f"Safety trend: {'Improving' if avg_safety_score > 60 else 'Needs attention'}"
+        f"Safety trend: {'Improving' if kpis['avg_safety_score'] > 60 else 'Needs attention'}"
     ]
     
-    insight_display = html.Div([
+    return html.Div([
         html.Div(insight, style={'marginBottom': '10px', 'padding': '5px 0'}) 
         for insight in insights
     ])
-    
-    # Image for latest frame
-    image_src = encode_image_for_display()
+
+# Change against the previous period, e.g. "📈 +2.3% vs last period"
+def format_trend(kpis, key):
+    previous = kpis['previous']
+    if previous is None or not previous[key] or np.isnan(previous[key]) or np.isnan(kpis[key]):
+        return "No previous period"
+    change = (kpis[key] - previous[key]) / previous[key] * 100
+    return f"{'📈' if change >= 0 else '📉'} {change:+.1f}% vs last period"
+
+# A rate KPI for a card, or a dash when the window has no detections to
+# take it over (NaN)
+def format_rate(value, suffix=''):
+    return "–" if np.isnan(value) else f"{value:.1f}{suffix}"
+
+# KPI cards (values and trend strings)
+def build_kpi_outputs(kpis):
+    # Trends compare with the previous period of the same length
+    helmet_trend = format_trend(kpis, 'avg_helmet_compliance')
+    detection_trend = format_trend(kpis, 'total_detections')
+    child_trend = format_trend(kpis, 'avg_child_ratio')
+    safety_trend = format_trend(kpis, 'avg_safety_score')
     
     return (
-        f"{avg_helmet_compliance:.1f}%",
-        f"{total_detections:,}",
-        f"{avg_child_ratio:.1f}%",
-        f"{avg_safety_score:.1f}",
+        format_rate(kpis['avg_helmet_compliance'], '%'),
+        f"{kpis['total_detections']:,}",
+        format_rate(kpis['avg_child_ratio'], '%'),
+        format_rate(kpis['avg_safety_score']),
         helmet_trend,
         detection_trend,
         child_trend,
-        safety_trend,
-        mirror_fig,
-        heatmap_fig,
-        trend_fig,
-        detection_fig,
-        alert_display,
-        insight_display,
+        safety_trend
+    )
+
+# Full render of every dashboard output for one combination of inputs.
+# The callbacks below each produce a slice of this; it is kept for callers
+# that need the whole view at once.
+def update_dashboard(time_range, heatmap_axis, trend_axis, site=ALL_SITES):
+    kpis = get_kpis(time_range, site)
+    with metrics.span('frame'):
+        frames = recent_frames()
+    image_src = frame_src(frames[0]) if frames else ""
+    
+    return (
+        *build_kpi_outputs(kpis),
+        build_mirror_figure(time_range, site),
+        build_compliance_figure(time_range, heatmap_axis, site),
+        build_trend_figure(time_range, trend_axis, site),
+        build_detection_figure(time_range, site),
+        build_alerts(site),
+        build_insights(kpis, time_range, trend_axis, site),
         image_src
     )
 
+# Rows ingested since the browser's previous data version, when the detection
+# chart can simply be extended with them: there is a single site and camera,
+# the window is All Time, the series is not downsampled and no late records have
+# shifted row positions
+def get_appended_rows(time_range, data_version):
+    if dash.ctx.triggered_id != 'data-version' or not data_version:
+        return None
+    previous = data_version.get('since')
+    if not previous or previous['rebuilds'] != data_version['rebuilds']:
+        return None
+    if get_time_range_bounds(time_range) != (None, None) or data_version['rows'] > DEFAULT_POINTS:
+        return None
+    return detections.appended_rows(previous['rows'], data_version['rows'])
+
+# Live mode: publish a new data version when records have been ingested
+@callback(
+    Output('data-version', 'data'),
+    Input('live-interval', 'n_intervals'),
+    State('data-version', 'data'),
+    prevent_initial_call=True
+)
+@metrics.callback
+def poll_data_version(n_intervals, data_version):
+    current = get_data_version()
+    if data_version and (data_version['rows'], data_version['rebuilds']) == (current['rows'], current['rebuilds']):
+        return dash.no_update
+    if data_version:
+        current['since'] = {'rows': data_version['rows'], 'rebuilds': data_version['rebuilds']}
+    return current
+
+# Everything that depends on the selected time range (or new data) comes
+# back in one request; the axis dropdowns are handled in the browser. The
+# page arrives with the default view already rendered (serve_layout), so
+# there is no initial call.
+TIME_RANGE_OUTPUTS = [
+    ('helmet-compliance-metric', 'children'),
+    ('total-detections-metric', 'children'),
+    ('child-ratio-metric', 'children'),
+    ('safety-score-metric', 'children'),
+    ('helmet-trend', 'children'),
+    ('detection-trend', 'children'),
+    ('child-trend', 'children'),
+    ('safety-trend', 'children'),
+    ('mirror-status-chart', 'figure'),
+    ('detection-patterns', 'figure'),
+    ('axis-aggregates', 'data')
+]
+
+# Windows with more records than this are rendered by a background job, so a
+# slow render does not hold a worker; smaller ones, and every live update,
+# are answered inline rather than forking a job per browser and poll
+BACKGROUND_MIN_ROWS = int(os.environ.get("BACKGROUND_MIN_ROWS", 1_000_000))
+
+def runs_in_background(time_range, site=ALL_SITES):
+    if background_manager is None:
+        return False
+    start, end = get_time_range_bounds(time_range)
+    return detections.totals(start, end, site)['rows'] > BACKGROUND_MIN_ROWS
+
+def render_time_range_outputs(set_progress, time_range, site=ALL_SITES, data_version=None):
+    kpis = get_kpis(time_range, site)
+    set_progress(1)
+    mirror_chart = update_mirror_chart(time_range, site)
+    set_progress(2)
+    detection_chart = update_detection_patterns(time_range, site, data_version)
+    set_progress(3)
+    axis_aggregates = get_axis_aggregates(time_range, site)
+    set_progress(UPDATE_STAGES)
+    return (
+        *build_kpi_outputs(kpis),
+        mirror_chart,
+        detection_chart,
+        axis_aggregates
+    )
+
+@callback(
+    [Output(component_id, prop) for component_id, prop in TIME_RANGE_OUTPUTS] +
+    [Output('background-request', 'data')],
+    [Input('selected-time-range', 'data'),
+     Input('site-dropdown', 'value'),
+     Input('data-version', 'data')],
+    prevent_initial_call=True
+)
+@metrics.callback
+def update_time_range_outputs(time_range, site=ALL_SITES, data_version=None):
+    if dash.ctx.triggered_id != 'data-version' and runs_in_background(time_range, site):
+        # A new value every time, so picking the same range again still
+        # starts a job
+        request = {'time_range': time_range, 'site': site, 'requested': time.time_ns()}
+        return (*[dash.no_update] * len(TIME_RANGE_OUTPUTS), request)
+    return (*render_time_range_outputs(ignore_progress, time_range, site, data_version), dash.no_update)
+
+@background_callback(
+    background_manager,
+    [Output(component_id, prop, allow_duplicate=True) for component_id, prop in TIME_RANGE_OUTPUTS],
+    Input('background-request', 'data'),
+    progress=[Output('update-progress', 'value')],
+    progress_default=[0],
+    running=[(Output('update-progress', 'style'), PROGRESS_STYLE, {**PROGRESS_STYLE, 'visibility': 'hidden'})],
+    prevent_initial_call=True
+)
+@metrics.callback
+def update_time_range_in_background(set_progress, request):
+    return render_time_range_outputs(set_progress, request['time_range'], request['site'])
+
+# Totals per hour and per day of week, compact enough to send both at once
+@result_cache.memoize
+def get_axis_aggregates(time_range, site=ALL_SITES):
+    kpis = get_kpis(time_range, site)
+    aggregates = {'kpis': {
+        'avg_helmet_compliance': float(kpis['avg_helmet_compliance']),
+        'avg_safety_score': float(kpis['avg_safety_score'])
+    }}
+    for axis in AXIS_COLUMNS:
+        trend_data = get_trend_data(time_range, axis, site)
+        trend_quantiles = get_trend_quantiles(time_range, axis, site)
+        aggregates[axis] = {
+            'x': trend_data.index.tolist(),
+            'helmet_compliance': trend_data['helmet_compliance'].tolist(),
+            'total_detections': trend_data['total_detections'].tolist(),
+            'helmet_compliance_rate': trend_data['helmet_compliance_rate'].tolist(),
+            # Rounded: the sketches resolve them to a few points only
+            **{column: trend_quantiles[column].round(1).tolist() for column in TREND_BAND}
+        }
+    return aggregates
+
+# The figures exist in the browser from the initial layout; only their data
+# needs to be patched
+def update_mirror_chart(time_range, site=ALL_SITES):
+    patched_fig = Patch()
+    patched_fig['data'][0]['values'] = list(get_mirror_data(time_range, site).values())
+    return patched_fig
+
+def update_detection_patterns(time_range, site=ALL_SITES, data_version=None):
+    patched_fig = Patch()
+    new_rows = get_appended_rows(time_range, data_version)
+    if new_rows is not None:
+        # Only the new points go over the wire
+        new_x = epoch_ms(new_rows['timestamp'].to_numpy()).tolist()
+        for i, column in enumerate(DETECTION_SERIES):
+            patched_fig['data'][i]['x'].extend(new_x)
+            patched_fig['data'][i]['y'].extend(new_rows[column].tolist())
+        return patched_fig
+    
+    for i, (x, y) in enumerate(get_detection_series(time_range, site)):
+        patched_fig['data'][i]['x'] = x
+        patched_fig['data'][i]['y'] = y
+    return patched_fig
+
+# Bar chart, trend chart and insights from the preloaded aggregates: an axis
+# dropdown change costs no request at all
+clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='renderComplianceChart'),
+    Output('compliance-heatmap', 'figure'),
+    [Input('axis-aggregates', 'data'),
+     Input('heatmap-axis-dropdown', 'value')],
+    State('compliance-heatmap', 'figure')
+)
+
+clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='renderTrendChart'),
+    Output('helmet-compliance-trends', 'figure'),
+    [Input('axis-aggregates', 'data'),
+     Input('trend-axis-dropdown', 'value')],
+    State('helmet-compliance-trends', 'figure')
+)
+
+clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='renderInsights'),
+    Output('key-insights', 'children'),
+    [Input('axis-aggregates', 'data'),
+     Input('trend-axis-dropdown', 'value')]
+)
+
+# Alerts are evaluated as records are ingested; the panel is only resent
+# when the engine's state changed or another site was picked
+@callback(
+    [Output('live-alerts', 'children'),
+     Output('alerts-state', 'data')],
+    [Input('live-interval', 'n_intervals'),
+     Input('site-dropdown', 'value')],
+    State('alerts-state', 'data'),
+    prevent_initial_call=True
+)
+@metrics.callback
+def update_alerts(n_intervals, site, alerts_state):
+    state = [alert_engine.version, site]
+    if state == alerts_state:
+        return dash.no_update, dash.no_update
+    return build_alerts(site), state
+
+# Clicked thumbnail -> 'selected-frame' (LIVE clears it)
+clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='selectFrame'),
+    Output('selected-frame', 'data'),
+    [Input({'type': 'frame-thumb', 'index': ALL}, 'n_clicks'),
+     Input('frame-live', 'n_clicks')],
+    State('selected-frame', 'data'),
+    prevent_initial_call=True
+)
+
+# Displayed frame and history strip, only resent when a new frame arrived or
+# another one was picked. Frames were resized when they were ingested, so
+# this only lists ids.
+@callback(
+    [Output('latest-frame', 'src'),
+     Output('frame-history', 'children'),
+     Output('frame-history-state', 'data')],
+    [Input('live-interval', 'n_intervals'),
+     Input('selected-frame', 'data')],
+    [State('latest-frame', 'src'),
+     State('frame-history-state', 'data')],
+    prevent_initial_call=True
+)
+@metrics.callback
+def update_latest_frame(n_intervals, selected_frame, current_frame_src, history_state):
+    with metrics.span('frame'):
+        frames = recent_frames()
+    if selected_frame not in frames:
+        # Nothing picked, or the picked frame has left the history
+        selected_frame = None
+    shown_frame = selected_frame or (frames[0] if frames else None)
+    image_src = frame_src(shown_frame) if shown_frame else ""
+
+    state = [frames, selected_frame]
+    if state == history_state:
+        history, state = dash.no_update, dash.no_update
+    else:
+        history = build_frame_history(frames, selected_frame)
+    if image_src == current_frame_src:
+        image_src = dash.no_update
+    return image_src, history, state
+
+# Set once the figure builders it uses are defined (Dash renders it once
+# on assignment to validate it)
+app.layout = serve_layout
+
 if __name__ == '__main__':
+    start_worker_threads()
     app.run_server(host="0.0.0.0", port=port, debug=True, dev_tools_ui=False)
 
-app = dash.Dash(__name__)
-server = app.server  # This is important for deployment
-
@@ -0,0 +1,152 @@
+// Clientside callbacks for UI-only state. Dash serves every file in assets/
+// automatically; app.py wires these up with ClientsideFunction('dashboard', ...).
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        // Time range buttons and box-zoom on the detection chart -> the
+        // 'selected-time-range' store ('24h', 'week', 'all' or {start, end})
+        selectTimeRange: function(btn24h, btnWeek, btnAll, relayoutData) {
+            const triggered = dash_clientside.callback_context.triggered;
+            if (!triggered.length) {
+                return 'all';
+            }
+            const source = triggered[0].prop_id.split('.')[0];
+            if (source === 'detection-patterns') {
+                return relayoutWindow(relayoutData);
+            } else if (source === 'btn-24h') {
+                return '24h';
+            } else if (source === 'btn-week') {
+                return 'week';
+            }
+            return 'all';
+        },
+
+        // Highlight the button of the selected preset (none for a zoom window)
+        highlightTimeRange: function(timeRange) {
+            return ['24h', 'week', 'all'].map(function(preset) {
+                return preset === timeRange ? 'time-btn active' : 'time-btn';
+            });
+        },
+
+        // Compliance vs. non-compliance bars from the preloaded aggregates
+        renderComplianceChart: function(aggregates, axis, figure) {
+            if (!aggregates || !figure) {
+                return dash_clientside.no_update;
+            }
+            const grouped = aggregates[axis];
+            const nonCompliant = grouped.total_detections.map(function(total, i) {
+                return total - grouped.helmet_compliance[i];
+            });
+            return withAxisData(figure, axis, [
+                {x: grouped.x, y: grouped.helmet_compliance},
+                {x: grouped.x, y: nonCompliant}
+            ]);
+        },
+
+        // Compliance rate line over its p10-p90 band and median (trace
+        // order of build_trend_figure() in app.py) from the preloaded
+        // aggregates
+        renderTrendChart: function(aggregates, axis, figure) {
+            if (!aggregates || !figure) {
+                return dash_clientside.no_update;
+            }
+            const grouped = aggregates[axis];
+            return withAxisData(figure, axis, [
+                {x: grouped.x, y: grouped.helmet_compliance_rate_p10},
+                {x: grouped.x, y: grouped.helmet_compliance_rate_p90},
+                {x: grouped.x, y: grouped.helmet_compliance_rate_p50},
+                {x: grouped.x, y: grouped.helmet_compliance_rate}
+            ]);
+        },
+
+        // Key insights (same grouping as the trend chart); mirrors
+        // build_insights() in app.py
+        renderInsights: function(aggregates, axis) {
+            if (!aggregates) {
+                return dash_clientside.no_update;
+            }
+            const grouped = aggregates[axis];
+            if (!grouped.x.length) {
+                // A custom window can contain no records at all
+                return htmlDiv("No detections in the selected window");
+            }
+            const unit = axis === 'hours' ? 'hour' : 'day';
+            const kpis = aggregates.kpis;
+            const insights = [
+                "Average compliance rate: " + kpis.avg_helmet_compliance.toFixed(1) + "%",
+                "Peak detection " + unit + ": " + grouped.x[argmax(grouped.total_detections)],
+                "Best compliance " + unit + ": " + grouped.x[argmax(grouped.helmet_compliance_rate)],
+                "Safety trend: " + (kpis.avg_safety_score > 60 ? 'Improving' : 'Needs attention')
+            ];
+            return htmlDiv(insights.map(function(insight) {
+                return htmlDiv(insight, {marginBottom: '10px', padding: '5px 0'});
+            }));
+        },
+
+        // Clicked thumbnail in the frame history -> its frame id for the
+        // 'selected-frame' store; LIVE -> null (follow the latest frame)
+        selectFrame: function(thumbClicks, liveClicks, selected) {
+            const triggered = dash_clientside.callback_context.triggered;
+            // Thumbnails added by a history update fire with no clicks
+            if (!triggered.length || !triggered[0].value) {
+                return dash_clientside.no_update;
+            }
+            const source = triggered[0].prop_id.split('.')[0];
+            if (source === 'frame-live') {
+                return null;
+            }
+            const frameId = JSON.parse(source).index;
+            return frameId === selected ? dash_clientside.no_update : frameId;
+        }
+    }
+});
+
+// Custom window from a zoomed x axis; double-click (autorange) resets to all
+function relayoutWindow(relayoutData) {
+    relayoutData = relayoutData || {};
+    if (relayoutData['xaxis.autorange']) {
+        return 'all';
+    }
+    if ('xaxis.range[0]' in relayoutData && 'xaxis.range[1]' in relayoutData) {
+        return {start: relayoutData['xaxis.range[0]'], end: relayoutData['xaxis.range[1]']};
+    }
+    if ('xaxis.range' in relayoutData) {
+        return {start: relayoutData['xaxis.range'][0], end: relayoutData['xaxis.range'][1]};
+    }
+    // Pan/zoom on the y axis or other layout changes
+    return dash_clientside.no_update;
+}
+
+// Copy of figure with new trace data and the x axis title for axis
+function withAxisData(figure, axis, traces) {
+    const data = figure.data.map(function(trace, i) {
+        return Object.assign({}, trace, traces[i]);
+    });
+    const xaxis = Object.assign({}, figure.layout.xaxis, {
+        title: Object.assign({}, figure.layout.xaxis.title, {
+            text: axis === 'hours' ? 'Hour of Day' : 'Day of Week'
+        })
+    });
+    return Object.assign({}, figure, {
+        data: data,
+        layout: Object.assign({}, figure.layout, {xaxis: xaxis})
+    });
+}
+
+// Position of the first largest value, like pandas' idxmax()
+function argmax(values) {
+    let best = 0;
+    for (let i = 1; i < values.length; i++) {
+        if (values[i] > values[best]) {
+            best = i;
+        }
+    }
+    return best;
+}
+
+function htmlDiv(children, style) {
+    return {
+        type: 'Div',
+        namespace: 'dash_html_components',
+        props: style ? {children: children, style: style} : {children: children}
+    };
+}
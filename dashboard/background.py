@@ -0,0 +1,137 @@
+import functools
+import os
+import tempfile
+import threading
+
+from dash import DiskcacheManager, callback
+
+# Background callbacks: the request that triggers one returns at once and the
+# browser polls for the result, so a slow render does not hold a gunicorn
+# worker for its whole duration. Jobs run in forked processes (which share
+# the loaded data copy-on-write) with results passed back through a diskcache
+# directory; no broker is needed. Without dash[diskcache] installed the
+# callbacks run inline as before.
+#
+# Any worker may be asked about a job another worker started, and jobs exit
+# on their own schedule, so the manager treats a job that vanishes while it
+# is being checked as finished. Jobs are never forked while another thread
+# is inside a diskcache call: the job would inherit SQLite's record of that
+# thread's lock and wait on it until it timed out. Metrics a job records
+# (stage timings, cache lookups) are handed back with its result to the
+# worker that returns it.
+JOBS_PATH = os.environ.get('BACKGROUND_JOBS_PATH', os.path.join(tempfile.gettempdir(), 'motorcycle_dashboard_jobs'))
+# How often the browser polls a running job, in milliseconds
+POLL_INTERVAL_MS = int(os.environ.get('BACKGROUND_POLL_MS', 250))
+# Seconds a finished job's result is kept if the browser never collects it
+RESULT_EXPIRE_SECONDS = 600
+
+
+class JobManager(DiskcacheManager):
+
+    def __init__(self, cache, metrics=None, **kwargs):
+        super().__init__(cache, **kwargs)
+        self.metrics = metrics
+        # Held around every use of the cache in this process, and taken
+        # before any fork
+        self._lock = threading.RLock()
+        os.register_at_fork(before=self._lock.acquire, after_in_parent=self._lock.release,
+                            after_in_child=self._lock.release)
+
+    def get_progress(self, key):
+        with self._lock:
+            return super().get_progress(key)
+
+    def result_ready(self, key):
+        with self._lock:
+            return super().result_ready(key)
+
+    def clear_cache_entry(self, key):
+        with self._lock:
+            super().clear_cache_entry(key)
+
+    def terminate_job(self, job):
+        # Unlike Dash's version, this does not wait for the process to go
+        # away while holding the cache's lock: a finished job started by
+        # another worker stays a zombie until that worker reaps it, so the
+        # wait always ran its full second and held up jobs storing results
+        import psutil
+        if not job:
+            return
+        try:
+            process = psutil.Process(int(job))
+            if process.status() == psutil.STATUS_ZOMBIE:
+                return
+            processes = process.children(recursive=True) + [process]
+        except psutil.NoSuchProcess:
+            return
+        for process in processes:
+            try:
+                process.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+    def job_running(self, job):
+        import psutil
+        try:
+            return super().job_running(job)
+        except psutil.NoSuchProcess:
+            return False
+
+    def run_job(self, func, *args):
+        # Called in the job process, whose metrics are a copy of the
+        # worker's at the fork: start them empty, so only what the job
+        # records is handed back
+        if self.metrics is None:
+            return func(*args)
+        self.metrics.reset()
+        try:
+            return func(*args)
+        finally:
+            self.handle.set(f'job-metrics:{os.getpid()}', self.metrics.export(), expire=RESULT_EXPIRE_SECONDS)
+
+    def get_result(self, key, job):
+        with self._lock:
+            result = super().get_result(key, job)
+            exported = None
+            if result is not self.UNDEFINED and job and self.metrics is not None:
+                exported = self.handle.pop(f'job-metrics:{job}', None)
+        if exported is not None:
+            self.metrics.merge(exported)
+        return result
+
+
+def make_background_manager(path=JOBS_PATH, metrics=None):
+    # None when background callbacks are unavailable or disabled
+    # (BACKGROUND_CALLBACKS=0)
+    if os.environ.get('BACKGROUND_CALLBACKS', '1') == '0':
+        return None
+    try:
+        import diskcache
+        return JobManager(diskcache.Cache(path), metrics=metrics, expire=RESULT_EXPIRE_SECONDS)
+    except ImportError:
+        return None
+
+
+def ignore_progress(progress):
+    pass
+
+
+def background_callback(manager, *dependencies, progress=None, running=None, **kwargs):
+    # dash.callback that runs as a background job when manager is set and
+    # inline otherwise. Either way the function gets set_progress first.
+    # A job still running when its inputs change again is terminated: the
+    # browser names it in the next request, and Dash kills its process.
+    def decorator(func):
+        if manager is not None:
+            @functools.wraps(func)
+            def run_job(*args):
+                return manager.run_job(func, *args)
+            return callback(*dependencies, background=True, manager=manager, progress=progress,
+                            running=running, interval=POLL_INTERVAL_MS, **kwargs)(run_job)
+
+        @functools.wraps(func)
+        def run_inline(*args):
+            return func(ignore_progress, *args)
+        return callback(*dependencies, **kwargs)(run_inline)
+
+    return decorator
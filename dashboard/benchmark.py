@@ -0,0 +1,261 @@
+# benchmark.py
+# Times the dashboard's callback pipeline without a browser. For each data
+# scale a synthetic store is generated (once), app.py is imported against it
+# in a fresh process, and filter_data_by_time_range() and the callback a time
+# range button triggers are driven for every time range. The callback is
+# requested through the Flask test client as the browser requests it, so
+# the timings include Dash's dispatch, serialization and compression; the
+# axis dropdowns are handled in the browser and cost no request.
+# Results are saved as JSON; pass --compare to diff against an earlier run.
+import argparse
+import gzip
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCALES = [1_000, 100_000, 10_000_000]
+# Every dataset covers the same time span, so each time range selects the
+# same share of rows at every scale
+SPAN = pd.Timedelta(days=28)
+SEED = 42
+TIME_RANGES = ['24h', 'week', 'all']
+# Input of the callback a time range button triggers
+TIME_RANGE_INPUT = 'selected-time-range.data'
+# Components of that callback's response that are Plotly figures
+FIGURE_OUTPUTS = ['mirror-status-chart', 'detection-patterns']
+PERCENTILES = [50, 90, 99]
+# Metrics compared between runs, and how much slower counts as a regression
+COMPARE_METRICS = ['filter_ms', 'cold_ms', 'warm_ms']
+REGRESSION_RATIO = 1.2
+
+
+def dataset_path(data_dir, rows):
+    return os.path.join(data_dir, f'store_{rows}_{SEED}')
+
+
+def ensure_dataset(data_dir, rows):
+    # Generate the store once and reuse it on later runs
+    from create_dummy_data import write_dummy_data
+    from store import META_FILE
+
+    path = dataset_path(data_dir, rows)
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        freq = (SPAN / rows).round('ms')
+        print(f"Generating {rows:,} rows at {freq} intervals in {path}", file=sys.stderr)
+        write_dummy_data(path, rows, freq=freq, seed=SEED, output='store')
+    return path
+
+
+def summarize(samples):
+    # Latency samples (seconds) -> milliseconds summary
+    ms = np.asarray(samples) * 1000
+    summary = {f'p{p}': round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+    summary.update({'min': round(float(ms.min()), 3), 'max': round(float(ms.max()), 3),
+                    'mean': round(float(ms.mean()), 3), 'n': len(ms)})
+    return summary
+
+
+def timed(func, repeat, before=None):
+    samples = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_worker(repeat):
+    # Runs inside a fresh process with DETECTION_STORE_PATH set (see run_scale)
+    start = time.perf_counter()
+    import app
+    load_seconds = time.perf_counter() - start
+    app.log_tailer.stop()
+
+    from plotly.io.json import to_json_plotly
+
+    from loadtest import UPDATE_ROUTE, dependency_outputs, layout_values, prop_key
+
+    client = app.server.test_client()
+    values = layout_values(client.get('/_dash-layout').get_json(), {})
+    dependency = next(dependency for dependency in client.get('/_dash-dependencies').get_json()
+                      if any(prop_key(spec) == TIME_RANGE_INPUT for spec in dependency['inputs'])
+                      and not dependency.get('clientside_function'))
+
+    def clear_cache():
+        app.result_cache.invalidate()
+
+    def request(time_range):
+        # The callback request the browser sends after a time range click,
+        # accepting gzip like a browser
+        page = dict(values, **{TIME_RANGE_INPUT: time_range})
+        response = client.post(UPDATE_ROUTE, headers={'Accept-Encoding': 'gzip'}, json={
+            'output': dependency['output'],
+            'outputs': dependency_outputs(dependency),
+            'inputs': [{**spec, 'value': page.get(prop_key(spec))} for spec in dependency['inputs']],
+            'state': [{**spec, 'value': page.get(prop_key(spec))} for spec in dependency['state']],
+            'changedPropIds': [TIME_RANGE_INPUT]
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"{UPDATE_ROUTE} returned {response.status_code} for {time_range}")
+        return response
+
+    combinations = []
+    for time_range in TIME_RANGES:
+        filter_samples = timed(lambda: app.filter_data_by_time_range(time_range), repeat)
+        filtered_rows = len(app.filter_data_by_time_range(time_range))
+
+        # Cold: every memoized result recomputed; warm: served from the cache
+        cold = timed(lambda: request(time_range), repeat, before=clear_cache)
+        warm = timed(lambda: request(time_range), repeat)
+
+        clear_cache()
+        tracemalloc.start()
+        response = request(time_range)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        sent = response.get_data()
+        body = gzip.decompress(sent) if response.headers.get('Content-Encoding') == 'gzip' else sent
+        sizes = {component: len(to_json_plotly(props).encode('utf-8'))
+                 for component, props in json.loads(body)['response'].items()}
+        combinations.append({
+            'time_range': time_range,
+            'filtered_rows': filtered_rows,
+            'filter_ms': summarize(filter_samples),
+            'cold_ms': summarize(cold),
+            'warm_ms': summarize(warm),
+            'peak_memory_bytes': peak,
+            'output_bytes': sizes,
+            'figure_bytes': {name: sizes[name] for name in FIGURE_OUTPUTS},
+            'total_output_bytes': sum(sizes.values()),
+            # As sent (see compression.py)
+            'total_output_gzip_bytes': len(sent)
+        })
+
+    return {
+        'rows': len(app.detections),
+        'load_seconds': round(load_seconds, 3),
+        # ru_maxrss is kilobytes on Linux
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'combinations': combinations
+    }
+
+
+def run_scale(store_path, repeat):
+    # Import app.py against one dataset in its own process, so load time and
+    # peak memory are not skewed by earlier scales
+    work_dir = tempfile.mkdtemp(prefix='motorcycle_dashboard_bench_')
+    env = dict(os.environ,
+               DETECTION_STORE_PATH=store_path,
+               DETECTION_DATA_PATH=os.path.join(work_dir, 'missing.csv'),
+               DETECTION_LOG_PATH=os.path.join(work_dir, 'detections.log'),
+               RESULT_CACHE_PATH=os.path.join(work_dir, 'cache.sqlite'),
+               # Every range is rendered in the request, not handed to a job
+               BACKGROUND_CALLBACKS='0')
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', '--repeat', str(repeat)],
+        cwd=BASE_DIR, env=env, check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def combination_key(combination):
+    return (combination['time_range'],)
+
+
+def compare(results, baseline):
+    # Print p50 latencies against a previous results file; returns the number
+    # of regressions
+    regressions = 0
+    for rows, scale in results['scales'].items():
+        previous = baseline['scales'].get(rows)
+        if previous is None:
+            continue
+        before = {combination_key(c): c for c in previous['combinations']}
+        for combination in scale['combinations']:
+            old = before.get(combination_key(combination))
+            if old is None:
+                continue
+            for metric in COMPARE_METRICS:
+                ratio = combination[metric]['p50'] / max(old[metric]['p50'], 1e-6)
+                if ratio > REGRESSION_RATIO:
+                    regressions += 1
+                    print(f"REGRESSION rows={rows} {'/'.join(combination_key(combination))} {metric}: "
+                          f"{old[metric]['p50']:.2f} -> {combination[metric]['p50']:.2f} ms ({ratio:.2f}x)")
+            if combination['total_output_bytes'] > old['total_output_bytes'] * REGRESSION_RATIO:
+                regressions += 1
+                print(f"REGRESSION rows={rows} {'/'.join(combination_key(combination))} output size: "
+                      f"{old['total_output_bytes']:,} -> {combination['total_output_bytes']:,} bytes")
+    return regressions
+
+
+def print_summary(results):
+    print(f"{'rows':>10} {'range':>5} {'filter p50':>10} "
+          f"{'cold p50':>9} {'cold p99':>9} {'warm p50':>9} {'peak MB':>8} {'out KB':>7} {'gz KB':>6}")
+    for rows, scale in results['scales'].items():
+        for c in scale['combinations']:
+            print(f"{int(rows):>10,} {c['time_range']:>5} "
+                  f"{c['filter_ms']['p50']:>10.3f} {c['cold_ms']['p50']:>9.2f} {c['cold_ms']['p99']:>9.2f} "
+                  f"{c['warm_ms']['p50']:>9.3f} {c['peak_memory_bytes'] / 2**20:>8.1f} "
+                  f"{c['total_output_bytes'] / 1024:>7.1f} {c.get('total_output_gzip_bytes', 0) / 1024:>6.1f}")
+        print(f"{int(rows):>10,} load {scale['load_seconds']:.2f}s, max RSS {scale['max_rss_bytes'] / 2**20:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard callback pipeline")
+    parser.add_argument('--rows', type=int, nargs='+', default=SCALES, help="Dataset sizes to run")
+    parser.add_argument('--repeat', type=int, default=10, help="Timed calls per measurement")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'motorcycle_dashboard_bench'))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.repeat)))
+        sys.exit(0)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'scales': {}
+    }
+    for rows in args.rows:
+        results['scales'][str(rows)] = run_scale(ensure_dataset(args.data_dir, rows), args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_summary(results)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        print(f"{regressions} regression(s) against {args.compare}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,166 @@
+import functools
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Results shared by every worker process through one SQLite file. Entries
+# are keyed on (function, arguments, data version), so ingesting new data
+# makes old entries unreachable; they are dropped by invalidate() or age out.
+CACHE_PATH = os.environ.get(
+    'RESULT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'motorcycle_dashboard_cache.sqlite')
+)
+CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 300))
+CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 512))
+# Per-process LRU in front of the shared store, so hot entries skip SQLite
+LOCAL_SIZE = 64
+
+
+class ResultCache:
+
+    def __init__(self, version, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_SIZE, metrics=None):
+        # version: callable returning the current data version string;
+        # metrics: Metrics that counts lookups by outcome
+        self.version = version
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._connections = threading.local()
+        # Held around writes to the shared store and taken before any fork:
+        # a child forked mid-write (a background job) would inherit SQLite's
+        # record of the write lock and wait on it until it timed out
+        self._write_lock = threading.Lock()
+        # Both are taken before any fork, so a job never inherits the local
+        # cache's lock held by another thread; neither is held while taking
+        # the other
+        for lock in (self._lock, self._write_lock):
+            os.register_at_fork(before=lock.acquire, after_in_parent=lock.release, after_in_child=lock.release)
+
+    def _connect(self):
+        # One connection per thread and per process (connections do not
+        # survive a fork)
+        conn = getattr(self._connections, 'conn', None)
+        if conn is not None and self._connections.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        with self._write_lock:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, version TEXT, value BLOB, expires REAL, accessed REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self._connections.conn = conn
+        self._connections.pid = os.getpid()
+        return conn
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry
+
+    def _put_local(self, key, expires, value):
+        with self._lock:
+            self._local[key] = (expires, value)
+            self._local.move_to_end(key)
+            while len(self._local) > LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        # (found, value)
+        entry = self._get_local(key)
+        if entry is not None:
+            return True, entry[1]
+        if not self.path:
+            return False, None
+        try:
+            conn = self._connect()
+            now = time.time()
+            row = conn.execute(
+                'SELECT value, expires FROM results WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return False, None
+            with self._write_lock:
+                conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            value = pickle.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"Result cache read failed: {e}")
+            return False, None
+        self._put_local(key, row[1], value)
+        return True, value
+
+    def put(self, key, version, value):
+        expires = time.time() + self.ttl
+        self._put_local(key, expires, value)
+        if not self.path:
+            return
+        try:
+            conn = self._connect()
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._write_lock:
+                conn.execute(
+                    'INSERT OR REPLACE INTO results (key, version, value, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                    (key, version, data, expires, time.time())
+                )
+                # Least recently used entries beyond the size limit go first
+                conn.execute(
+                    'DELETE FROM results WHERE expires <= ? OR key IN ('
+                    'SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                    (time.time(), self.max_entries)
+                )
+        except sqlite3.Error as e:
+            print(f"Result cache write failed: {e}")
+
+    def invalidate(self, version=None):
+        # Drop the entries computed against version, the one this process
+        # has just moved past (every entry when None). Workers apply new
+        # records at slightly different times, so entries of any other
+        # version may be another worker's current ones; they are left to
+        # age out.
+        with self._lock:
+            self._local.clear()
+        if not self.path:
+            return
+        try:
+            conn = self._connect()
+            with self._write_lock:
+                if version is None:
+                    conn.execute('DELETE FROM results')
+                else:
+                    conn.execute('DELETE FROM results WHERE version = ?', (version,))
+        except sqlite3.Error as e:
+            print(f"Result cache invalidation failed: {e}")
+
+    def memoize(self, func):
+        # Cache func's result per (arguments, data version). Arguments must be
+        # JSON-serializable; results must be picklable and are shared, so
+        # callers must not modify them.
+        @functools.wraps(func)
+        def wrapper(*args):
+            version = self.version()
+            key = json.dumps([func.__qualname__, args, version], sort_keys=True, default=str)
+            found, value = self.get(key)
+            if self.metrics is not None:
+                self.metrics.inc('dashboard_cache_requests_total', result='hit' if found else 'miss')
+            if found:
+                return value
+            value = func(*args)
+            self.put(key, version, value)
+            return value
+
+        return wrapper
@@ -0,0 +1,11 @@
+import numpy as np
+
+# Compact figure data. The plotly.js bundled with dcc (2.24) has no typed
+# array ({'dtype', 'bdata'}) decoder, and plotly.py encodes every numpy
+# array it is given that way, so figure data goes out as plain lists.
+
+
+def epoch_ms(timestamps):
+    # datetime64 values -> int64 milliseconds, which a date axis reads
+    # directly (and which take a third of the room of ISO strings)
+    return np.asarray(timestamps, dtype='datetime64[ms]').astype(np.int64)
@@ -0,0 +1,86 @@
+import gzip
+import threading
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # gzip only
+    brotli = None
+
+# Compressed responses for the Dash routes. Callback and layout responses are
+# compressed per request at a fast level; the component bundles and assets
+# never change while the server runs, so they are compressed once at the
+# highest level and kept in memory.
+MIN_SIZE = 512
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+DYNAMIC_LEVELS = {'br': 4, 'gzip': 6}
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# (encoding, length, crc32 of the original bytes) -> compressed bytes
+_static_cache = {}
+_static_lock = threading.Lock()
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    # mtime=0 keeps the output identical between calls and workers
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_static(data, encoding):
+    key = (encoding, len(data), zlib.crc32(data))
+    with _static_lock:
+        compressed = _static_cache.get(key)
+    if compressed is None:
+        compressed = compress(data, encoding, STATIC_LEVELS[encoding])
+        with _static_lock:
+            _static_cache[key] = compressed
+    return compressed
+
+
+def is_compressible(response):
+    return (response.status_code == 200
+            and 'Content-Encoding' not in response.headers
+            and (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)
+            # Generators stream as they go and cannot be compressed up front
+            and (response.direct_passthrough or not response.is_streamed))
+
+
+def register_compression(server, static_prefixes=()):
+    # static_prefixes: URL prefixes of responses that are the same bytes on
+    # every request (the compressed copy is cached)
+    @server.after_request
+    def compress_response(response):
+        if not is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if encoding is None:
+            return response
+
+        # send_file() responses hand the file straight to the server
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        if request.path.startswith(tuple(static_prefixes)):
+            compressed = compress_static(data, encoding)
+        else:
+            compressed = compress(data, encoding, DYNAMIC_LEVELS[encoding])
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Accept-Ranges', None)
+        # Byte offsets no longer match the file; a weak ETag still lets the
+        # browser revalidate with If-None-Match
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return compress_response
@@ -0,0 +1,154 @@
+# convert_data.py
+# Convert a detections CSV into the memory-mapped columnar store read by app.py
+# (or, with --sqlite, into the SQLite database of sqlstore.py). The CSV is
+# streamed in chunks, so it never has to fit in memory.
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+from sqlstore import DB_PATH, INSERT_CHUNKSIZE, build_database
+from store import (COUNT_COLUMNS, CATEGORY_COLUMNS, EXTRA_COLUMNS, META_FILE, SITE_COLUMN,
+                   COUNT_DTYPE, HOUR_DTYPE, CODE_DTYPE, EXTRA_DTYPE, check_range, is_sorted_by_site)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def count_rows(csv_path):
+    # Data rows in the CSV (lines minus the header)
+    lines = 0
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            lines += 1
+    return max(0, lines - 1)
+
+
+class StoreWriter:
+    # Writes a columnar store of a known row count, chunk by chunk. The meta
+    # file is written last and marks the store as complete.
+
+    def __init__(self, store_path, rows, extra_columns=()):
+        self.store_path = store_path
+        self.rows = rows
+        self.extra_columns = [column for column in EXTRA_COLUMNS if column in extra_columns]
+        self.offset = 0
+        os.makedirs(store_path, exist_ok=True)
+        self.meta_path = os.path.join(store_path, META_FILE)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+        self.timestamps = self._block('timestamp', 'datetime64[ns]', (rows,))
+        self.counts = self._block('counts', COUNT_DTYPE, (len(COUNT_COLUMNS), rows))
+        self.hours = self._block('hour', HOUR_DTYPE, (rows,))
+        self.codes = {column: self._block(column, CODE_DTYPE, (rows,)) for column in CATEGORY_COLUMNS}
+        self.extras = {column: self._block(column, EXTRA_DTYPE, (rows,)) for column in self.extra_columns}
+        # Category -> code, in order of first appearance
+        self.categories = {column: {} for column in CATEGORY_COLUMNS}
+
+    def _block(self, name, dtype, shape):
+        return open_memmap(os.path.join(self.store_path, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+    def _arrays(self):
+        return [self.timestamps, self.counts, self.hours, *self.codes.values(), *self.extras.values()]
+
+    def write(self, chunk):
+        offset, end = self.offset, self.offset + len(chunk)
+        if end > self.rows:
+            raise ValueError(f"More than the expected {self.rows:,} rows were written")
+        self.timestamps[offset:end] = chunk['timestamp'].to_numpy()
+        for i, column in enumerate(COUNT_COLUMNS):
+            check_range(column, chunk[column], COUNT_DTYPE)
+            self.counts[i, offset:end] = chunk[column].to_numpy()
+        check_range('hour', chunk['hour'], HOUR_DTYPE)
+        self.hours[offset:end] = chunk['hour'].to_numpy()
+        for column in CATEGORY_COLUMNS:
+            mapping = self.categories[column]
+            for value in chunk[column].unique():
+                mapping.setdefault(value, len(mapping))
+            if len(mapping) > np.iinfo(CODE_DTYPE).max:
+                raise ValueError(f"Column '{column}' has too many distinct values")
+            self.codes[column][offset:end] = chunk[column].map(mapping).to_numpy()
+        for column in self.extra_columns:
+            check_range(column, chunk[column], EXTRA_DTYPE)
+            self.extras[column][offset:end] = chunk[column].to_numpy()
+        self.offset = end
+
+    def close(self, chunksize=1_000_000):
+        rows = self.offset
+        # Re-number categories in lexical order, matching compact_dtypes()
+        meta_categories = {}
+        for column in CATEGORY_COLUMNS:
+            ordered = sorted(self.categories[column])
+            remap = np.empty(len(ordered), dtype=CODE_DTYPE)
+            for new_code, value in enumerate(ordered):
+                remap[self.categories[column][value]] = new_code
+            codes = self.codes[column]
+            for start in range(0, rows, chunksize):
+                codes[start:start + chunksize] = remap[codes[start:start + chunksize]]
+            meta_categories[column] = ordered
+
+        # The store must be sorted by timestamp (by site first, if there are
+        # sites); sort once here if the input was not. Only the rows written
+        # count: the blocks were sized from the CSV's line count, which
+        # blank lines make larger.
+        timestamps = self.timestamps[:rows]
+        sites = self.extras[SITE_COLUMN][:rows] if SITE_COLUMN in self.extras else None
+        order = None
+        if sites is not None:
+            if rows and not is_sorted_by_site(sites, timestamps):
+                order = np.lexsort((timestamps, sites))
+        elif rows and not (np.diff(timestamps) >= np.timedelta64(0)).all():
+            order = np.argsort(timestamps, kind='stable')
+        if order is not None:
+            timestamps[:] = timestamps[order]
+            for i in range(len(COUNT_COLUMNS)):
+                self.counts[i, :rows] = self.counts[i, :rows][order]
+            self.hours[:rows] = self.hours[:rows][order]
+            for array in [*self.codes.values(), *self.extras.values()]:
+                array[:rows] = array[:rows][order]
+
+        for array in self._arrays():
+            array.flush()
+        with open(self.meta_path, 'w') as f:
+            json.dump({
+                'rows': rows,
+                'count_columns': COUNT_COLUMNS,
+                'categories': meta_categories,
+                'extra_columns': self.extra_columns
+            }, f, indent=2)
+        return rows
+
+
+def convert(csv_path, store_path, chunksize=1_000_000):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    writer = StoreWriter(store_path, count_rows(csv_path), extra_columns=header)
+    for chunk in pd.read_csv(csv_path, parse_dates=['timestamp'], chunksize=chunksize):
+        writer.write(chunk)
+    return writer.close(chunksize)
+
+
+def convert_sqlite(csv_path, db_path, chunksize=INSERT_CHUNKSIZE):
+    return build_database(db_path, pd.read_csv(csv_path, parse_dates=['timestamp'], chunksize=chunksize))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a detections CSV into the columnar data store")
+    parser.add_argument('csv_path', nargs='?', default=os.path.join(BASE_DIR, 'data.csv'))
+    parser.add_argument('store_path', nargs='?', default=os.path.join(BASE_DIR, 'data_store'))
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--sqlite', nargs='?', const=DB_PATH, metavar='DB_PATH',
+                        help="Write an SQLite database (DETECTION_BACKEND=sqlite) instead of the store")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        rows = convert_sqlite(args.csv_path, args.sqlite, min(args.chunksize, INSERT_CHUNKSIZE))
+        print(f"Wrote {rows:,} rows to {args.sqlite}")
+    else:
+        rows = convert(args.csv_path, args.store_path, args.chunksize)
+        print(f"Wrote {rows:,} rows to {args.store_path}")
@@ -1,46 +1,118 @@
 # generate_dummy_data.py
+# Synthetic detections for development and scale testing. Rows are generated
+# in vectorized chunks and streamed to a CSV or to the columnar data store,
+# so row counts in the tens of millions never have to fit in memory.
+import argparse
+import os
+
 import pandas as pd
 import numpy as np
-from datetime import timedelta
-
-def create_dummy_data():
-    np.random.seed(42)
-    dates = pd.date_range(start='2024-01-01 07:00:00', periods=168, freq='1H')
-    
-    data = []
-    for i, date in enumerate(dates):
-        hour = date.hour
-        base_compliance = 0.6 + 0.3 * np.sin((hour - 6) * np.pi / 12)
-        noise = np.random.normal(0, 0.15)
-        compliance_rate = max(0.1, min(0.95, base_compliance + noise))
-
-        total_detections = np.random.poisson(12) + 5
-        helmet_compliance = int(total_detections * compliance_rate)
-        child_passengers = np.random.poisson(1.5) if np.random.random() < 0.4 else 0
-
-        mirror_probs = np.random.dirichlet([2, 3, 4])
-        mirror_counts = np.random.multinomial(total_detections, mirror_probs)
-        no_mirror = mirror_counts[0]
-        left_mirror = mirror_counts[1]
-        right_mirror = mirror_counts[2]
-        both_mirrors = mirror_counts[1] + mirror_counts[2]
-
-        data.append({
-            'timestamp': date,
-            'helmet_compliance': helmet_compliance,
-            'total_detections': total_detections,
-            'child_passengers': child_passengers,
-            'no_mirror': no_mirror,
-            'left_mirror': left_mirror,
-            'right_mirror': right_mirror,
-            'both_mirrors': both_mirrors,
-            'time_window': f"{date.strftime('%H:%M')}-{(date + timedelta(hours=1)).strftime('%H:%M')}",
-            'hour': hour,
-            'day_of_week': date.strftime('%A')
-        })
-    
-    return pd.DataFrame(data)
+
+from convert_data import StoreWriter
+from store import COUNT_COLUMNS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+START = '2024-01-01 07:00:00'
+CHUNKSIZE = 1_000_000
+COLUMNS = ['timestamp'] + COUNT_COLUMNS + ['time_window', 'hour', 'day_of_week']
+
+# Labels looked up by hour / weekday number instead of formatted per row
+TIME_WINDOWS = np.array([f"{hour:02d}:00-{(hour + 1) % 24:02d}:00" for hour in range(24)], dtype=object)
+DAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+
+
+def generate_chunk(rng, timestamps, cameras=1, sites=1):
+    # One row per (timestamp, camera), cameras interleaved within each
+    # timestamp. Each site has `cameras` cameras; camera ids are global.
+    feeds = cameras * sites
+    timestamps = pd.DatetimeIndex(timestamps).repeat(feeds)
+    n = len(timestamps)
+    hour = timestamps.hour.to_numpy()
+
+    base_compliance = 0.6 + 0.3 * np.sin((hour - 6) * np.pi / 12)
+    compliance_rate = np.clip(base_compliance + rng.normal(0, 0.15, n), 0.1, 0.95)
+
+    total_detections = rng.poisson(12, n) + 5
+    helmet_compliance = (total_detections * compliance_rate).astype(np.int64)
+    child_passengers = np.where(rng.random(n) < 0.4, rng.poisson(1.5, n), 0)
+
+    # Dirichlet-multinomial: per-row mirror shares, then counts drawn from them
+    mirror_probs = rng.dirichlet([2, 3, 4], n)
+    mirror_counts = rng.multinomial(total_detections, mirror_probs)
+
+    chunk = pd.DataFrame({
+        'timestamp': timestamps,
+        'helmet_compliance': helmet_compliance,
+        'total_detections': total_detections,
+        'child_passengers': child_passengers,
+        'no_mirror': mirror_counts[:, 0],
+        'left_mirror': mirror_counts[:, 1],
+        'right_mirror': mirror_counts[:, 2],
+        'both_mirrors': mirror_counts[:, 1] + mirror_counts[:, 2],
+        'time_window': TIME_WINDOWS[hour],
+        'hour': hour,
+        'day_of_week': DAY_NAMES[timestamps.dayofweek.to_numpy()]
+    })
+    feed = np.tile(np.arange(feeds, dtype=np.int32), n // feeds)
+    if sites > 1:
+        chunk['site_id'] = feed // cameras
+    if feeds > 1:
+        chunk['camera_id'] = feed
+    return chunk
+
+
+def generate_chunks(rows, freq='1h', cameras=1, seed=42, start=START, chunksize=CHUNKSIZE, sites=1):
+    # Yields DataFrames of at most about chunksize rows, rows in total
+    rng = np.random.default_rng(seed)
+    feeds = cameras * sites
+    periods = -(-rows // feeds)
+    step = max(1, chunksize // feeds)
+    start = pd.Timestamp(start)
+    offset = pd.tseries.frequencies.to_offset(freq)
+    produced = 0
+    for first in range(0, periods, step):
+        timestamps = pd.date_range(start + first * offset, periods=min(step, periods - first), freq=offset)
+        chunk = generate_chunk(rng, timestamps, cameras, sites)
+        chunk = chunk.iloc[:rows - produced]
+        produced += len(chunk)
+        yield chunk
+
+
+def create_dummy_data(rows=168, freq='1h', cameras=1, seed=42, sites=1):
+    # Small datasets in memory; use write_dummy_data() for large ones
+    return pd.concat(generate_chunks(rows, freq, cameras, seed, sites=sites), ignore_index=True)
+
+
+def write_dummy_data(path, rows, freq='1h', cameras=1, seed=42, output='csv', chunksize=CHUNKSIZE, sites=1):
+    chunks = generate_chunks(rows, freq, cameras, seed, chunksize=chunksize, sites=sites)
+    if output == 'store':
+        extra_columns = (['site_id'] if sites > 1 else []) + (['camera_id'] if cameras * sites > 1 else [])
+        writer = StoreWriter(path, rows, extra_columns=extra_columns)
+        for chunk in chunks:
+            writer.write(chunk)
+        return writer.close()
+
+    written = 0
+    for chunk in chunks:
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += len(chunk)
+    return written
+
 
 if __name__ == "__main__":
-    df = create_dummy_data()
-    df.to_csv("dashboard/data.csv", index=False)  # Save to file (adjust path if needed)
+    parser = argparse.ArgumentParser(description="Generate synthetic detection data")
+    parser.add_argument('path', nargs='?', help="Output file (csv) or directory (store)")
+    parser.add_argument('--rows', type=int, default=168)
+    parser.add_argument('--freq', default='1h', help="Time between readings of one camera")
+    parser.add_argument('--cameras', type=int, default=1, help="Cameras per site")
+    parser.add_argument('--sites', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(BASE_DIR, 'data.csv' if args.format == 'csv' else 'data_store')
+    rows = write_dummy_data(path, args.rows, args.freq, args.cameras, args.seed, args.format, args.chunksize,
+                            args.sites)
+    print(f"Wrote {rows:,} rows to {path}")
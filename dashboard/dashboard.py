@@ -1,27 +1,118 @@
+import os
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from frames import frame_store, recent_frames
+from ingest import records_to_frame
+from queries import get_daily_data, get_kpis, get_mirror_data, get_totals, make_log_tailer, open_detections
+from sites import ALL_SITES
+
+# Same data store and queries as the Dash app (app.py). Streamlit reruns the
+# whole script on every widget interaction, so the data is loaded once per
+# server process (st.cache_resource) and aggregates and figures are memoized
+# (st.cache_data) on the data version and their inputs.
+DATA_PATH = os.environ.get('DETECTION_DATA_PATH', os.path.join(os.path.dirname(__file__), 'data.csv'))
+STORE_PATH = os.environ.get('DETECTION_STORE_PATH', os.path.join(os.path.dirname(__file__), 'data_store'))
+
+TIME_RANGES = {'all': "All Time", 'week': "Last 7 Days", '24h': "Last 24 Hours"}
+
+
+@st.cache_resource
+def load_detections():
+    # (detections, data source id), from the backend chosen by
+    # DETECTION_BACKEND as in the Dash app
+    detections, source_id = open_detections(STORE_PATH, DATA_PATH)
+
+    # Keep following the detection log, as the Dash app does; the data
+    # version below changes with every append
+    def ingest_records(records):
+        detections.append(records_to_frame(records))
+    make_log_tailer(detections, ingest_records).start()
+    return detections, source_id
+
+
+def get_data_version(detections, source_id):
+    return f"{source_id}:{len(detections)}:{detections.rebuilds}"
+
+
+# Arguments starting with an underscore are not hashed: cached results are
+# keyed on the version string instead of the data itself
+@st.cache_data(max_entries=64)
+def cached_kpis(_detections, version, time_range, site):
+    kpis = get_kpis(_detections, time_range, site)
+    kpis['child_passengers'] = int(round(get_totals(_detections, time_range, site)['child_passengers']))
+    return kpis
+
+
+@st.cache_data(max_entries=64)
+def build_violation_figure(_detections, version, time_range, site):
+    totals = get_totals(_detections, time_range, site)
+    bar_data = pd.DataFrame({
+        'Violation': ['No Helmet', 'No Mirrors'],
+        'Count': [int(round(totals['total_detections'] - totals['helmet_compliance'])),
+                  int(round(totals['no_mirror']))]
+    })
+    fig_bar = px.bar(bar_data, x='Violation', y='Count', text='Count', color='Violation')
+    fig_bar.update_traces(textposition='outside')
+    fig_bar.update_layout(showlegend=False)
+    return fig_bar
+
+
+@st.cache_data(max_entries=64)
+def build_mirror_figure(_detections, version, time_range, site):
+    mirror_data = get_mirror_data(_detections, time_range, site)
+    pie_data = pd.DataFrame({
+        'Mirror Status': list(mirror_data.keys()),
+        'Count': list(mirror_data.values())
+    })
+    return px.pie(pie_data, names='Mirror Status', values='Count', hole=0.4)
+
+
+@st.cache_data(max_entries=64)
+def build_helmet_usage_figure(_detections, version, time_range, site):
+    daily = get_daily_data(_detections, time_range, site)
+    line_data = pd.DataFrame({
+        'Date': daily.index,
+        'Helmet Usage Rate (%)': daily['helmet_compliance_rate'].round(1).to_numpy()
+    })
+    return px.line(line_data, x='Date', y='Helmet Usage Rate (%)', markers=True)
+
+
 # Page configuration
 st.set_page_config(
     layout="wide",
     page_title="Motorcycle Safety Insights Dashboard"
 )
 
+detections, source_id = load_detections()
+version = get_data_version(detections, source_id)
+
+# Filters
+time_range = st.sidebar.selectbox("Time Range", list(TIME_RANGES), format_func=TIME_RANGES.get)
+site = st.sidebar.selectbox(
+    "Site", [ALL_SITES] + list(detections.sites),
+    format_func=lambda site: "All sites" if site == ALL_SITES else f"Site {site}"
+)
+
 # Title
 st.markdown("<h1 style='text-align: center;'>🏍️ MOTORCYCLE SAFETY INSIGHTS DASHBOARD</h1>", unsafe_allow_html=True)
 st.markdown("---")
 
 # ---- METRICS SECTION ----
 st.markdown("### Key Safety Indicators")
+kpis = cached_kpis(detections, version, time_range, site)
 kpi1, kpi2, kpi3 = st.columns(3)
 
 with kpi1:
-    st.metric(label="Helmet Compliance Rate (%)", value="78%")
+    # No detections in the window leave the rate undefined
+    compliance = kpis['avg_helmet_compliance']
+    st.metric(label="Helmet Compliance Rate (%)", value="–" if pd.isna(compliance) else f"{compliance:.0f}%")
 with kpi2:
-    st.metric(label="Total Motorcycle Detections", value="1,242")
+    st.metric(label="Total Motorcycle Detections", value=f"{kpis['total_detections']:,}")
 with kpi3:
-    st.metric(label="Child Passengers Detected", value="67")
+    st.metric(label="Child Passengers Detected", value=f"{kpis['child_passengers']:,}")
 
 st.markdown("---")
 
@@ -31,36 +122,30 @@ left_col, right_col = st.columns([2, 1], gap="large")
 # LEFT: Latest Frame
 with left_col:
     st.subheader("📸 Latest Detected Frame")
-    st.image("latest_frame.jpg", caption="Most recent detection", use_column_width=True)
+    # Frames are resized when they are ingested; this only reads the stored
+    # display rendition
+    frames = recent_frames()
+    if not frames:
+        st.info("No frame available yet")
+    else:
+        frame_id = frames[0]
+        if len(frames) > 1:
+            # Oldest to newest, starting at the newest
+            frame_id = st.select_slider(
+                "Recent frames", options=frames[::-1], value=frames[0], label_visibility="collapsed",
+                format_func=lambda frame_id: f"{frames.index(frame_id)} frames ago" if frame_id != frames[0] else "Latest"
+            )
+        caption = "Most recent detection" if frame_id == frames[0] else "Earlier detection"
+        st.image(frame_store.load(frame_id, 'display'), caption=caption, use_column_width=True)
 
 # RIGHT: Charts Stacked Vertically
 st.subheader("🚨 Violation Types")
-bar_data = pd.DataFrame({
-    'Violation': ['No Helmet', 'Overloaded', 'Wrong Lane', 'No Mirrors'],
-    'Count': [130, 55, 22, 150]
-})
-fig_bar = px.bar(bar_data, x='Violation', y='Count', text='Count', color='Violation')
-fig_bar.update_traces(textposition='outside')
-fig_bar.update_layout(showlegend=False)
-st.plotly_chart(fig_bar, use_container_width=True)
+st.plotly_chart(build_violation_figure(detections, version, time_range, site), use_container_width=True)
 with right_col:
     # Pie Chart
     st.subheader("🪞 Mirror Status Breakdown")
-    pie_data = pd.DataFrame({
-        'Mirror Status': ['Both', 'Left Only', 'Right Only', 'None'],
-        'Count': [520, 110, 90, 150]
-    })
-    fig_pie = px.pie(pie_data, names='Mirror Status', values='Count', hole=0.4)
-    st.plotly_chart(fig_pie, use_container_width=True)
+    st.plotly_chart(build_mirror_figure(detections, version, time_range, site), use_container_width=True)
 
     # Line Chart
     st.subheader("⏱️ Helmet Usage Over Time")
-    line_data = pd.DataFrame({
-        'Date': pd.date_range(start="2025-05-28", periods=7),
-        'Helmet Usage Rate (%)': [55, 60, 63, 70, 74, 76, 78]
-    })
-    fig_line = px.line(line_data, x='Date', y='Helmet Usage Rate (%)', markers=True)
-    st.plotly_chart(fig_line, use_container_width=True)
-
-    # Bar Chart
-    
+    st.plotly_chart(build_helmet_usage_figure(detections, version, time_range, site), use_container_width=True)
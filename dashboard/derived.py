@@ -0,0 +1,66 @@
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+# Derived metrics, each defined once as a weighted sum of count columns over a
+# denominator column. They are not stored per record: a view sums the counts
+# over the rows or cube cells it covers, and every metric it needs is then
+# evaluated from those sums in one matrix product. A rate is thereby always
+# the ratio of the summed counts, consistent with the count totals beside it.
+Metric = namedtuple('Metric', ['numerator', 'denominator', 'scale'], defaults=[100])
+
+MIRROR_COLUMNS = ['left_mirror', 'right_mirror', 'both_mirrors']
+
+# Name -> Metric; numerator maps count column -> weight
+DERIVED_METRICS = {
+    'helmet_compliance_rate': Metric({'helmet_compliance': 1}, 'total_detections'),
+    'child_passenger_ratio': Metric({'child_passengers': 1}, 'total_detections'),
+    'mirror_coverage_rate': Metric({column: 1 for column in MIRROR_COLUMNS}, 'total_detections'),
+    # 60% helmet compliance rate + 40% mirror coverage rate
+    'safety_score': Metric({'helmet_compliance': 0.6, **{column: 0.4 for column in MIRROR_COLUMNS}}, 'total_detections')
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_metrics(names):
+    # (input columns, numerator weights, denominator weights, scales) for the
+    # named metrics: metric i is scale[i] * (sums @ numerators[:, i]) /
+    # (sums @ denominators[:, i])
+    metrics = [DERIVED_METRICS[name] for name in names]
+    columns = sorted({column for metric in metrics for column in [*metric.numerator, metric.denominator]})
+    numerators = np.zeros((len(columns), len(metrics)))
+    denominators = np.zeros((len(columns), len(metrics)))
+    for i, metric in enumerate(metrics):
+        for column, weight in metric.numerator.items():
+            numerators[columns.index(column), i] = weight
+        denominators[columns.index(metric.denominator), i] = 1
+    return columns, numerators, denominators, np.array([metric.scale for metric in metrics], dtype=np.float64)
+
+
+def metric_columns(names):
+    # Count columns the named metrics are computed from
+    return compile_metrics(tuple(names))[0]
+
+
+def evaluate(sums, names):
+    # Metrics from an array of summed counts (rows = groups) whose columns
+    # are metric_columns(names); NaN where the denominator is zero
+    _, numerators, denominators, scales = compile_metrics(tuple(names))
+    sums = np.asarray(sums, dtype=np.float64)
+    numerator = sums @ numerators
+    denominator = sums @ denominators
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator != 0, scales * numerator / denominator, np.nan)
+
+
+def with_metrics(grouped, names):
+    # Summed counts per group (a DataFrame) with the named metrics added as columns
+    values = evaluate(grouped[metric_columns(names)].to_numpy(), names)
+    return grouped.assign(**{name: values[:, i] for i, name in enumerate(names)})
+
+
+def metric_totals(totals, names):
+    # {name: value} from a dict of count totals
+    values = evaluate([[totals[column] for column in metric_columns(names)]], names)[0]
+    return {name: float(value) for name, value in zip(names, values)}
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Points kept per trace: about one per horizontal pixel of the chart
+DEFAULT_POINTS = 1500
+
+# Above this many points per output point, pre-select bucket minima/maxima
+# before running LTTB (MinMaxLTTB), so the LTTB loop never sees raw history
+MINMAX_RATIO = 4
+
+
+def minmax_indices(y, n_out):
+    # Indices of the minimum and maximum of each of n_out / 2 equal buckets,
+    # plus the first and last point. Fully vectorized, keeps every peak.
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+
+    n_buckets = max(1, n_out // 2)
+    size = -(-n // n_buckets)
+    # Pad the tail with the last value; padded positions clip back to n - 1
+    padded = np.empty(n_buckets * size)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    padded = padded.reshape(n_buckets, size)
+    offsets = np.arange(n_buckets) * size
+
+    mins = np.minimum(offsets + padded.argmin(axis=1), n - 1)
+    maxs = np.minimum(offsets + padded.argmax(axis=1), n - 1)
+    return np.unique(np.concatenate(([0, n - 1], mins, maxs)))
+
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: from each bucket keep the point forming
+    # the largest triangle with the previously kept point and the average of
+    # the next bucket
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.int64), n)
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop, next_stop = edges[i], edges[i + 1], edges[i + 2]
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+
+def downsample_indices(x, y, n_out=DEFAULT_POINTS):
+    # Row positions to plot for one trace, at most n_out of them
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype(np.int64)
+    y = np.asarray(y, dtype=np.float64)
+    if n > n_out * MINMAX_RATIO:
+        candidates = minmax_indices(y, n_out * MINMAX_RATIO)
+        return candidates[lttb_indices(x[candidates], y[candidates], n_out)]
+    return lttb_indices(x, y, n_out)
@@ -0,0 +1,223 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import Response, abort, jsonify, request
+
+# Detection frames are resized once, when they are ingested, into the
+# renditions the dashboards show; requests only ever read the stored bytes.
+# The detector either overwrites FRAME_PATH (picked up on the next check) or
+# posts the image to FRAME_ROUTE. The last FRAME_HISTORY frames are kept in
+# FRAME_DIR, shared by every worker process, and recently served renditions
+# in a size-bounded in-memory LRU.
+FRAME_PATH = os.path.join(os.path.dirname(__file__), "latest_frame.jpg")
+FRAME_DIR = os.environ.get('FRAME_DIR', os.path.join(tempfile.gettempdir(), 'motorcycle_dashboard_frames'))
+FRAME_HISTORY = int(os.environ.get('FRAME_HISTORY', 12))
+FRAME_CACHE_BYTES = int(os.environ.get('FRAME_CACHE_BYTES', 8 * 1024 * 1024))
+FRAME_ROUTE = "/frames"
+LATEST_ROUTE = "/frames/latest.jpg"
+
+# Rendition name -> bounding box and JPEG quality. 'display' is about twice
+# the 400px the image is shown at, for high-density screens.
+RENDITIONS = {
+    'display': {'size': (1280, 720), 'quality': 80},
+    'thumb': {'size': (192, 108), 'quality': 70}
+}
+# Frame ids are a prefix of the source image's MD5, so the same image is
+# only processed once however many workers see it
+FRAME_ID = re.compile(r'^[0-9a-f]{16}$')
+
+
+def make_renditions(data):
+    # Source image bytes -> {rendition name: progressive JPEG bytes}. PIL is
+    # only imported once a frame arrives, not when the app starts.
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder scale down while decoding (no-op for other formats)
+    image.draft('RGB', RENDITIONS['display']['size'])
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    renditions = {}
+    for name, spec in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(spec['size'], Image.LANCZOS)
+        out = io.BytesIO()
+        resized.save(out, 'JPEG', quality=spec['quality'], optimize=True, progressive=True)
+        renditions[name] = out.getvalue()
+    return renditions
+
+
+class FrameStore:
+    # Rolling history of processed frames in a directory, newest first
+
+    def __init__(self, directory=FRAME_DIR, history=FRAME_HISTORY, cache_bytes=FRAME_CACHE_BYTES):
+        self.directory = directory
+        self.history = history
+        self.cache_bytes = cache_bytes
+        os.makedirs(directory, exist_ok=True)
+        # (frame id, rendition) -> bytes, least recently used first
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        # Frame ids, refreshed when the directory's mtime changes
+        self._listing_key = None
+        self._listing = []
+        # (mtime, size) of the source file when it was last ingested
+        self._source_key = None
+        self._source_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def path(self, frame_id, name):
+        return os.path.join(self.directory, f"{frame_id}.{name}.jpg")
+
+    def ingest(self, data):
+        # Process and store a new frame; returns its id. Raises ValueError
+        # when data is not an image.
+        frame_id = hashlib.md5(data).hexdigest()[:16]
+        if os.path.exists(self.path(frame_id, 'display')):
+            return frame_id
+        try:
+            renditions = make_renditions(data)
+        except OSError as e:
+            # Includes PIL's UnidentifiedImageError
+            raise ValueError(f"Not a readable image: {e}")
+
+        # 'display' last: its file is what marks the frame as present
+        for name in sorted(renditions, key=lambda name: name == 'display'):
+            path = self.path(frame_id, name)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(renditions[name])
+            os.replace(tmp_path, path)
+        self.prune()
+        return frame_id
+
+    def sync_source(self, path=FRAME_PATH):
+        # Ingest the source file if it was replaced since the last check
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._source_lock:
+            if key == self._source_key:
+                return
+            with open(path, 'rb') as f:
+                data = f.read()
+            try:
+                self.ingest(data)
+            except ValueError as e:
+                print(f"Error loading image: {e}")
+            self._source_key = key
+
+    def frames(self):
+        # Ids of the frames in the history, newest first
+        return self.list_directory()[:self.history]
+
+    def list_directory(self):
+        # Ids of every frame on disk, newest first
+        try:
+            key = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return []
+        if key != self._listing_key:
+            stamped = []
+            for entry in os.scandir(self.directory):
+                frame_id, _, suffix = entry.name.partition('.')
+                if suffix == 'display.jpg':
+                    try:
+                        stamped.append((entry.stat().st_mtime_ns, frame_id))
+                    except OSError:
+                        # Pruned by another process
+                        continue
+            self._listing = [frame_id for _, frame_id in sorted(stamped, reverse=True)]
+            self._listing_key = key
+        return self._listing
+
+    def prune(self):
+        # Drop frames beyond the history length
+        for frame_id in self.list_directory()[self.history:]:
+            for name in RENDITIONS:
+                try:
+                    os.remove(self.path(frame_id, name))
+                except OSError:
+                    pass
+
+    def load(self, frame_id, name):
+        # Rendition bytes, or None for an unknown or pruned frame
+        if name not in RENDITIONS or not FRAME_ID.match(frame_id):
+            return None
+        key = (frame_id, name)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+        try:
+            with open(self.path(frame_id, name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = data
+                self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+        return data
+
+
+frame_store = FrameStore()
+
+
+def recent_frames():
+    # Ids of the frames in the history, newest first
+    frame_store.sync_source()
+    return frame_store.frames()
+
+
+def frame_src(frame_id, name='display'):
+    # Renditions never change, so their URLs can be cached indefinitely
+    return f"{FRAME_ROUTE}/{frame_id}/{name}.jpg"
+
+
+def register_frame_routes(server):
+    @server.route(f"{FRAME_ROUTE}/<frame_id>/<name>.jpg")
+    def serve_frame(frame_id, name):
+        data = frame_store.load(frame_id, name)
+        if data is None:
+            abort(404)
+        response = Response(data, mimetype='image/jpeg')
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+        return response
+
+    # The current frame's display rendition at a fixed URL, for clients that
+    # do not track frame ids
+    @server.route(LATEST_ROUTE)
+    def serve_latest_frame():
+        frames = recent_frames()
+        if not frames:
+            abort(404)
+        response = serve_frame(frames[0], 'display')
+        response.cache_control.max_age = None
+        response.cache_control.immutable = False
+        # Let the browser keep the bytes but revalidate with If-None-Match
+        response.cache_control.no_cache = True
+        response.set_etag(frames[0])
+        return response.make_conditional(request)
+
+    @server.route(FRAME_ROUTE, methods=['POST'])
+    def ingest_frame():
+        try:
+            frame_id = frame_store.ingest(request.get_data())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'id': frame_id, 'src': frame_src(frame_id)}), 201
+
+    return serve_frame
@@ -0,0 +1,33 @@
+# gunicorn settings for the dashboard (read automatically from the working
+# directory). The app, and with it every column buffer, prefix sum and
+# aggregate cube, is loaded once in the master; workers are forked from it
+# and share those pages copy-on-write, so each extra worker costs little
+# more than its own interpreter state.
+import gc
+import os
+
+wsgi_app = 'wsgi:server'
+bind = f"0.0.0.0:{os.environ.get('PORT', 8050)}"
+preload_app = True
+
+# Callbacks are numpy-bound and mostly short (slow renders run as background
+# jobs), so a few processes with a few threads each: threads keep polling,
+# /metrics and /ingest responsive while another request computes
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, os.cpu_count() or 1)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Cold All Time renders on large stores can take seconds when background
+# callbacks are unavailable
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not write to (and so copy) shared pages
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Threads started in the master are not carried over by fork()
+    from app import start_worker_threads
+    start_worker_threads()
@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from flask import jsonify, request
+
+from store import COUNT_COLUMNS, COUNT_DTYPE, EXTRA_COLUMNS, EXTRA_DTYPE, check_range
+
+# Append-only JSON-lines log of detections that are not in the data store yet.
+# The POST route writes to it and every app process tails it, so all
+# gunicorn workers see the same records in the same order.
+LOG_PATH = os.environ.get(
+    'DETECTION_LOG_PATH', os.path.join(os.path.dirname(__file__), 'detections.log')
+)
+INGEST_ROUTE = '/ingest'
+POLL_SECONDS = float(os.environ.get('INGEST_POLL_SECONDS', 1.0))
+
+REQUIRED_FIELDS = ['timestamp'] + COUNT_COLUMNS
+# site_id and camera_id; records without them belong to site/camera 0
+OPTIONAL_FIELDS = EXTRA_COLUMNS
+# Every timestamp is parsed with this one format, in validate_record() and
+# records_to_frame() alike
+TIMESTAMP_FORMAT = 'ISO8601'
+
+
+def parse_timestamp(value):
+    # Naive timestamp of a record, like those in the data store; missing,
+    # unparseable and tz-aware values are rejected rather than stored as NaT
+    # or shifted against the other records
+    if not isinstance(value, str):
+        raise ValueError("Field 'timestamp' must be an ISO 8601 string")
+    try:
+        timestamp = pd.to_datetime(value, format=TIMESTAMP_FORMAT)
+    except ValueError:
+        raise ValueError(f"Field 'timestamp' is not a valid ISO 8601 timestamp: {value!r}") from None
+    if pd.isna(timestamp):
+        raise ValueError("Field 'timestamp' must not be empty")
+    if timestamp.tzinfo is not None:
+        raise ValueError("Field 'timestamp' must not have a UTC offset")
+    return timestamp
+
+
+def validate_record(record):
+    if not isinstance(record, dict):
+        raise ValueError("Each record must be a JSON object")
+    missing = [field for field in REQUIRED_FIELDS if field not in record]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    parse_timestamp(record['timestamp'])
+    # Counts and ids are stored in narrow dtypes, so they are checked
+    # against the same ranges as converted data
+    for field in COUNT_COLUMNS:
+        if int(record[field]) < 0:
+            raise ValueError(f"Field '{field}' must not be negative")
+        check_range(field, np.array([int(record[field])]), COUNT_DTYPE)
+    if int(record['total_detections']) <= 0:
+        raise ValueError("Field 'total_detections' must be positive")
+    if int(record['helmet_compliance']) > int(record['total_detections']):
+        raise ValueError("Field 'helmet_compliance' must not exceed 'total_detections'")
+    for field in OPTIONAL_FIELDS:
+        if field in record:
+            if int(record[field]) < 0:
+                raise ValueError(f"Field '{field}' must not be negative")
+            check_range(field, np.array([int(record[field])]), EXTRA_DTYPE)
+
+
+def records_to_frame(records):
+    # Detection records -> rows in the data.csv layout, with the hour,
+    # day_of_week and time_window columns filled in from the timestamp
+    frame = pd.DataFrame.from_records(records, columns=REQUIRED_FIELDS + OPTIONAL_FIELDS)
+    # Validated records are naive; parsing as UTC and dropping the zone keeps
+    # the column naive whatever the parser infers from the batch
+    frame['timestamp'] = pd.to_datetime(frame['timestamp'], format=TIMESTAMP_FORMAT, utc=True).dt.tz_localize(None)
+    for column in COUNT_COLUMNS:
+        frame[column] = frame[column].astype('int64')
+    for column in OPTIONAL_FIELDS:
+        frame[column] = frame[column].fillna(0).astype('int32')
+    start = frame['timestamp'].dt.floor('h')
+    frame['time_window'] = start.dt.strftime('%H:%M') + '-' + (start + timedelta(hours=1)).dt.strftime('%H:%M')
+    frame['hour'] = frame['timestamp'].dt.hour
+    frame['day_of_week'] = frame['timestamp'].dt.day_name()
+    return frame
+
+
+def append_to_log(records, path=LOG_PATH):
+    # One write call in append mode, so lines from concurrent writers
+    # (threads or worker processes) do not interleave
+    lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(lines)
+
+
+class DetectionLogTailer(threading.Thread):
+    # Background thread that follows the detection log and hands every batch
+    # of new records to on_records
+
+    def __init__(self, on_records, path=LOG_PATH, interval=POLL_SECONDS):
+        super().__init__(name='detection-log-tailer', daemon=True)
+        self.on_records = on_records
+        self.path = path
+        self.interval = interval
+        self.offset = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def poll(self):
+        # Read complete lines past the last offset; returns the record count
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size < self.offset:
+            # The log was truncated or rotated; start over
+            self.offset = 0
+        if size == self.offset:
+            return 0
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+
+        records = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                validate_record(record)
+            except (ValueError, TypeError) as e:
+                print(f"Skipping bad detection record: {e}")
+                continue
+            records.append(record)
+        applied = self.apply(records) if records else 0
+        # Only now past the batch: if applying it failed for another reason,
+        # the same lines are read again on the next poll
+        self.offset += end
+        return applied
+
+    def apply(self, records):
+        # Hand records to on_records, which either applies all of them or
+        # raises having applied none. A batch rejected as bad data is retried
+        # one record at a time and the rejected records are skipped, so one
+        # bad record neither loses the rest of its batch nor, as it stays in
+        # the log, fails again on every restart. Returns the applied count.
+        try:
+            self.on_records(records)
+            return len(records)
+        except (ValueError, TypeError) as e:
+            if len(records) == 1:
+                print(f"Skipping bad detection record: {e}")
+                return 0
+        return sum(self.apply([record]) for record in records)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error ingesting detections: {e}")
+            self._stop_event.wait(self.interval)
+
+
+def register_ingest_routes(server, path=LOG_PATH):
+    @server.route(INGEST_ROUTE, methods=['POST'])
+    def ingest_detections():
+        payload = request.get_json(silent=True)
+        records = payload if isinstance(payload, list) else [payload]
+        try:
+            for record in records:
+                validate_record(record)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        append_to_log(records, path)
+        return jsonify({'accepted': len(records)}), 202
+
+    return ingest_detections
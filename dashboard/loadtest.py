@@ -0,0 +1,495 @@
+# loadtest.py
+# Measures how many concurrent viewers one deployment of the dashboard can
+# serve. For each worker/thread configuration gunicorn is started on the
+# app (wsgi:server, with gunicorn.conf.py) and N simulated users, run as
+# asyncio tasks, replay what a browser sends:
+# - a page load: the index page, layout and dependencies, then the initial
+#   callbacks
+# - clicks on the time range buttons (btn-24h/btn-week/btn-all) and changes
+#   of the site dropdown, with a random think time in between. The axis
+#   dropdowns are handled in the browser and send nothing.
+# - the live mode polls, on the interval from the layout
+# Callback requests are built from /_dash-dependencies as the Dash renderer
+# builds them, callbacks triggered by another's outputs are chained, and
+# background callbacks are polled until their result arrives. Throughput,
+# latency percentiles, error rate and bytes transferred are printed per
+# configuration and saved as JSON; pass --url to load an already running
+# server instead.
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+from benchmark import git_commit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PERCENTILES = [50, 95, 99]
+# Connections a browser keeps open to one host
+MAX_CONNECTIONS = 6
+# Time range button -> value the browser stores for it (selectTimeRange in
+# assets/dashboard.js)
+TIME_RANGE_BUTTONS = {'btn-24h': '24h', 'btn-week': 'week', 'btn-all': 'all'}
+# Interaction -> relative frequency
+ACTIONS = {'time_range': 3, 'site': 2}
+# Callbacks triggering callbacks, as far as the renderer would follow them
+MAX_CHAIN = 5
+STARTUP_SECONDS = 120
+UPDATE_ROUTE = '/_dash-update-component'
+
+
+def summarize(samples):
+    # Latency samples (seconds) -> milliseconds summary
+    if not samples:
+        return {'n': 0}
+    ms = np.asarray(samples) * 1000
+    summary = {f'p{p}': round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+    summary.update({'min': round(float(ms.min()), 3), 'max': round(float(ms.max()), 3),
+                    'mean': round(float(ms.mean()), 3), 'n': len(ms)})
+    return summary
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Connection:
+    # One keep-alive HTTP/1.1 connection
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, target, body=b'', headers=()):
+        # -> (status, headers, body, bytes received, bytes sent)
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 "Accept-Encoding: gzip", f"Content-Length: {len(body)}", *headers]
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+        self.writer.write(data)
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        status = int(status_line.split(' ', 2)[1])
+        response_headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+
+        received = len(head)
+        if status in (204, 304) or method == 'HEAD':
+            content = b''
+        elif response_headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size_line = await self.reader.readuntil(b'\r\n')
+                size = int(size_line.split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                received += len(size_line) + len(chunk)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            content = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            content = await self.reader.readexactly(int(response_headers['content-length']))
+            received += len(content)
+        else:
+            content = await self.reader.read()
+            received += len(content)
+            response_headers['connection'] = 'close'
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        if response_headers.get('content-encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return status, response_headers, content, received, len(data)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Results:
+    # Requests and interactions completed during a run
+
+    def __init__(self):
+        # (label, seconds, ok, bytes received, bytes sent)
+        self.requests = []
+        # (kind, seconds, ok)
+        self.interactions = []
+
+    def report(self, elapsed):
+        ok = [request for request in self.requests if request[2]]
+        labels = sorted({request[0] for request in self.requests})
+        kinds = sorted({interaction[0] for interaction in self.interactions})
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': len(self.requests),
+            'errors': len(self.requests) - len(ok),
+            'error_rate': round((len(self.requests) - len(ok)) / max(1, len(self.requests)), 5),
+            'requests_per_second': round(len(ok) / elapsed, 3),
+            'interactions_per_second': round(sum(1 for i in self.interactions if i[2]) / elapsed, 3),
+            'bytes_received': sum(request[3] for request in self.requests),
+            'bytes_sent': sum(request[4] for request in self.requests),
+            'latency_ms': summarize([request[1] for request in ok]),
+            'requests_by_label': {
+                label: {**summarize([r[1] for r in ok if r[0] == label]),
+                        'errors': sum(1 for r in self.requests if r[0] == label and not r[2])}
+                for label in labels
+            },
+            'interactions': {
+                kind: {**summarize([i[1] for i in self.interactions if i[0] == kind and i[2]]),
+                       'errors': sum(1 for i in self.interactions if i[0] == kind and not i[2])}
+                for kind in kinds
+            }
+        }
+
+
+def dependency_label(dependency):
+    # First output's component id, e.g. 'data-version'
+    output = dependency['output']
+    return output.strip('.').split('...')[0].rsplit('.', 1)[0]
+
+
+def dependency_outputs(dependency):
+    output = dependency['output']
+    outputs = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [dict(zip(('id', 'property'), output.rsplit('.', 1))) for output in outputs]
+
+
+def prop_key(spec):
+    return f"{spec['id']}.{spec['property']}"
+
+
+def layout_values(node, values):
+    # Initial "id.prop" -> value for every component with an id
+    if isinstance(node, list):
+        for child in node:
+            layout_values(child, values)
+    elif isinstance(node, dict):
+        props = node.get('props', {})
+        if isinstance(props.get('id'), str):
+            for prop, value in props.items():
+                values[f"{props['id']}.{prop}"] = value
+        for value in props.values():
+            if isinstance(value, (dict, list)):
+                layout_values(value, values)
+    return values
+
+
+class SimulatedUser:
+    # One browser tab: its connections, component state and the server
+    # callbacks it can trigger
+
+    def __init__(self, host, port, results, rng, timeout):
+        self.host = host
+        self.port = port
+        self.results = results
+        self.rng = rng
+        self.timeout = timeout
+        self.idle = []
+        self.slots = asyncio.Semaphore(MAX_CONNECTIONS)
+        self.values = {}
+        self.dependencies = []
+
+    async def request(self, label, method, target, payload=None):
+        # -> (status, decoded body or None); every request is recorded
+        body = json.dumps(payload).encode() if payload is not None else b''
+        headers = ['Content-Type: application/json'] if payload is not None else []
+        async with self.slots:
+            start = time.perf_counter()
+            while True:
+                # An idle connection may have been closed by the server's
+                # keep-alive timeout meanwhile; like a browser, retry those
+                # once on a new connection
+                reused = bool(self.idle)
+                connection = self.idle.pop() if reused else Connection(self.host, self.port)
+                try:
+                    status, _, content, received, sent = await asyncio.wait_for(
+                        connection.request(method, target, body, headers), self.timeout)
+                    break
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    connection.close()
+                    if reused and not isinstance(e, asyncio.TimeoutError):
+                        continue
+                    error = e
+                except (asyncio.LimitOverrunError, ValueError) as e:
+                    connection.close()
+                    error = e
+                self.results.requests.append((label, time.perf_counter() - start, False, 0, len(body)))
+                raise HTTPError(f"{method} {target} failed: {error!r}")
+            elapsed = time.perf_counter() - start
+            if connection.writer is not None:
+                self.idle.append(connection)
+        ok = status < 400
+        self.results.requests.append((label, elapsed, ok, received, sent))
+        if not ok:
+            raise HTTPError(f"{method} {target} returned {status}")
+        if status == 204 or not content:
+            return status, None
+        try:
+            return status, json.loads(content)
+        except ValueError:
+            return status, None
+
+    async def interaction(self, kind, action):
+        # Time one user-visible interaction, from the first request to the
+        # last chained callback
+        start = time.perf_counter()
+        try:
+            await action
+        except HTTPError:
+            self.results.interactions.append((kind, time.perf_counter() - start, False))
+            return
+        self.results.interactions.append((kind, time.perf_counter() - start, True))
+
+    async def load_page(self):
+        await self.request('page', 'GET', '/')
+        _, layout = await self.request('layout', 'GET', '/_dash-layout')
+        _, dependencies = await self.request('dependencies', 'GET', '/_dash-dependencies')
+        self.values = layout_values(layout, {})
+        # Only server callbacks cost requests
+        self.dependencies = [dependency for dependency in dependencies if not dependency.get('clientside_function')]
+        initial = [dependency for dependency in self.dependencies if not dependency.get('prevent_initial_call')]
+        await asyncio.gather(*(self.call(dependency, []) for dependency in initial))
+
+    async def call(self, dependency, changed, depth=0):
+        # POST one callback as the renderer does, then fire the callbacks
+        # its outputs trigger
+        outputs = dependency_outputs(dependency)
+        payload = {
+            'output': dependency['output'],
+            'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+            'inputs': [{**spec, 'value': self.values.get(prop_key(spec))} for spec in dependency['inputs']],
+            'state': [{**spec, 'value': self.values.get(prop_key(spec))} for spec in dependency['state']],
+            'changedPropIds': changed
+        }
+        label = dependency_label(dependency)
+        _, data = await self.request(label, 'POST', UPDATE_ROUTE, payload)
+        # Background callback: poll the job until its result is in (the
+        # responses before that only carry progress)
+        if data is not None and 'cacheKey' in data and 'response' not in data:
+            job = urlencode({'cacheKey': data['cacheKey'], 'job': data['job']})
+            interval = (dependency.get('long') or {}).get('interval', 250) / 1000
+            while True:
+                await asyncio.sleep(interval)
+                _, data = await self.request(label, 'POST', f"{UPDATE_ROUTE}?{job}", payload)
+                if data is None or 'response' in data:
+                    break
+
+        updated = []
+        for component, props in ((data or {}).get('response') or {}).items():
+            for prop, value in props.items():
+                if isinstance(value, dict) and '__dash_patch_update' in value:
+                    continue
+                self.values[f"{component}.{prop}"] = value
+                updated.append(f"{component}.{prop}")
+        if updated and depth < MAX_CHAIN:
+            await self.changed(updated, depth + 1)
+
+    async def changed(self, props, depth=0):
+        # Fire every server callback with one of the props as an input
+        triggered = [dependency for dependency in self.dependencies
+                     if any(prop_key(spec) in props for spec in dependency['inputs'])]
+        await asyncio.gather(*(self.call(dependency, props, depth) for dependency in triggered))
+
+    async def click_time_range(self):
+        current = self.values.get('selected-time-range.data')
+        button = self.rng.choice([b for b, value in TIME_RANGE_BUTTONS.items() if value != current])
+        self.values[f'{button}.n_clicks'] = (self.values.get(f'{button}.n_clicks') or 0) + 1
+        self.values['selected-time-range.data'] = TIME_RANGE_BUTTONS[button]
+        await self.changed(['selected-time-range.data'])
+
+    async def change_site(self):
+        current = self.values.get('site-dropdown.value')
+        options = [option['value'] for option in self.values.get('site-dropdown.options') or []
+                   if option['value'] != current]
+        if not options:
+            return
+        self.values['site-dropdown.value'] = self.rng.choice(options)
+        await self.changed(['site-dropdown.value'])
+
+    async def live_polls(self, deadline):
+        if self.values.get('live-interval.disabled'):
+            return
+        interval = self.values.get('live-interval.interval', 5000) / 1000
+        while time.perf_counter() + interval < deadline:
+            await asyncio.sleep(interval)
+            self.values['live-interval.n_intervals'] = (self.values.get('live-interval.n_intervals') or 0) + 1
+            await self.interaction('live_poll', self.changed(['live-interval.n_intervals']))
+
+    async def run(self, deadline, think, live):
+        await self.interaction('page_load', self.load_page())
+        if not self.dependencies:
+            return
+        polls = asyncio.ensure_future(self.live_polls(deadline)) if live else None
+        actions = {'time_range': self.click_time_range, 'site': self.change_site}
+        while True:
+            pause = self.rng.expovariate(1 / think) if think > 0 else 0
+            if time.perf_counter() + pause >= deadline:
+                break
+            await asyncio.sleep(pause)
+            kind = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+            await self.interaction(kind, actions[kind]())
+        if polls is not None:
+            await polls
+        for connection in self.idle:
+            connection.close()
+
+
+async def run_load(url, users, duration, ramp, think, live, seed, timeout):
+    # N users over `duration` seconds, started evenly over the first `ramp`
+    address = urlsplit(url)
+    results = Results()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def user(i):
+        await asyncio.sleep(ramp * i / max(1, users))
+        simulated = SimulatedUser(address.hostname, address.port or 80, results, random.Random(seed + i), timeout)
+        try:
+            await simulated.run(deadline, think, live)
+        except HTTPError:
+            # Page load failed; the error is already recorded
+            pass
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+    return results.report(time.perf_counter() - start)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url, process, log_path):
+    deadline = time.time() + STARTUP_SECONDS
+    while time.time() < deadline:
+        if process.poll() is not None:
+            with open(log_path) as f:
+                raise RuntimeError(f"Server exited during startup:\n{f.read()[-2000:]}")
+        try:
+            with urllib.request.urlopen(f"{url}/_dash-layout", timeout=5):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {STARTUP_SECONDS}s")
+
+
+def start_server(workers, threads, store_path, work_dir):
+    # gunicorn on a free local port, with its own log, result cache and
+    # detection log so runs do not share state
+    port = free_port()
+    env = dict(os.environ,
+               DETECTION_LOG_PATH=os.path.join(work_dir, 'detections.log'),
+               RESULT_CACHE_PATH=os.path.join(work_dir, 'cache.sqlite'),
+               BACKGROUND_JOBS_PATH=os.path.join(work_dir, 'jobs'))
+    if store_path:
+        env.update(DETECTION_STORE_PATH=store_path, DETECTION_DATA_PATH=os.path.join(work_dir, 'missing.csv'))
+    log_path = os.path.join(work_dir, f'gunicorn_{workers}x{threads}.log')
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads), 'wsgi:server'],
+        cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(url, process, log_path)
+    except RuntimeError:
+        stop_server(process)
+        raise
+    finally:
+        log.close()
+    return process, url
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def print_summary(results):
+    print(f"{'workers':>7} {'threads':>7} {'users':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'errors':>7} {'MB recv':>8}")
+    for run in results['runs']:
+        latency = run['latency_ms']
+        print(f"{run['workers'] or '-':>7} {run['threads'] or '-':>7} {run['users']:>5} "
+              f"{run['requests_per_second']:>8.1f} {latency.get('p50', 0):>8.1f} {latency.get('p95', 0):>8.1f} "
+              f"{latency.get('p99', 0):>8.1f} {run['error_rate']:>7.2%} {run['bytes_received'] / 2**20:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dashboard with concurrent simulated users")
+    parser.add_argument('--url', help="Load a running server instead of starting gunicorn")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help="gunicorn worker counts to run")
+    parser.add_argument('--threads', type=int, nargs='+', default=[4], help="Threads per worker to run")
+    parser.add_argument('--users', type=int, nargs='+', default=[10], help="Concurrent users to simulate")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds per run")
+    parser.add_argument('--ramp', type=float, default=5, help="Seconds over which users arrive")
+    parser.add_argument('--think', type=float, default=2, help="Mean seconds between a user's interactions (0: none)")
+    parser.add_argument('--no-live', action='store_true', help="Do not send the live mode polls")
+    parser.add_argument('--store', help="Data store for the started server (DETECTION_STORE_PATH)")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request counts as failed")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='loadtest_results.json')
+    args = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {'duration': args.duration, 'ramp': args.ramp, 'think': args.think,
+                     'live': not args.no_live, 'store': args.store, 'url': args.url},
+        'runs': []
+    }
+    configurations = [(None, None)] if args.url else [(w, t) for w in args.workers for t in args.threads]
+    for workers, threads in configurations:
+        process = None
+        url = args.url
+        if url is None:
+            work_dir = tempfile.mkdtemp(prefix='motorcycle_dashboard_load_')
+            print(f"Starting gunicorn with {workers} worker(s) x {threads} thread(s)", file=sys.stderr)
+            process, url = start_server(workers, threads, args.store, work_dir)
+        try:
+            for users in args.users:
+                print(f"  {users} user(s) for {args.duration:g}s", file=sys.stderr)
+                report = asyncio.run(run_load(url, users, args.duration, args.ramp, args.think,
+                                              not args.no_live, args.seed, args.timeout))
+                results['runs'].append({'workers': workers, 'threads': threads, 'users': users, **report})
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_summary(results)
+    print(f"Saved results to {args.output}")
@@ -0,0 +1,274 @@
+import atexit
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+
+# In-process metrics in the Prometheus text format. Each gunicorn worker
+# keeps its own; the scrape shows whichever worker answered, labelled with
+# its pid, so scrape every worker or aggregate with sum() across pids.
+METRICS_ROUTE = '/metrics'
+
+# Seconds; stage spans range from microseconds (slicing) to seconds (cold
+# renders of long windows)
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HELP = {
+    'dashboard_stage_seconds': ('histogram', "Time spent in each pipeline stage, excluding nested stages"),
+    'dashboard_callback_seconds': ('histogram', "Dash callback request time, including serialization"),
+    'dashboard_callbacks_total': ('counter', "Dash callback requests by HTTP status"),
+    'dashboard_payload_bytes': ('histogram', "Dash callback response size as sent (after compression)"),
+    'dashboard_cache_requests_total': ('counter', "Result cache lookups by outcome"),
+}
+
+# Sampling profiler, off unless a dump path is set. The dump is in folded
+# stack format (one "frame;frame;frame count" line per stack), readable by
+# flamegraph.pl and speedscope.
+PROFILE_PATH = os.environ.get('DASHBOARD_PROFILE_PATH')
+PROFILE_INTERVAL = float(os.environ.get('DASHBOARD_PROFILE_INTERVAL', 0.005))
+PROFILE_DUMP_SECONDS = float(os.environ.get('DASHBOARD_PROFILE_DUMP_SECONDS', 30))
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{format_labels(labels, le=format_value(bound))} {cumulative}'
+        yield f'{name}_bucket{format_labels(labels, le="+Inf")} {self.count}'
+        yield f'{name}_sum{format_labels(labels)} {format_value(self.sum)}'
+        yield f'{name}_count{format_labels(labels)} {self.count}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+class Metrics:
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = collections.Counter()
+        # name -> (type, help, callable returning {labels tuple: value})
+        self.collectors = {}
+        # Taken before any fork, so a background job never inherits it held
+        # by another thread (it resets and exports its own copy)
+        self._lock = threading.Lock()
+        os.register_at_fork(before=self._lock.acquire, after_in_parent=self._lock.release,
+                            after_in_child=self._lock.release)
+        # Durations of nested spans, per open span on this thread
+        self._spans = threading.local()
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def export(self):
+        # Histograms and counters as plain picklable data, for merge() in
+        # another process (background jobs report through this)
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            return histograms, dict(self.counters)
+
+    def merge(self, exported):
+        histograms, counters = exported
+        with self._lock:
+            for key, (buckets, counts, total, count) in histograms.items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+            self.counters.update(counters)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = collections.Counter()
+
+    def collect(self, name, kind, help, func):
+        # Values read at scrape time, e.g. counters kept by another object
+        self.collectors[name] = (kind, help, func)
+
+    @contextmanager
+    def span(self, stage):
+        # Time a pipeline stage. Spans nest: time spent in an inner span is
+        # reported under the inner stage only.
+        stack = getattr(self._spans, 'stack', None)
+        if stack is None:
+            stack = self._spans.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.observe('dashboard_stage_seconds', elapsed - nested, stage=stage)
+
+    def timed(self, stage):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def callback(self, func):
+        # Wrap a Dash callback body. Request time not spent in the body is
+        # Dash's dispatch, mostly JSON serialization and compression of the
+        # outputs.
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with self.span('callback'):
+                    return func(*args, **kwargs)
+            finally:
+                if has_request_context():
+                    g.dashboard_callback_body = g.get('dashboard_callback_body', 0.0) + time.perf_counter() - start
+        return wrapper
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        pid = ('pid', os.getpid())
+
+        by_name = collections.defaultdict(list)
+        for (name, labels), histogram in histograms:
+            by_name[name].extend(histogram.lines(name, (pid,) + labels))
+        for (name, labels), value in counters:
+            by_name[name].append(f'{name}{format_labels((pid,) + labels)} {format_value(value)}')
+
+        lines = []
+        for name, samples in by_name.items():
+            kind, help = HELP.get(name, ('untyped', name))
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}'] + samples
+        for name, (kind, help, func) in self.collectors.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            for labels, value in func().items():
+                lines.append(f'{name}{format_labels((pid,) + labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def register_metrics_routes(server, metrics, update_path):
+    # update_path: Dash's callback route, whose requests are timed and sized
+    @server.before_request
+    def start_callback_timer():
+        if request.path == update_path:
+            g.dashboard_request_start = time.perf_counter()
+
+    @server.after_request
+    def record_callback(response):
+        start = g.pop('dashboard_request_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        payload = request.get_json(silent=True) or {}
+        # The first output id names the callback ("..a.children...b.children.." for several)
+        callback = payload.get('output', '').strip('.').split('.')[0] or 'unknown'
+        metrics.observe('dashboard_callback_seconds', elapsed, callback=callback)
+        body = g.pop('dashboard_callback_body', None)
+        if body is not None:
+            metrics.observe('dashboard_stage_seconds', max(0.0, elapsed - body), stage='serialize')
+        metrics.inc('dashboard_callbacks_total', callback=callback, status=response.status_code)
+        if not response.is_streamed:
+            metrics.observe('dashboard_payload_bytes', response.calculate_content_length() or 0,
+                            buckets=BYTE_BUCKETS, callback=callback)
+        return response
+
+    @server.route(METRICS_ROUTE)
+    def serve_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return serve_metrics
+
+
+class SamplingProfiler(threading.Thread):
+    # Samples every thread's Python stack at a fixed interval and writes the
+    # aggregated stacks to path (suffixed with the pid) periodically and at exit
+
+    def __init__(self, path, interval=PROFILE_INTERVAL, dump_seconds=PROFILE_DUMP_SECONDS):
+        super().__init__(name='sampling-profiler', daemon=True)
+        self.path = f'{path}.{os.getpid()}'
+        self.interval = interval
+        self.dump_seconds = dump_seconds
+        self.stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            with self._lock:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self):
+        with self._lock:
+            lines = [f'{stack} {count}\n' for stack, count in self.stacks.most_common()]
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        atexit.register(self.dump)
+        last_dump = time.monotonic()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+            if time.monotonic() - last_dump >= self.dump_seconds:
+                self.dump()
+                last_dump = time.monotonic()
+        self.dump()
@@ -0,0 +1,160 @@
+import os
+from datetime import timedelta
+
+from derived import metric_columns, metric_totals, with_metrics
+from ingest import DetectionLogTailer
+from sites import ALL_SITES, SitePartitions
+from sketches import SKETCHES, sketch_columns, with_quantiles
+from snapshot import snapshot_cells
+from sqlstore import DB_PATH, SQLiteDetections, SQLiteLogTailer
+from store import COUNT_COLUMNS, data_source_id, load_detections
+
+# Data access and queries shared by the Dash app (app.py) and the Streamlit
+# dashboard (dashboard.py). Queries run against the detections they are
+# given, either backend:
+# - 'memory' (default): records loaded into per-site partitions (sites.py)
+# - 'sqlite': an SQLite database file that filters and aggregates are
+#   pushed down to (sqlstore.py), for histories larger than worker memory
+# Caching is left to the caller.
+DETECTION_BACKEND = os.environ.get('DETECTION_BACKEND', 'memory')
+
+# Columns with running totals in the store; the KPI rates are derived from
+# these totals (see derived.py)
+TOTAL_COLUMNS = COUNT_COLUMNS
+# KPI key -> derived metric
+KPI_METRICS = {
+    'avg_helmet_compliance': 'helmet_compliance_rate',
+    'avg_child_ratio': 'child_passenger_ratio',
+    'avg_safety_score': 'safety_score'
+}
+# Derived metrics of the trend and daily views, and the cube columns they
+# and the compliance bars are summed from
+TREND_METRICS = ['helmet_compliance_rate']
+TREND_COLUMNS = sorted({'helmet_compliance', 'total_detections', 'rows', *metric_columns(TREND_METRICS)})
+# Quantiles of the per-record values behind each hour or day (see
+# sketches.py), e.g. 'helmet_compliance_rate_p10'
+TREND_QUANTILES = (0.1, 0.5, 0.9)
+
+# Axis dropdown value -> cube column
+AXIS_COLUMNS = {'hours': 'hour', 'days': 'day_of_week'}
+
+
+def prepare_partitions(df, cells=None):
+    # One partition per site, each with its records sorted by timestamp for
+    # binary-search range filtering (any range's totals a few lookups away)
+    # and an hour x day-of-week aggregate cube behind the bar, trend and
+    # insight outputs (built from the records unless cells, {site: cube
+    # cells}, has them already)
+    return SitePartitions(df, sum_columns=TOTAL_COLUMNS, cells=cells)
+
+
+def open_detections(store_path, csv_path, backend=DETECTION_BACKEND):
+    # (detections, id of the data source for keying cached results). The
+    # SQLite database is built from the store or CSV on first use.
+    if backend == 'sqlite':
+        detections = SQLiteDetections.open(DB_PATH, lambda: load_detections(store_path, csv_path))
+        return detections, detections.source_id
+    if backend != 'memory':
+        raise ValueError(f"Unknown detection backend: {backend}")
+    source_id = data_source_id(store_path, csv_path)
+    df = load_detections(store_path, csv_path)
+    # Cube cells from the startup snapshot (snapshot.py) when it was made
+    # from this data
+    return prepare_partitions(df, snapshot_cells(source_id, len(df))), source_id
+
+
+def make_log_tailer(detections, on_records):
+    # Thread following the detection log. Workers sharing a database must
+    # not each insert the same records.
+    if isinstance(detections, SQLiteDetections):
+        return SQLiteLogTailer(detections, on_records)
+    return DetectionLogTailer(on_records)
+
+
+def make_alert_tailer(detections, on_records):
+    # Thread feeding the alert rules every new record, or None when the log
+    # tailer's callback already sees them all. Workers sharing a database
+    # each insert only some records, so there every worker also follows the
+    # log itself, from where the database had got to.
+    if not isinstance(detections, SQLiteDetections):
+        return None
+    tailer = DetectionLogTailer(on_records)
+    tailer.offset = detections.log_offset(tailer.path)
+    return tailer
+
+
+def get_time_range_bounds(time_range, latest):
+    # (start, end) bounds of the selected time range; None leaves a side
+    # open. Besides the presets, a range can be a custom {'start': ...,
+    # 'end': ...} window. Presets count back from latest, the latest record
+    # of any site.
+    if isinstance(time_range, dict):
+        return time_range.get('start'), time_range.get('end')
+    elif time_range == '24h':
+        return latest - timedelta(hours=24), None
+    elif time_range == 'week':
+        return latest - timedelta(days=7), None
+    else:
+        return None, None
+
+
+def filter_window(detections, start=None, end=None, site=ALL_SITES):
+    # Rows with start <= timestamp <= end
+    return detections.window(start, end, site)
+
+
+def get_totals(detections, time_range, site=ALL_SITES):
+    # TOTAL_COLUMNS summed over the selected range and sites
+    start, end = get_time_range_bounds(time_range, detections.max_timestamp)
+    return detections.totals(start, end, site)
+
+
+def compute_kpis(totals):
+    # Rates over the summed counts (NaN when nothing was detected)
+    rates = metric_totals(totals, list(KPI_METRICS.values()))
+    kpis = {key: rates[name] for key, name in KPI_METRICS.items()}
+    kpis['total_detections'] = int(round(totals['total_detections']))
+    return kpis
+
+
+def get_kpis(detections, time_range, site=ALL_SITES):
+    # Key metrics for the selected time range, with the previous period's
+    # metrics for the trend strings (None when there is no previous period)
+    start, end = get_time_range_bounds(time_range, detections.max_timestamp)
+    current, previous = detections.period_totals(start, end, site)
+    kpis = compute_kpis(current)
+    kpis['previous'] = compute_kpis(previous) if previous is not None and previous['rows'] else None
+    return kpis
+
+
+def get_mirror_data(detections, time_range, site=ALL_SITES):
+    # Mirror status values, in pie slice order
+    totals = get_totals(detections, time_range, site)
+    return {
+        'No Mirror': int(round(totals['no_mirror'])),
+        'Left Mirror': int(round(totals['left_mirror'])),
+        'Right Mirror': int(round(totals['right_mirror'])),
+        'Both Mirrors': int(round(totals['both_mirrors']))
+    }
+
+
+def get_trend_data(detections, time_range, trend_axis, site=ALL_SITES):
+    # Compliance rate and detections per hour or day
+    start, end = get_time_range_bounds(time_range, detections.max_timestamp)
+    sums = detections.axis_sums(AXIS_COLUMNS[trend_axis], start, end, TREND_COLUMNS, site)
+    return with_metrics(sums, TREND_METRICS)
+
+
+def get_trend_quantiles(detections, time_range, trend_axis, site=ALL_SITES, names=tuple(SKETCHES)):
+    # Quantiles of the named values' per-record distribution per hour or
+    # day, from the summed sketches
+    start, end = get_time_range_bounds(time_range, detections.max_timestamp)
+    sums = detections.axis_sums(AXIS_COLUMNS[trend_axis], start, end, sketch_columns(names), site)
+    return with_quantiles(sums, names, TREND_QUANTILES)
+
+
+def get_daily_data(detections, time_range, site=ALL_SITES):
+    # Compliance rate and detections per calendar day, from the hourly
+    # aggregates
+    start, end = get_time_range_bounds(time_range, detections.max_timestamp)
+    return with_metrics(detections.daily_sums(start, end, TREND_COLUMNS, site), TREND_METRICS)
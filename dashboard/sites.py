@@ -0,0 +1,259 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from aggregates import SUM_COLUMNS, AggregateCube
+from store import SITE_COLUMN, DetectionStore, is_sorted_by_site
+
+# Site of records that carry no site_id (single-site data)
+DEFAULT_SITE = 0
+ALL_SITES = 'all'
+# Threads that aggregate partitions concurrently; numpy and pandas release
+# the GIL in their inner loops, so all-sites views use several cores
+AGGREGATION_THREADS = int(os.environ.get('AGGREGATION_THREADS', min(8, os.cpu_count() or 1)))
+
+
+def split_sites(df):
+    # [(site, rows)] per site. Data sorted by (site_id, timestamp), the order
+    # convert_data.py writes, splits into zero-copy slices.
+    if SITE_COLUMN not in df or len(df) == 0:
+        return [(DEFAULT_SITE, df)]
+    if not is_sorted_by_site(df[SITE_COLUMN].to_numpy(), df['timestamp'].to_numpy()):
+        df = df.sort_values([SITE_COLUMN, 'timestamp'], kind='stable', ignore_index=True)
+    sites = df[SITE_COLUMN].to_numpy()
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(sites)) + 1, [len(df)]))
+    return [(int(sites[first]), df.iloc[first:last]) for first, last in zip(bounds[:-1], bounds[1:])]
+
+
+def merge_axis_sums(parts):
+    # Add up AggregateCube.sums() from several partitions. The day_of_week
+    # index is categorical; only days some partition has are kept.
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return pd.DataFrame(columns=SUM_COLUMNS, dtype='float64')
+    return pd.concat(parts).groupby(level=0, sort=True, observed=True).sum()
+
+
+def collapse_timestamps(timestamps, columns):
+    # Sum the values of rows sharing a timestamp (timestamps sorted)
+    if len(timestamps) < 2 or (timestamps[1:] != timestamps[:-1]).all():
+        return timestamps, columns
+    starts = np.flatnonzero(np.concatenate(([True], timestamps[1:] != timestamps[:-1])))
+    return timestamps[starts], [np.add.reduceat(column.astype(np.int64), starts) for column in columns]
+
+
+def merge_series(parts):
+    # [(timestamps, [columns])] from several partitions -> one series with
+    # values summed per timestamp
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        return np.array([], dtype='datetime64[ns]'), []
+    timestamps = np.concatenate([part[0] for part in parts])
+    order = np.argsort(timestamps, kind='stable')
+    columns = [np.concatenate([part[1][i] for part in parts])[order] for i in range(len(parts[0][1]))]
+    return collapse_timestamps(timestamps[order], columns)
+
+
+def sum_totals(parts, columns):
+    # Totals added up over sites
+    return {column: sum(part[column] for part in parts) for column in columns + ['rows']}
+
+
+class SitePartition:
+    # One site's records and hourly aggregate cube
+
+    def __init__(self, rows, sum_columns, cells=None):
+        self.store = DetectionStore(rows, sum_columns=sum_columns)
+        self.cube = AggregateCube(self.store.df, cells)
+
+    def prepare(self, rows):
+        # (rows in the store's dtypes, cube cells with them merged in),
+        # computed without modifying the partition
+        rows = self.store.conform(rows)
+        return rows, self.cube.merged(rows)
+
+    def commit(self, prepared):
+        rows, cells = prepared
+        appended = self.store.append(rows)
+        self.cube.cells = cells
+        return appended
+
+    def append(self, rows):
+        return self.commit(self.prepare(rows))
+
+    def row_totals(self, first, last):
+        # The store's sum_columns summed over rows [first, last), plus the row count
+        totals = dict(zip(self.store.sum_columns, self.store.totals(first, last)))
+        totals['rows'] = last - first
+        return totals
+
+    def period_totals(self, start, end, latest):
+        # Totals for the range [start, end], the same rows as totals() and
+        # every other output, and for the equally long period
+        # [start - length, start) just before it (None for an open-ended
+        # range like All Time)
+        timestamps = self.store.timestamps
+        first, last = self.store.locate(start, end, timestamps)
+        current = self.row_totals(first, last)
+        if start is None:
+            return current, None
+        start = pd.Timestamp(start)
+        length = (latest if end is None else pd.Timestamp(end)) - start
+        previous_first, _ = self.store.locate(start - length, None, timestamps)
+        return current, self.row_totals(previous_first, first)
+
+
+class SitePartitions:
+    # Detection records partitioned by site. Queries run per partition (in a
+    # thread pool when several are selected) and their results are merged.
+
+    def __init__(self, df, sum_columns=(), threads=AGGREGATION_THREADS, cells=None):
+        # cells: precomputed cube cells per site (see snapshot.py)
+        self.sum_columns = list(sum_columns)
+        cells = cells or {}
+        self.partitions = {site: SitePartition(rows, self.sum_columns, cells.get(site))
+                           for site, rows in split_sites(df)}
+        self.threads = threads
+        self._start_pool()
+        # A forked process (background job, gunicorn worker) inherits the
+        # pool but not its threads, and would wait on it forever
+        os.register_at_fork(after_in_child=self._start_pool)
+
+    def _start_pool(self):
+        self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix='site-aggregate') if self.threads > 1 else None
+        self._lock = threading.Lock()
+
+    @property
+    def sites(self):
+        return sorted(self.partitions)
+
+    def __len__(self):
+        return sum(len(partition.store) for partition in self.partitions.values())
+
+    @property
+    def rebuilds(self):
+        return sum(partition.store.rebuilds for partition in self.partitions.values())
+
+    @property
+    def max_timestamp(self):
+        # Latest record over all sites, so every site shares one "now"
+        latest = [p.store.max_timestamp for p in self.partitions.values() if p.store.max_timestamp is not None]
+        return max(latest) if latest else None
+
+    def select(self, site=ALL_SITES):
+        partitions = self.partitions
+        if site == ALL_SITES:
+            return [partitions[key] for key in sorted(partitions)]
+        partition = partitions.get(site)
+        return [partition] if partition is not None else []
+
+    def map(self, func, site=ALL_SITES, parallel=True):
+        # [func(partition)] for the selected partitions, in site order. Pass
+        # parallel=False for work too small to be worth a thread hand-off.
+        selected = self.select(site)
+        if not parallel or self._pool is None or len(selected) < 2:
+            return [func(partition) for partition in selected]
+        return list(self._pool.map(func, selected))
+
+    # Queries, also answered by the SQLite backend (sqlstore.py). Bounds are
+    # inclusive; None leaves a side open.
+
+    def totals(self, start=None, end=None, site=ALL_SITES):
+        # sum_columns summed over the range and sites, plus the row count.
+        # Each site's totals are a few prefix-sum lookups, so sites are not
+        # run in parallel.
+        return sum_totals(self.map(lambda partition: partition.row_totals(*partition.store.locate(start, end)),
+                                   site, parallel=False), self.sum_columns)
+
+    def period_totals(self, start=None, end=None, site=ALL_SITES):
+        # (totals, totals of the equally long period before start), the
+        # latter None for an open-ended range
+        latest = self.max_timestamp
+        periods = self.map(lambda partition: partition.period_totals(start, end, latest), site, parallel=False)
+        current = sum_totals([current for current, _ in periods], self.sum_columns)
+        if start is None:
+            return current, None
+        return current, sum_totals([previous for _, previous in periods], self.sum_columns)
+
+    def axis_sums(self, column, start=None, end=None, columns=SUM_COLUMNS, site=ALL_SITES):
+        # Cube columns summed per hour or day_of_week; each site's cube is
+        # summed in the aggregation pool and the sums are merged
+        return merge_axis_sums(self.map(lambda partition: partition.cube.sums(column, start, end, columns), site))
+
+    def daily_sums(self, start=None, end=None, columns=SUM_COLUMNS, site=ALL_SITES):
+        # Cube columns summed per calendar day
+        def daily(partition):
+            cells = partition.cube.window(start, end)
+            return cells[columns].groupby(cells.index.floor('D').rename('date'), sort=True).sum()
+
+        return merge_axis_sums(self.map(daily, site))
+
+    def window(self, start=None, end=None, site=ALL_SITES):
+        # Rows with start <= timestamp <= end, as a view on the sorted data (a
+        # copy when several sites are selected)
+        parts = self.map(lambda partition: partition.store.slice(start, end), site, parallel=False)
+        return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+    def series(self, start=None, end=None, columns=(), site=ALL_SITES, max_points=None):
+        # [(timestamps, values)] per column, with the values of rows sharing a
+        # timestamp summed. All points are returned; max_points only lets
+        # other backends pre-reduce long series.
+        def partition_series(partition):
+            rows = partition.store.slice(start, end)
+            return collapse_timestamps(rows['timestamp'].to_numpy(), [rows[column].to_numpy() for column in columns])
+
+        timestamps, values = merge_series(self.map(partition_series, site))
+        if not values:
+            # No partition selected
+            values = [np.array([], dtype=np.int64) for _ in columns]
+        return [(timestamps, column) for column in values]
+
+    def appended_rows(self, first, last):
+        # Rows [first, last) in ingest order, when that is also plot order:
+        # a single site and no cameras reporting at the same timestamp
+        if len(self.partitions) != 1:
+            return None
+        store = self.select()[0].store
+        if 'camera_id' in store.df:
+            return None
+        return store.df.iloc[first:last]
+
+    def append(self, rows):
+        # Route new records to their site's partition (creating it for a new
+        # site); returns the appended rows as stored
+        if len(rows) == 0:
+            return rows
+        sites = rows[SITE_COLUMN] if SITE_COLUMN in rows else pd.Series(DEFAULT_SITE, index=rows.index)
+        with self._lock:
+            # Every site's records are checked and aggregated before any
+            # partition changes, so a rejected batch leaves all of them as
+            # they were
+            template = next(iter(self.partitions.values()), None)
+            pending = []
+            for site, site_rows in rows.groupby(sites.to_numpy(), sort=True):
+                site_rows = site_rows.reset_index(drop=True)
+                partition = self.partitions.get(site)
+                if partition is None:
+                    if template is not None:
+                        site_rows = template.store.conform(site_rows)
+                    pending.append((int(site), SitePartition(site_rows, self.sum_columns), None))
+                else:
+                    pending.append((site, partition, partition.prepare(site_rows)))
+
+            partitions = dict(self.partitions)
+            appended = []
+            for site, partition, prepared in pending:
+                if prepared is None:
+                    partitions[site] = partition
+                    appended.append(partition.store.df)
+                else:
+                    appended.append(partition.commit(prepared))
+            if len(partitions) != len(self.partitions):
+                # Readers iterate the dict unlocked, so publish a new one
+                self.partitions = partitions
+        return pd.concat(appended, ignore_index=True)
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from derived import DERIVED_METRICS, evaluate, metric_columns
+
+# Mergeable quantile sketches of per-record values: a histogram over fixed
+# bin edges, i.e. the number of records whose value falls in each bin.
+# Histograms of the same values add up bin by bin, so they are stored as
+# count columns next to the summed counts, in the hourly cube cells
+# (aggregates.py) and the SQLite rollup (sqlstore.py), kept up to date as
+# records are appended and summed over any window, site and hour or day.
+# A quantile is then read from the summed histogram by interpolating inside
+# the bin it falls in: it is off by at most that bin's width, and costs
+# the same however many records are behind it.
+#
+# Value (a derived metric or a count column) -> bin edges. A bin holds
+# edges[i] <= value < edges[i + 1], the last one also its upper edge;
+# values outside the edges go to the first or last bin, undefined ones
+# (a rate over zero detections) into none.
+SKETCHES = {
+    # Compliance rate in 2-point bins
+    'helmet_compliance_rate': np.linspace(0, 100, 51),
+    # Detections per record: one bin per value up to 10, then bins about
+    # 10% wide (relative error as in DDSketch) up to the largest stored
+    # count
+    'total_detections': np.unique(np.concatenate([
+        [0], np.floor(1.1 ** np.arange(110)), [2 ** 15]
+    ]))
+}
+
+
+def sketch_columns(names=tuple(SKETCHES)):
+    # Bin count columns of the named sketches
+    return [f"{name}_bin{i}" for name in names for i in range(len(SKETCHES[name]) - 1)]
+
+
+SKETCH_COLUMNS = sketch_columns()
+
+# Values are binned once per distinct combination of the count columns they
+# are computed from, rather than once per record, when there are at most
+# this many combinations
+LOOKUP_SIZE = 1 << 20
+
+
+def value_inputs(name):
+    # Count columns a sketched value is computed from
+    return metric_columns([name]) if name in DERIVED_METRICS else [name]
+
+
+def compute_values(inputs, name):
+    # Values from an array whose columns are value_inputs(name)
+    if name in DERIVED_METRICS:
+        return evaluate(inputs, [name])[:, 0]
+    return inputs[:, 0].astype(np.float64)
+
+
+def value_bins(values, edges):
+    # Bin of each value; -1 where it is undefined
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+    return np.where(np.isnan(values), -1, bins)
+
+
+def record_bins(rows, name):
+    # Bin of every record's value. Counts are small non-negative integers,
+    # so this is mostly a lookup into the bins of every combination of them.
+    inputs = rows[value_inputs(name)].to_numpy()
+    edges = SKETCHES[name]
+    if len(inputs) and inputs.dtype.kind in 'iu' and inputs.min() >= 0:
+        shape = inputs.max(axis=0).astype(np.int64) + 1
+        if np.prod(shape) <= LOOKUP_SIZE:
+            combinations = np.indices(shape).reshape(len(shape), -1).T
+            lookup = value_bins(compute_values(combinations, name), edges)
+            return lookup[np.ravel_multi_index(tuple(inputs.T), shape)]
+    return value_bins(compute_values(inputs, name), edges)
+
+
+def sketch_counts(rows, groups, n_groups):
+    # Records per group and bin for every sketch, as an (n_groups,
+    # len(SKETCH_COLUMNS)) array; groups is each record's group number
+    counts = []
+    for name, edges in SKETCHES.items():
+        # Undefined values are counted in a spare last bin, then dropped
+        n_bins = len(edges) - 1
+        bins = record_bins(rows, name)
+        bins[bins < 0] = n_bins
+        counted = np.bincount(groups * (n_bins + 1) + bins, minlength=n_groups * (n_bins + 1))
+        counts.append(counted.reshape(n_groups, n_bins + 1)[:, :n_bins])
+    return np.hstack(counts)
+
+
+def quantiles(counts, edges, qs):
+    # Quantiles qs of every row of histogram counts, as a (rows, len(qs))
+    # array; NaN for an empty histogram
+    counts = np.asarray(counts, dtype=np.float64).reshape(-1, len(edges) - 1)
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1]
+    rows = np.arange(len(counts))
+    result = np.full((len(counts), len(qs)), np.nan)
+    for j, q in enumerate(qs):
+        target = q * total
+        # First bin whose cumulative count reaches the target, skipping
+        # empty bins (for q = 0)
+        reached = (cumulative >= target[:, None]) & (counts > 0)
+        bins = reached.argmax(axis=1)
+        below = cumulative[rows, bins] - counts[rows, bins]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = (target - below) / counts[rows, bins]
+        result[:, j] = np.where(total > 0, edges[bins] + fraction * (edges[bins + 1] - edges[bins]), np.nan)
+    return result
+
+
+def with_quantiles(sums, names, qs):
+    # Summed sketch columns per group (a DataFrame) -> the named values'
+    # quantiles, as columns like 'helmet_compliance_rate_p50'
+    columns = {}
+    for name in names:
+        values = quantiles(sums[sketch_columns([name])].to_numpy(), SKETCHES[name], qs)
+        for j, q in enumerate(qs):
+            columns[f"{name}_p{round(q * 100)}"] = values[:, j]
+    return pd.DataFrame(columns, index=sums.index)
@@ -0,0 +1,80 @@
+# snapshot.py
+# Startup snapshot, written by a build step after convert_data.py:
+#     python snapshot.py
+# It holds what a starting instance would otherwise compute before it can
+# serve its first page: the hourly aggregate cells of every site (see
+# aggregates.py), which take longest to build from a large store, and the
+# outputs of the default view (All Time, all sites, hour axes), which
+# app.py embeds in the initial layout instead of running the initial
+# callback. A snapshot is only used for the data it was made from (same
+# data source id and row count) and in this version's layout; anything else
+# is computed as before.
+import functools
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_PATH = os.environ.get('DASHBOARD_SNAPSHOT_PATH', os.path.join(os.path.dirname(__file__), 'snapshot.json'))
+# Bumped whenever the cube cells or the default view change shape or
+# encoding
+SNAPSHOT_VERSION = 3
+
+
+def cells_to_json(cells):
+    # AggregateCube cells -> JSON-safe dict, dtypes included
+    return {
+        'bucket': cells.index.asi8.tolist(),
+        'dtypes': {column: str(dtype) for column, dtype in cells.dtypes.items()},
+        'columns': {column: cells[column].tolist() for column in cells.columns}
+    }
+
+
+def cells_from_json(data):
+    index = pd.DatetimeIndex(np.asarray(data['bucket'], dtype=np.int64).astype('datetime64[ns]'), name='bucket')
+    return pd.DataFrame({column: pd.Series(values, index=index).astype(data['dtypes'][column])
+                         for column, values in data['columns'].items()})
+
+
+@functools.lru_cache(maxsize=4)
+def load_snapshot(source_id, rows, path=SNAPSHOT_PATH):
+    # The snapshot for this data source, or None
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('source_id') != source_id
+            or snapshot.get('rows') != rows):
+        return None
+    return snapshot
+
+
+def snapshot_cells(source_id, rows, path=SNAPSHOT_PATH):
+    # {site: aggregate cells} from the snapshot, or None
+    snapshot = load_snapshot(source_id, rows, path)
+    if snapshot is None or snapshot.get('cells') is None:
+        return None
+    return {int(site): cells_from_json(cells) for site, cells in snapshot['cells'].items()}
+
+
+def write_snapshot(snapshot, path=SNAPSHOT_PATH):
+    # Written under a temporary name, so a starting instance never reads a
+    # partial file
+    from plotly.io.json import to_json_plotly
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(to_json_plotly({**snapshot, 'version': SNAPSHOT_VERSION}))
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    # The app loads (and renders) everything the snapshot replaces
+    os.environ['DASHBOARD_SNAPSHOT_PATH'] = os.devnull
+    import app
+
+    write_snapshot(app.make_snapshot(), SNAPSHOT_PATH)
+    print(f"Wrote startup snapshot for {len(app.detections):,} rows to {SNAPSHOT_PATH}", file=sys.stderr)
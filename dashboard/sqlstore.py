@@ -0,0 +1,443 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from aggregates import SUM_COLUMNS, bucket_bound
+from ingest import LOG_PATH, POLL_SECONDS, DetectionLogTailer
+from sites import ALL_SITES, DEFAULT_SITE
+from sketches import SKETCH_COLUMNS, sketch_counts
+from store import CATEGORY_COLUMNS, COUNT_COLUMNS, SITE_COLUMN
+
+# Detections in an SQLite database file, for histories too long to hold in
+# worker memory. Filters and aggregates are pushed down to the database, so
+# only small result sets reach Python:
+# - `detections` holds the records, indexed by timestamp and by (site,
+#   timestamp) for range filters
+# - `hourly` is a rollup with the summed counts per site and hour, kept up
+#   to date on every insert. It answers the hour/day-of-week and daily
+#   groupings and the whole-hour part of any range total; only the partial
+#   hours at the edges of a range are summed from `detections`. It also
+#   holds the bin counts of the quantile sketches (sketches.py).
+# Queries match SitePartitions (sites.py) and are selected with
+# DETECTION_BACKEND=sqlite (see queries.py).
+DB_PATH = os.environ.get('DETECTION_DB_PATH', os.path.join(os.path.dirname(__file__), 'data.sqlite'))
+INSERT_CHUNKSIZE = 100_000
+
+HOUR_NS = 3600 * 10 ** 9
+DAY_NS = 24 * HOUR_NS
+AXIS_COLUMNS = ['hour', 'day_of_week']
+RECORD_COLUMNS = ['timestamp', SITE_COLUMN, 'camera_id'] + COUNT_COLUMNS + ['time_window', 'hour', 'day_of_week']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS detections (
+    timestamp INTEGER NOT NULL,
+    site_id INTEGER NOT NULL,
+    camera_id INTEGER,
+    {', '.join(f'{column} INTEGER NOT NULL' for column in COUNT_COLUMNS)},
+    time_window TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    day_of_week TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_timestamp ON detections (timestamp);
+CREATE INDEX IF NOT EXISTS detections_site_timestamp ON detections (site_id, timestamp);
+CREATE TABLE IF NOT EXISTS hourly (
+    site_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    day_of_week TEXT NOT NULL,
+    {', '.join(f'{column} INTEGER NOT NULL' for column in COUNT_COLUMNS)},
+    records INTEGER NOT NULL,
+    {', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in SKETCH_COLUMNS)},
+    PRIMARY KEY (site_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS hourly_bucket ON hourly (bucket);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# Rollup upsert: a bucket that already exists has the new counts added
+HOURLY_UPSERT = f"""
+INSERT INTO hourly (site_id, bucket, hour, day_of_week, {', '.join(COUNT_COLUMNS + ['records'] + SKETCH_COLUMNS)})
+VALUES ({', '.join('?' * (len(COUNT_COLUMNS) + len(SKETCH_COLUMNS) + 5))})
+ON CONFLICT (site_id, bucket) DO UPDATE SET
+{', '.join(f'{column} = {column} + excluded.{column}' for column in COUNT_COLUMNS + ['records'] + SKETCH_COLUMNS)}
+"""
+
+
+def ns(timestamp):
+    return pd.Timestamp(timestamp).value
+
+
+def hourly_sql(column):
+    # Column of the hourly table behind a SUM_COLUMNS name
+    return 'records' if column == 'rows' else column
+
+
+def record_rows(df):
+    # DataFrame in the data.csv layout -> rows for the detections table
+    n = len(df)
+    columns = {
+        'timestamp': df['timestamp'].to_numpy('datetime64[ns]').astype(np.int64).tolist(),
+        SITE_COLUMN: df[SITE_COLUMN].tolist() if SITE_COLUMN in df else [DEFAULT_SITE] * n,
+        'camera_id': df['camera_id'].tolist() if 'camera_id' in df else [None] * n,
+        **{column: df[column].astype(np.int64).tolist() for column in COUNT_COLUMNS + ['hour']},
+        **{column: df[column].astype(str).tolist() for column in CATEGORY_COLUMNS}
+    }
+    return list(zip(*(columns[column] for column in RECORD_COLUMNS)))
+
+
+def hourly_cells(df):
+    # DataFrame -> summed counts and sketch bins per site and hour
+    timestamps = df['timestamp'].to_numpy('datetime64[ns]').astype(np.int64)
+    cells = pd.DataFrame({
+        SITE_COLUMN: df[SITE_COLUMN].to_numpy() if SITE_COLUMN in df else DEFAULT_SITE,
+        'bucket': timestamps - timestamps % HOUR_NS,
+        'hour': df['hour'].to_numpy(),
+        'day_of_week': df['day_of_week'].astype(str).to_numpy(),
+        **{column: df[column].to_numpy() for column in COUNT_COLUMNS},
+        'records': 1
+    })
+    grouped = cells.groupby([SITE_COLUMN, 'bucket'], sort=False)
+    cells = grouped.agg(
+        {'hour': 'first', 'day_of_week': 'first', **{column: 'sum' for column in COUNT_COLUMNS + ['records']}}
+    ).reset_index()
+    sketches = sketch_counts(df, grouped.ngroup().to_numpy(), len(cells))
+    return pd.concat([cells, pd.DataFrame(sketches, columns=SKETCH_COLUMNS)], axis=1)
+
+
+def hourly_rows(df):
+    # DataFrame -> summed rows for the hourly upsert
+    cells = hourly_cells(df)
+    return [tuple(int(value) if isinstance(value, (np.integer, int)) else value for value in row)
+            for row in cells.itertuples(index=False)]
+
+
+def insert_records(connection, df):
+    connection.executemany(
+        f"INSERT INTO detections ({', '.join(RECORD_COLUMNS)}) VALUES ({', '.join('?' * len(RECORD_COLUMNS))})",
+        record_rows(df)
+    )
+    connection.executemany(HOURLY_UPSERT, hourly_rows(df))
+
+
+def build_database(path, chunks):
+    # Write the DataFrames in chunks to a new database at path; returns the
+    # row count. Built under a temporary name, so readers never see a
+    # partial database.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript(SCHEMA)
+        rows = 0
+        for chunk in chunks:
+            with connection:
+                insert_records(connection, chunk)
+            rows += len(chunk)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('created', ?)", (str(time.time_ns()),))
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return rows
+
+
+def frame_chunks(df, chunksize=INSERT_CHUNKSIZE):
+    for first in range(0, len(df), chunksize):
+        yield df.iloc[first:first + chunksize]
+
+
+class SQLiteDetections:
+    # Query interface of SitePartitions over a database built by
+    # build_database()
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        # Identifies this database (rebuilding it gives a new id), for
+        # keying cached results
+        created = self._query_one("SELECT value FROM meta WHERE key = 'created'")[0]
+        self.source_id = f"{os.path.abspath(path)}:{created}"
+        self._add_sketches()
+
+    @classmethod
+    def open(cls, path=DB_PATH, load=None):
+        # Open the database, first building it from load() (a DataFrame) if
+        # it does not exist yet
+        if not os.path.exists(path):
+            build_database(path, frame_chunks(load()))
+        return cls(path)
+
+    def _add_sketches(self):
+        # A database built before the rollup held (these) sketch bins gets
+        # the columns added and counted from the records, once
+        def missing():
+            present = {row[1] for row in self._query("PRAGMA table_info(hourly)")}
+            return [column for column in SKETCH_COLUMNS if column not in present]
+
+        if not missing():
+            return
+        with self.transaction() as connection:
+            for column in missing():
+                connection.execute(f"ALTER TABLE hourly ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            connection.execute(f"UPDATE hourly SET {', '.join(f'{column} = 0' for column in SKETCH_COLUMNS)}")
+            update = (f"UPDATE hourly SET {', '.join(f'{column} = {column} + ?' for column in SKETCH_COLUMNS)} "
+                      f"WHERE site_id = ? AND bucket = ?")
+            records = pd.read_sql_query(
+                f"SELECT timestamp, site_id, hour, day_of_week, {', '.join(COUNT_COLUMNS)} FROM detections",
+                connection, chunksize=INSERT_CHUNKSIZE
+            )
+            for chunk in records:
+                chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+                cells = hourly_cells(chunk)
+                connection.executemany(update, cells[SKETCH_COLUMNS + [SITE_COLUMN, 'bucket']].to_numpy(np.int64).tolist())
+
+    @property
+    def connection(self):
+        # One connection per thread; a forked process opens its own
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Write transaction; nested uses are savepoints in the outer one, so
+        # a failed one is undone without ending it
+        connection = self.connection
+        if connection.in_transaction:
+            connection.execute("SAVEPOINT nested")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK TO nested")
+                connection.execute("RELEASE nested")
+                raise
+            connection.execute("RELEASE nested")
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        return self.connection.execute(sql, params).fetchall()
+
+    def _query_one(self, sql, params=()):
+        return self.connection.execute(sql, params).fetchone()
+
+    @property
+    def sites(self):
+        return [site for site, in self._query("SELECT DISTINCT site_id FROM hourly ORDER BY site_id")]
+
+    def __len__(self):
+        # Records are never deleted, so the last rowid is the record count
+        return self._query_one("SELECT COALESCE(MAX(rowid), 0) FROM detections")[0]
+
+    @property
+    def rebuilds(self):
+        # Late records never shift anything in the database
+        return 0
+
+    @property
+    def max_timestamp(self):
+        latest = self._query_one("SELECT MAX(timestamp) FROM detections")[0]
+        return pd.Timestamp(latest) if latest is not None else None
+
+    def append(self, rows):
+        with self.transaction() as connection:
+            insert_records(connection, rows)
+        return rows
+
+    def log_offset(self, path):
+        row = self._query_one("SELECT value FROM meta WHERE key = ?", (f"log_offset:{path}",))
+        return int(row[0]) if row else 0
+
+    def set_log_offset(self, path, offset):
+        with self.transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (f"log_offset:{path}", str(offset)))
+
+    # Predicates
+
+    def _raw_where(self, first=None, last=None, site=ALL_SITES):
+        # detections rows with first <= timestamp < last (nanoseconds)
+        clauses, params = [], []
+        if site != ALL_SITES:
+            clauses.append("site_id = ?")
+            params.append(site)
+        if first is not None:
+            clauses.append("timestamp >= ?")
+            params.append(first)
+        if last is not None:
+            clauses.append("timestamp < ?")
+            params.append(last)
+        return ' AND '.join(clauses) or '1', params
+
+    def _bucket_where(self, first=None, last=None, site=ALL_SITES):
+        # hourly rows with first <= bucket < last
+        clauses, params = [], []
+        if site != ALL_SITES:
+            clauses.append("site_id = ?")
+            params.append(site)
+        if first is not None:
+            clauses.append("bucket >= ?")
+            params.append(first)
+        if last is not None:
+            clauses.append("bucket < ?")
+            params.append(last)
+        return ' AND '.join(clauses) or '1', params
+
+    # Queries (bounds inclusive, None leaves a side open, as in SitePartitions)
+
+    def _range_totals(self, first, last, site):
+        # Totals over first <= timestamp < last: whole hours from the rollup,
+        # the partial hours at either edge from the records
+        columns = ', '.join(f"COALESCE(SUM({column}), 0)" for column in COUNT_COLUMNS)
+        whole_first = None if first is None else -(-first // HOUR_NS) * HOUR_NS
+        whole_last = None if last is None else last - last % HOUR_NS
+        if whole_first is not None and whole_last is not None and whole_first >= whole_last:
+            spans, raw = [], [(first, last)]
+        else:
+            spans = [(whole_first, whole_last)]
+            raw = ([(first, whole_first)] if first is not None else []) + ([(whole_last, last)] if last is not None else [])
+
+        sums = np.zeros(len(COUNT_COLUMNS) + 1)
+        for span_first, span_last in spans:
+            where, params = self._bucket_where(span_first, span_last, site)
+            sums += self._query_one(f"SELECT {columns}, COALESCE(SUM(records), 0) FROM hourly WHERE {where}", params)
+        for span_first, span_last in raw:
+            where, params = self._raw_where(span_first, span_last, site)
+            sums += self._query_one(f"SELECT {columns}, COUNT(*) FROM detections WHERE {where}", params)
+        totals = dict(zip(COUNT_COLUMNS, sums.tolist()))
+        totals['rows'] = int(sums[-1])
+        return totals
+
+    def totals(self, start=None, end=None, site=ALL_SITES):
+        return self._range_totals(None if start is None else ns(start), None if end is None else ns(end) + 1, site)
+
+    def period_totals(self, start=None, end=None, site=ALL_SITES):
+        # [start, end] (as totals()) and [start - length, start), as in
+        # SitePartition
+        current = self.totals(start, end, site)
+        if start is None:
+            return current, None
+        start = pd.Timestamp(start)
+        length = (self.max_timestamp if end is None else pd.Timestamp(end)) - start
+        return current, self._range_totals(ns(start - length), ns(start), site)
+
+    def _grouped_sums(self, key, start, end, columns, site):
+        # Rollup cells whose whole hour lies inside [start, end] (both edges
+        # rounded inwards, as AggregateCube.window() does) summed per key
+        first = None if start is None else -(-ns(start) // HOUR_NS) * HOUR_NS
+        where, params = self._bucket_where(first, None if end is None else ns(bucket_bound(end)), site)
+        sums = ', '.join(f"SUM({hourly_sql(column)})" for column in columns)
+        rows = self._query(f"SELECT {key} AS grouped, {sums} FROM hourly WHERE {where} "
+                           f"GROUP BY grouped ORDER BY grouped", params)
+        index = [row[0] for row in rows]
+        return pd.DataFrame([row[1:] for row in rows], index=index, columns=list(columns), dtype='int64')
+
+    def axis_sums(self, column, start=None, end=None, columns=SUM_COLUMNS, site=ALL_SITES):
+        if column not in AXIS_COLUMNS:
+            raise ValueError(f"Unknown axis column: {column}")
+        grouped = self._grouped_sums(column, start, end, columns, site)
+        grouped.index.name = column
+        return grouped
+
+    def daily_sums(self, start=None, end=None, columns=SUM_COLUMNS, site=ALL_SITES):
+        grouped = self._grouped_sums(f"bucket - bucket % {DAY_NS}", start, end, columns, site)
+        grouped.index = pd.to_datetime(np.asarray(grouped.index, dtype=np.int64)).rename('date')
+        return grouped
+
+    def window(self, start=None, end=None, site=ALL_SITES):
+        # Records in [start, end], in (site, timestamp) order like the
+        # concatenated partitions
+        where, params = self._raw_where(None if start is None else ns(start), None if end is None else ns(end) + 1, site)
+        rows = self._query(f"SELECT {', '.join(RECORD_COLUMNS)} FROM detections WHERE {where} "
+                           f"ORDER BY site_id, timestamp", params)
+        df = pd.DataFrame(rows, columns=RECORD_COLUMNS)
+        df['timestamp'] = pd.to_datetime(df['timestamp'].astype(np.int64))
+        if df['camera_id'].isna().all():
+            df = df.drop(columns='camera_id')
+        return df
+
+    def series(self, start=None, end=None, columns=(), site=ALL_SITES, max_points=None):
+        # [(timestamps, values)] per column, values summed per timestamp.
+        # Windows with more than max_points records are reduced in the
+        # database to each column's minimum and maximum in max_points / 2
+        # equal time buckets, at the timestamps where they occur, plus the
+        # first and last point (as downsample.minmax_indices() picks them),
+        # for the caller's downsampling to pick from.
+        where, params = self._raw_where(None if start is None else ns(start), None if end is None else ns(end) + 1, site)
+        sums = ', '.join(f"SUM({column}) AS v{i}" for i, column in enumerate(columns))
+        points = f"SELECT timestamp, {sums} FROM detections WHERE {where} GROUP BY timestamp"
+
+        if max_points is None or self._query_one(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM detections WHERE {where} LIMIT ?)",
+                params + [max_points + 1])[0] <= max_points:
+            rows = np.array(self._query(f"{points} ORDER BY timestamp", params), dtype=np.int64).reshape(-1, len(columns) + 1)
+            timestamps = rows[:, 0].astype('datetime64[ns]')
+            return [(timestamps, rows[:, i + 1]) for i in range(len(columns))]
+
+        low, high = self._query_one(f"SELECT MIN(timestamp), MAX(timestamp) FROM detections WHERE {where}", params)
+        width = max(1, -(-(high - low + 1) // max(1, max_points // 2)))
+        # With a single MIN() or MAX() in a query, SQLite takes the bare
+        # timestamp from the row holding it, so each column's minimum and
+        # maximum is its own query over the bucketed points (computed once)
+        extremes = ' UNION ALL '.join(f"SELECT {i}, timestamp, {func}(v{i}) FROM buckets GROUP BY bucket"
+                                      for i in range(len(columns)) for func in ('MIN', 'MAX'))
+        rows = np.array(self._query(
+            f"WITH buckets AS (SELECT (timestamp - ?) / ? AS bucket, * FROM ({points})) {extremes}",
+            [low, width] + params
+        ), dtype=np.int64).reshape(-1, 3)
+        ends = np.array(self._query(
+            f"SELECT timestamp, {sums} FROM detections WHERE {where} AND timestamp IN (?, ?) GROUP BY timestamp",
+            params + [low, high]
+        ), dtype=np.int64).reshape(-1, len(columns) + 1)
+
+        series = []
+        for i in range(len(columns)):
+            picked = rows[rows[:, 0] == i, 1:]
+            picked = np.concatenate([picked, ends[:, [0, i + 1]]])
+            # In time order, once per timestamp (a bucket's minimum and
+            # maximum can be the same point)
+            timestamps, first = np.unique(picked[:, 0], return_index=True)
+            series.append((timestamps.astype('datetime64[ns]'), picked[first, 1]))
+        return series
+
+    def appended_rows(self, first, last):
+        # Live charts are re-rendered rather than extended
+        return None
+
+
+class SQLiteLogTailer(DetectionLogTailer):
+    # Every worker follows the detection log, but they share one database:
+    # the log offset is kept in the database and advanced in the same
+    # transaction as the insert, so each record is inserted exactly once
+
+    def __init__(self, detections, on_records, path=LOG_PATH, interval=POLL_SECONDS):
+        super().__init__(on_records, path, interval)
+        self.detections = detections
+
+    def poll(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size == self.detections.log_offset(self.path):
+            return 0
+        with self.detections.transaction():
+            self.offset = self.detections.log_offset(self.path)
+            count = super().poll()
+            self.detections.set_log_offset(self.path, self.offset)
+        return count
@@ -0,0 +1,327 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Columnar on-disk layout written by convert_data.py: one .npy file per
+# block, memory-mapped on load so only the pages a query touches are read
+COUNT_COLUMNS = ['helmet_compliance', 'total_detections', 'child_passengers',
+                 'no_mirror', 'left_mirror', 'right_mirror', 'both_mirrors']
+CATEGORY_COLUMNS = ['time_window', 'day_of_week']
+# Optional integer columns, stored only when the data has them
+EXTRA_COLUMNS = ['site_id', 'camera_id']
+# Data with several sites is stored sorted by (site, timestamp), so that each
+# site's records are one contiguous slice
+SITE_COLUMN = 'site_id'
+BLOCKS = ['timestamp', 'counts', 'time_window', 'hour', 'day_of_week']
+META_FILE = 'meta.json'
+
+COUNT_DTYPE = np.int16
+HOUR_DTYPE = np.int8
+CODE_DTYPE = np.int8
+EXTRA_DTYPE = np.int32
+
+# Rows per prefix-sum checkpoint. A window total reads two checkpoints plus
+# at most two partial blocks of rows, so its cost does not depend on the
+# window length, while the checkpoints take 1/PREFIX_BLOCK of the memory of
+# a per-row running sum.
+PREFIX_BLOCK = 256
+
+
+def check_range(column, values, dtype):
+    # Narrow dtypes are only safe if every value fits
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f"Column '{column}' does not fit in {np.dtype(dtype).name}")
+
+
+def compact_dtypes(df):
+    # Narrow integer counts and lexically ordered categoricals for the string
+    # columns (lexical order keeps groupby output the same as for strings)
+    df = df.copy()
+    for column in COUNT_COLUMNS:
+        check_range(column, df[column], COUNT_DTYPE)
+        df[column] = df[column].astype(COUNT_DTYPE)
+    check_range('hour', df['hour'], HOUR_DTYPE)
+    df['hour'] = df['hour'].astype(HOUR_DTYPE)
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].astype(pd.CategoricalDtype(sorted(df[column].unique())))
+    for column in EXTRA_COLUMNS:
+        if column in df:
+            check_range(column, df[column], EXTRA_DTYPE)
+            df[column] = df[column].astype(EXTRA_DTYPE)
+    return df
+
+
+def is_sorted_by_site(sites, timestamps):
+    # True if rows are ordered by site, then by timestamp within each site
+    site_steps = np.diff(sites)
+    return bool(((site_steps > 0) | ((site_steps == 0) & (np.diff(timestamps) >= np.timedelta64(0)))).all())
+
+
+def load_columnar(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+
+    rows = meta['rows']
+
+    def block(name):
+        # Plain ndarray view of the map, so pandas never sees np.memmap.
+        # Blocks may be longer than the rows written (see convert_data.py).
+        return np.asarray(np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))[..., :rows]
+
+    frames = []
+    for name in BLOCKS:
+        if name == 'counts':
+            # Stored as (columns, rows) so each column is contiguous on disk
+            frames.append(pd.DataFrame(block(name).T, columns=meta['count_columns'], copy=False))
+        elif name in CATEGORY_COLUMNS:
+            values = pd.Categorical.from_codes(block(name), categories=meta['categories'][name], validate=False)
+            frames.append(pd.DataFrame({name: values}, copy=False))
+        else:
+            frames.append(pd.DataFrame({name: block(name)}, copy=False))
+    for name in meta.get('extra_columns', []):
+        frames.append(pd.DataFrame({name: block(name)}, copy=False))
+    # Concatenating single-block frames keeps the memory maps shared
+    return pd.concat(frames, axis=1, copy=False)
+
+
+def load_detections(store_path, csv_path):
+    # Prefer the converted columnar store; fall back to parsing the CSV
+    if os.path.exists(os.path.join(store_path, META_FILE)):
+        return load_columnar(store_path)
+    return compact_dtypes(pd.read_csv(csv_path, parse_dates=["timestamp"]))
+
+
+def data_source_id(store_path, csv_path):
+    # Identifies the file load_detections() reads, changing whenever it is
+    # rewritten, so results cached against an older dataset are not reused
+    path = os.path.join(store_path, META_FILE)
+    if not os.path.exists(path):
+        path = csv_path
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class DetectionStore:
+    # Detection records kept sorted by timestamp, so any time window can be
+    # located with two binary searches and returned as a row slice (a view,
+    # not a filtered copy)
+
+    def __init__(self, df, sum_columns=()):
+        if not df['timestamp'].is_monotonic_increasing:
+            df = df.sort_values('timestamp', kind='stable', ignore_index=True)
+        # Columns whose totals over any row range are answered by totals()
+        self.sum_columns = list(sum_columns)
+        self._prefix = PrefixSums(df, self.sum_columns)
+        # Growable per-column buffers, created on the first append
+        self._buffers = None
+        self._lock = threading.Lock()
+        # Bumped on every append so caches can tell the data has changed
+        self.version = 0
+        # Bumped when late records force a re-sort, which shifts row positions
+        self.rebuilds = 0
+        self._publish(df)
+
+    def _publish(self, df):
+        # Readers take (df, timestamps, totals) together, so swap them as one object
+        timestamps = df['timestamp'].to_numpy()
+        max_timestamp = pd.Timestamp(timestamps[-1]) if len(timestamps) else None
+        self._view = (df, timestamps, max_timestamp, self._prefix.snapshot(df))
+
+    @property
+    def df(self):
+        return self._view[0]
+
+    @property
+    def timestamps(self):
+        return self._view[1]
+
+    @property
+    def max_timestamp(self):
+        return self._view[2]
+
+    def __len__(self):
+        return len(self.df)
+
+    def locate(self, start=None, end=None, timestamps=None):
+        # Row positions [first, last) of records with start <= timestamp <= end
+        if timestamps is None:
+            timestamps = self.timestamps
+        first = 0 if start is None else np.searchsorted(timestamps, np.datetime64(pd.Timestamp(start)), side='left')
+        last = len(timestamps) if end is None else np.searchsorted(timestamps, np.datetime64(pd.Timestamp(end)), side='right')
+        return int(first), int(max(first, last))
+
+    def slice(self, start=None, end=None):
+        df, timestamps, _, _ = self._view
+        first, last = self.locate(start, end, timestamps)
+        return df.iloc[first:last]
+
+    def totals(self, first, last):
+        # Totals of sum_columns over row positions [first, last), in order
+        checkpoints, values = self._view[3]
+        lo, hi = -(-first // PREFIX_BLOCK), last // PREFIX_BLOCK
+        if lo >= hi:
+            # Fewer than two blocks: sum the rows directly
+            return np.array([column[first:last].sum(dtype=np.float64) for column in values])
+        edges = np.array([column[first:lo * PREFIX_BLOCK].sum(dtype=np.float64)
+                          + column[hi * PREFIX_BLOCK:last].sum(dtype=np.float64) for column in values])
+        return checkpoints[hi] - checkpoints[lo] + edges
+
+    def conform(self, rows):
+        # New records in the store's columns and dtypes, sorted by timestamp.
+        # Raises ValueError for records the store cannot hold (missing
+        # values, tz-aware timestamps, counts that do not fit).
+        df = self.df
+        missing = [column for column in df.columns if column not in rows]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        columns = {}
+        for column in df.columns:
+            values, dtype = rows[column], df[column].dtype
+            if values.isna().any():
+                raise ValueError(f"Column '{column}' has missing values")
+            if isinstance(dtype, pd.CategoricalDtype):
+                # New values extend the categories, as in ColumnBuffers
+                new = set(values) - set(dtype.categories)
+                if new:
+                    dtype = pd.CategoricalDtype(sorted(set(dtype.categories) | new))
+            elif column == 'timestamp' and getattr(values.dtype, 'tz', None) is not None:
+                raise ValueError("Column 'timestamp' must not have a time zone")
+            elif dtype.kind in 'iu':
+                check_range(column, values, dtype)
+            columns[column] = values.astype(dtype)
+        return pd.DataFrame(columns).sort_values('timestamp', kind='stable', ignore_index=True)
+
+    def append(self, rows):
+        # Add new records and return them as stored (with the store's dtypes).
+        # In-order records are written into spare buffer capacity, so an
+        # append costs O(len(rows)) amortized; rows already handed out as
+        # views are never modified.
+        if len(rows) == 0:
+            return rows
+        with self._lock:
+            # Everything that can reject the records runs before the
+            # buffers change, so a bad batch leaves no trace
+            rows = self.conform(rows)
+            df = self.df
+            first = len(df)
+            late = first and rows['timestamp'].iloc[0] < df['timestamp'].iloc[-1]
+            if self._buffers is None:
+                self._buffers = ColumnBuffers(df, extra=len(rows))
+            merged = self._buffers.extend(rows)
+            appended = merged.iloc[first:]
+            if late:
+                # Late records: rebuild in timestamp order (rare)
+                merged = merged.sort_values('timestamp', kind='stable', ignore_index=True)
+                self._buffers = None
+                self._prefix = PrefixSums(merged, self.sum_columns)
+                self.rebuilds += 1
+            else:
+                self._prefix.extend(merged)
+            self._publish(merged)
+            self.version += 1
+        return appended
+
+
+class PrefixSums:
+    # Running totals of some columns at every PREFIX_BLOCK-th row, starting
+    # with a row of zeros: rows [0, i * PREFIX_BLOCK) sum to checkpoints[i]
+
+    def __init__(self, df, columns):
+        self.columns = columns
+        self.blocks = 0
+        self.checkpoints = np.zeros((1024, len(columns)))
+        self.extend(df)
+
+    def extend(self, df):
+        # Add checkpoints for the complete blocks of df not covered yet (df
+        # is the whole frame, of which earlier calls saw a prefix)
+        blocks = len(df) // PREFIX_BLOCK
+        if blocks <= self.blocks or not self.columns:
+            return
+        if blocks + 1 > len(self.checkpoints):
+            grown = np.zeros((max(blocks + 1, 2 * len(self.checkpoints)), len(self.columns)))
+            grown[:self.blocks + 1] = self.checkpoints[:self.blocks + 1]
+            self.checkpoints = grown
+        rows = slice(self.blocks * PREFIX_BLOCK, blocks * PREFIX_BLOCK)
+        sums = np.column_stack([
+            df[column].to_numpy()[rows].reshape(-1, PREFIX_BLOCK).sum(axis=1, dtype=np.float64)
+            for column in self.columns
+        ])
+        self.checkpoints[self.blocks + 1:blocks + 1] = self.checkpoints[self.blocks] + np.cumsum(sums, axis=0)
+        self.blocks = blocks
+
+    def snapshot(self, df):
+        # (checkpoints, column arrays) for df; later extends only write past
+        # the end of the checkpoints handed out here
+        return self.checkpoints[:self.blocks + 1], [df[column].to_numpy() for column in self.columns]
+
+
+class ColumnBuffers:
+    # Per-column arrays with spare capacity (doubling when full). The live
+    # frame is rebuilt as zero-copy views over the filled part of each array.
+
+    def __init__(self, df, extra=0):
+        self.columns = list(df.columns)
+        self.size = len(df)
+        capacity = max(2 * self.size, self.size + extra, 1024)
+        self.arrays = {}
+        self.categories = {}
+        for column in self.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                self.categories[column] = values.cat.categories
+                values = values.cat.codes
+            array = np.empty(capacity, dtype=values.dtype)
+            array[:self.size] = values.to_numpy()
+            self.arrays[column] = array
+
+    def _reserve(self, size):
+        capacity = len(next(iter(self.arrays.values())))
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for column, array in self.arrays.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[column] = grown
+
+    def _codes(self, column, values):
+        categories = self.categories[column]
+        codes = pd.Categorical(values, categories=categories).codes
+        if (codes >= 0).all():
+            return codes
+        # New categories: re-number into a fresh buffer (existing views keep
+        # the old codes and categories)
+        merged = pd.Index(sorted(set(categories) | set(values.dropna())))
+        old = self.arrays[column]
+        dtype = np.int8 if len(merged) <= np.iinfo(np.int8).max else np.int16
+        remap = merged.get_indexer(categories).astype(dtype)
+        array = np.empty(len(old), dtype=dtype)
+        array[:self.size] = remap[old[:self.size]]
+        self.arrays[column] = array
+        self.categories[column] = merged
+        return pd.Categorical(values, categories=merged).codes
+
+    def extend(self, rows):
+        end = self.size + len(rows)
+        self._reserve(end)
+        for column in self.columns:
+            values = rows[column]
+            if column in self.categories:
+                values = self._codes(column, values.astype(object))
+            self.arrays[column][self.size:end] = np.asarray(values)
+        self.size = end
+        return self.frame()
+
+    def frame(self):
+        frames = []
+        for column in self.columns:
+            values = self.arrays[column][:self.size]
+            if column in self.categories:
+                values = pd.Categorical.from_codes(values, categories=self.categories[column], validate=False)
+            frames.append(pd.DataFrame({column: values}, copy=False))
+        return pd.concat(frames, axis=1, copy=False)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# The dashboard modules are imported flat, as app.py imports them
+DASHBOARD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DASHBOARD_DIR)
+
+from create_dummy_data import generate_chunks  # noqa: E402
+from queries import prepare_partitions  # noqa: E402
+from sqlstore import SQLiteDetections, build_database, frame_chunks  # noqa: E402
+from store import compact_dtypes  # noqa: E402
+
+
+def load_csv():
+    return compact_dtypes(pd.read_csv(os.path.join(DASHBOARD_DIR, 'data.csv'), parse_dates=['timestamp']))
+
+
+def multi_site_frame():
+    # A few days of records from several sites and cameras, at an interval
+    # that does not line up with the hour, in the dtypes the app loads
+    return compact_dtypes(pd.concat(list(generate_chunks(6000, freq='7min', cameras=2, sites=3)), ignore_index=True))
+
+
+def open_backends(df, tmp_path):
+    # The same records in the in-memory and the SQLite backend
+    path = str(tmp_path / 'detections.sqlite')
+    build_database(path, frame_chunks(df.copy(), 1000))
+    return {'memory': prepare_partitions(df.copy()), 'sqlite': SQLiteDetections(path)}
+
+
+@pytest.fixture(scope='module')
+def csv_backends(tmp_path_factory):
+    return open_backends(load_csv(), tmp_path_factory.mktemp('csv'))
+
+
+@pytest.fixture(scope='module')
+def multi_site_backends(tmp_path_factory):
+    return open_backends(multi_site_frame(), tmp_path_factory.mktemp('sites'))
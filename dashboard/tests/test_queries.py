@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+from queries import get_kpis, get_time_range_bounds, get_totals, get_trend_data
+
+
+def time_ranges(detections):
+    latest = detections.max_timestamp
+    custom = {'start': str(latest - pd.Timedelta('2d3h17min')), 'end': str(latest - pd.Timedelta('1d5h41min'))}
+    return ['24h', 'week', 'all', custom]
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+@pytest.mark.parametrize('data', ['csv_backends', 'multi_site_backends'])
+def test_kpis_cover_the_same_window_as_totals(request, data, backend):
+    detections = request.getfixturevalue(data)[backend]
+    for site in ['all'] + list(detections.sites):
+        for time_range in time_ranges(detections):
+            totals = get_totals(detections, time_range, site)
+            kpis = get_kpis(detections, time_range, site)
+            assert kpis['total_detections'] == int(round(totals['total_detections']))
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_previous_period_is_as_long_and_ends_at_start(csv_backends, backend):
+    # Hourly records: 24h is [latest - 24h, latest] (25 records), the
+    # previous period [latest - 48h, latest - 24h) (24 records)
+    detections = csv_backends[backend]
+    start, end = get_time_range_bounds('24h', detections.max_timestamp)
+    current, previous = detections.period_totals(start, end)
+    window = detections.window(start - pd.Timedelta('24h'), start)
+    before = window[window['timestamp'] < start]
+    assert current['rows'] == len(detections.window(start, end))
+    assert previous['rows'] == len(before) == 24
+    assert previous['total_detections'] == before['total_detections'].sum()
+
+
+@pytest.mark.parametrize('trend_axis', ['hours', 'days'])
+def test_axis_sums_agree_between_backends(multi_site_backends, trend_axis):
+    # Only hours and days that hold records are returned, by either backend
+    memory, sqlite = multi_site_backends['memory'], multi_site_backends['sqlite']
+    for site in ['all'] + list(memory.sites):
+        for time_range in time_ranges(memory):
+            expected = get_trend_data(sqlite, time_range, trend_axis, site)
+            actual = get_trend_data(memory, time_range, trend_axis, site)
+            assert list(map(str, actual.index)) == list(map(str, expected.index))
+            assert actual['total_detections'].tolist() == expected['total_detections'].tolist()
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+@pytest.mark.parametrize('trend_axis', ['hours', 'days'])
+def test_axis_sums_cover_whole_hours_inside_the_window(multi_site_backends, backend, trend_axis):
+    # A custom window's bars count the records of the hours wholly inside
+    # it, never any after its end
+    detections = multi_site_backends[backend]
+    latest = detections.max_timestamp
+    for start, end in [('2d3h17min', '1d5h41min'), ('2d3h', '1d5h'), ('2d', '1d59min59s')]:
+        start, end = latest - pd.Timedelta(start), latest - pd.Timedelta(end)
+        window = detections.window(start, end)
+        whole = window[(window['timestamp'] >= start.ceil('h'))
+                       & (window['timestamp'] < (end + pd.Timedelta(1, 'ns')).floor('h'))]
+        sums = get_trend_data(detections, {'start': str(start), 'end': str(end)}, trend_axis)
+        assert sums['total_detections'].sum() == whole['total_detections'].sum()
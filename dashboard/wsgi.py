@@ -0,0 +1,7 @@
+# WSGI entry point. Run with
+#     gunicorn wsgi:server
+# from this directory; gunicorn.conf.py (picked up automatically) preloads
+# the data in the master and starts each worker's threads after the fork.
+from app import app
+
+server = app.server